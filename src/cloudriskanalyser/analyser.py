@@ -1,26 +1,61 @@
 #!/usr/bin/python
+import argparse
+import asyncio
+import csv
+import json
 import logging
 import os
 import sys
+import time
 import warnings
 
-from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from functools import partial
+from typing import Any, Awaitable, Callable
 
 # Own modules
+# The backends (langchain, chroma, Google GenAI, nvdlib) are imported when they are first needed, see LLMResearcherRegistry.create_runner()
+from assessment_store import ASSESSMENT_STORE_DB_FILE, AssessmentSnapshot, AssessmentStore, merge_cve_records
+from cassette import CASSETTE_MODE_REPLAY, CASSETTE_MODES, Cassette, get_active_cassette, save_active_cassette, set_active_cassette
+from instrumentation import get_span_percentiles, propagate_context, span, start_trace, trace_collector
+from llm_cache import LLMAnswerCache
 from llm_data import LLMPrompts as prm
-from llm_researcher import DataGatheringMethod, LLMResearcher, LLMResearcherGeminiSearch, LLMResearcherGeminiDirect, LLMResearcherGeminiCVE
+from llm_researcher import CHROMA_PERSIST_DIRECTORY, DataGatheringMethod, LLMResearcher, LLMResearcherRegistry
+from rate_limiter import get_rate_limiter_stats
 from risk_calculator import RiskCalculator, CVEEntry
+from service import SERVICE_DEFAULT_HOST, SERVICE_DEFAULT_MAX_QUEUE, SERVICE_DEFAULT_PORT, AssessmentService, run_service
 
 #################################
 # Global variables
 #################################
 logger = logging.getLogger(__name__)
 
+# Warm research runners, shared by all assessments of this process.
+# The answers are only cached on disk when the command line enables it (see main()), so that library callers always ask the LLM.
+research_runner_registry: LLMResearcherRegistry = LLMResearcherRegistry()
+
 #################################
 # Constants
 #################################
 URL_CVE_MITRE: str = "https://cve.mitre.org/"
 LOG_FORMAT: str = "%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)s - %(funcName)s ] %(message)s"
+BATCH_DEFAULT_MAX_WORKERS: int = 4
+BATCH_DEFAULT_OUTPUT_FILE: str = "batch_results.jsonl"
+# File in the trace directory (--trace-dir), which contains the span percentiles of a batch run
+BATCH_TRACE_SUMMARY_FILE: str = "batch_summary.json"
+# Maximum number of CSPs assessed concurrently on the event loop (--asyncio)
+ASYNC_DEFAULT_MAX_CONCURRENCY: int = 50
+
+# Data-gathering methods, which can ask all likelihood questions of a CSP in one request (batched question mode)
+BATCHED_QUESTION_METHODS: list[DataGatheringMethod] = [DataGatheringMethod.GEMINI_DIRECT]
+
+# Likelihood questions of the batched question mode: name -> (question_google, question_data_extract)
+LIKELIHOOD_QUESTIONS: dict[str, tuple[str, str]] = {
+    "valid_csp": (prm.PROMT_CHECK_CSP_GOOGLE, prm.PROMT_CHECK_CSP_DATA_EXTRACT),
+    "supports_mfa": (prm.PROMT_CHECK_RISK_INSEC_AUTH_1_GOOGLE, prm.PROMT_CHECK_RISK_INSEC_AUTH_1_DATA_EXTRACT),
+    "supports_auth_protocols": (prm.PROMT_CHECK_RISK_INSEC_AUTH_2_GOOGLE, prm.PROMT_CHECK_RISK_INSEC_AUTH_2_DATA_EXTRACT)
+}
 
 
 #################################
@@ -33,20 +68,53 @@ def is_valid_csp(csp_name: str, data_gathering_method: DataGatheringMethod, llm_
     if llm_test_mode:
         print("LLM-TEST-MODE - assessing is_valid_csp")
 
-    result: str = research_runner.get_research_results(prm.PROMT_CHECK_CSP_GOOGLE.format(csp=csp_name),
-                                                       prm.PROMT_CHECK_CSP_DATA_EXTRACT.format(csp=csp_name),
-                                                       llm_test_mode
-                                                       )
+    with span("valid_csp"):
+        result: str = research_runner.get_research_results(prm.PROMT_CHECK_CSP_GOOGLE.format(csp=csp_name),
+                                                           prm.PROMT_CHECK_CSP_DATA_EXTRACT.format(csp=csp_name),
+                                                           llm_test_mode,
+                                                           csp_name=csp_name
+                                                           )
 
     logger.info("Returning result from LLM: " + result)
 
     return str_to_bool(result)
 
 
-# Evaluate the "Lack of Control" risk
-def get_risk_data_lack_of_control(risk_calculator: RiskCalculator, data_gathering_method: DataGatheringMethod, llm_test_mode: bool = False) -> RiskCalculator:
+# Batched question mode: ask all likelihood questions of a CSP (valid CSP, MFA, SSO) in one request
+def get_likelihood_data(csp_name: str, data_gathering_method: DataGatheringMethod) -> dict[str, bool]:
+    research_runner: LLMResearcher = get_research_runner(data_gathering_method)
+
+    with span("likelihood_questions"):
+        results: dict[str, str] = research_runner.get_likelihood_results(get_likelihood_questions(csp_name), csp_name=csp_name)
+
+    logger.info("Returning result from LLM: " + str(results))
+
+    return {name: str_to_bool(result) for name, result in results.items()}
+
+
+# Format the likelihood questions for a CSP
+def get_likelihood_questions(csp_name: str) -> dict[str, tuple[str, str]]:
+    return {name: (question_google.format(csp=csp_name), question_data_extract.format(csp=csp_name))
+            for name, (question_google, question_data_extract) in LIKELIHOOD_QUESTIONS.items()}
+
+
+# Check if the batched question mode is used for the data-gathering method
+def use_batched_questions(data_gathering_method: DataGatheringMethod, batched_questions: bool, llm_test_mode: bool = False) -> bool:
+    # LLM-TEST-MODE is interactive, and needs the questions one by one
+    return batched_questions and not llm_test_mode and data_gathering_method in BATCHED_QUESTION_METHODS
+
+
+# Evaluate the "Lack of Control" risk. With keep_details, the CVE IDs and scores are kept in the RiskCalculator (see RiskCalculator.cve_list).
+def get_risk_data_lack_of_control(risk_calculator: RiskCalculator, data_gathering_method: DataGatheringMethod, llm_test_mode: bool = False,
+                                  keep_details: bool = False) -> RiskCalculator:
     csp_name: str = risk_calculator.csp_name
 
+    # The CVE data is already structured. With CVE_DB_DIRECT, the CVSS scores are taken over directly (no embeddings, no LLM).
+    if data_gathering_method == DataGatheringMethod.CVE_DB_DIRECT:
+        from cve_loader import CVELoader
+        risk_calculator.set_risk_params_lack_of_control(CVELoader().iter_CVE_entries_for_string(csp_name), keep_details)
+        return risk_calculator
+
     research_runner: LLMResearcher = get_research_runner(data_gathering_method)
 
     if llm_test_mode:
@@ -54,11 +122,20 @@ def get_risk_data_lack_of_control(risk_calculator: RiskCalculator, data_gatherin
 
     result_control = research_runner.get_research_results(csp_name,
                                                           prm.PROMT_CHECK_RISK_LACK_OF_CONTROL_DATA_EXTRACT.format(csp=csp_name, current_date=date.today()),
-                                                          llm_test_mode
+                                                          llm_test_mode,
+                                                          csp_name=csp_name
                                                           )
 
     logger.info("Returning result from LLM: " + result_control)
 
+    # Provide CVE list to risk_calculator. It will then calculate the risk.
+    risk_calculator.set_risk_params_lack_of_control(get_cve_list_from_llm_result(result_control), keep_details)
+
+    return risk_calculator
+
+
+# Convert the answer of the LLM ("cve_id;cvss_score" per line) to a list of CVEs
+def get_cve_list_from_llm_result(result_control: str) -> list[CVEEntry]:
     lines = result_control.splitlines()
     cve_list: list[CVEEntry] = []
 
@@ -73,10 +150,7 @@ def get_risk_data_lack_of_control(risk_calculator: RiskCalculator, data_gatherin
         except IndexError:
             logger.warn("Empty value returned for CVSS score. Ignoring this entry.")
 
-    # Provide CVE list to risk_calculator. It will then calculate the risk.
-    risk_calculator.set_risk_params_lack_of_control(cve_list)
-
-    return risk_calculator
+    return cve_list
 
 
 # Evaluate the "Insec Auth" risk
@@ -85,21 +159,28 @@ def get_risk_data_insec_auth(risk_calculator: RiskCalculator, data_gathering_met
 
     research_runner: LLMResearcher = get_research_runner(data_gathering_method)
 
+    questions_mfa: tuple[str, str] = (prm.PROMT_CHECK_RISK_INSEC_AUTH_1_GOOGLE.format(csp=csp_name),
+                                      prm.PROMT_CHECK_RISK_INSEC_AUTH_1_DATA_EXTRACT.format(csp=csp_name))
+    questions_proto: tuple[str, str] = (prm.PROMT_CHECK_RISK_INSEC_AUTH_2_GOOGLE.format(csp=csp_name),
+                                        prm.PROMT_CHECK_RISK_INSEC_AUTH_2_DATA_EXTRACT.format(csp=csp_name))
+
     if llm_test_mode:
+        # LLM-TEST-MODE is interactive. Therefore the questions are asked one after another.
         print("LLM-TEST-MODE - assessing get_risk_data_insec_auth 1")
+        result_mfa = research_runner.get_research_results(*questions_mfa, llm_test_mode, csp_name=csp_name)
 
-    result_mfa = research_runner.get_research_results(prm.PROMT_CHECK_RISK_INSEC_AUTH_1_GOOGLE.format(csp=csp_name),
-                                                      prm.PROMT_CHECK_RISK_INSEC_AUTH_1_DATA_EXTRACT.format(csp=csp_name),
-                                                      llm_test_mode
-                                                      )
-
-    if llm_test_mode:
         print("LLM-TEST-MODE - assessing get_risk_data_insec_auth 2")
+        result_proto = research_runner.get_research_results(*questions_proto, llm_test_mode, csp_name=csp_name)
+    else:
+        # Both questions are independent, and are researched concurrently
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            future_mfa = executor.submit(propagate_context(research_runner.get_research_results),
+                                         questions_mfa[0], questions_mfa[1], llm_test_mode, csp_name)
+            future_proto = executor.submit(propagate_context(research_runner.get_research_results),
+                                           questions_proto[0], questions_proto[1], llm_test_mode, csp_name)
 
-    result_proto = research_runner.get_research_results(prm.PROMT_CHECK_RISK_INSEC_AUTH_2_GOOGLE.format(csp=csp_name),
-                                                        prm.PROMT_CHECK_RISK_INSEC_AUTH_2_DATA_EXTRACT.format(csp=csp_name),
-                                                        llm_test_mode
-                                                        )
+            result_mfa = future_mfa.result()
+            result_proto = future_proto.result()
 
     logger.info("Returning result from LLM: " + result_mfa + " / " + result_proto)
 
@@ -108,6 +189,13 @@ def get_risk_data_insec_auth(risk_calculator: RiskCalculator, data_gathering_met
     return risk_calculator
 
 
+# Evaluate the "Insec Auth" risk with the answers of the batched question mode (no further LLM request is needed)
+def get_risk_data_insec_auth_from_likelihoods(risk_calculator: RiskCalculator, likelihood_data: dict[str, bool]) -> RiskCalculator:
+    risk_calculator.set_risk_params_insec_auth(likelihood_data["supports_mfa"], likelihood_data["supports_auth_protocols"])
+
+    return risk_calculator
+
+
 # Evaluate the "Compliance Issues" risk
 def get_risk_data_comp_issues(risk_calculator: RiskCalculator, data_gathering_method: DataGatheringMethod, llm_test_mode: bool = False) -> RiskCalculator:
     csp_name = risk_calculator.csp_name
@@ -119,7 +207,8 @@ def get_risk_data_comp_issues(risk_calculator: RiskCalculator, data_gathering_me
 
     result_default_countries: str = research_runner.get_research_results(prm.PROMT_CHECK_RISK_COMP_ISSUES_1_GOOGLE.format(csp=csp_name),
                                                                          prm.PROMT_CHECK_RISK_COMP_ISSUES_1_DATA_EXTRACT.format(csp=csp_name),
-                                                                         llm_test_mode
+                                                                         llm_test_mode,
+                                                                         csp_name=csp_name
                                                                          )
 
     logger.info("Returning result from LLM: " + result_default_countries)
@@ -130,6 +219,50 @@ def get_risk_data_comp_issues(risk_calculator: RiskCalculator, data_gathering_me
     return risk_calculator
 
 
+# Gather the data for all risks. The risk dimensions are independent of each other, and are gathered concurrently
+# (except in LLM-TEST-MODE, which is interactive). The latency of an assessment is therefore the one of the slowest stage.
+# If the likelihood_data of the batched question mode is provided, it is used instead of asking the LLM again.
+# With keep_details, the CVE IDs and scores of the "lack of control" risk are kept (e.g. for the per-CVE report).
+def get_risk_data(risk_calculator: RiskCalculator, data_gathering_method: DataGatheringMethod,
+                  cve_data_gathering_method: DataGatheringMethod = DataGatheringMethod.CVE_DB_DIRECT,
+                  llm_test_mode: bool = False, likelihood_data: dict[str, bool] | None = None, keep_details: bool = False) -> RiskCalculator:
+    stages: dict[str, Callable[[], RiskCalculator]] = {
+        "lack_of_control": lambda: get_risk_data_lack_of_control(risk_calculator, cve_data_gathering_method, llm_test_mode, keep_details),
+        "insec_auth": lambda: get_risk_data_insec_auth(risk_calculator, data_gathering_method, llm_test_mode),
+        "comp_issues": lambda: get_risk_data_comp_issues(risk_calculator, data_gathering_method, llm_test_mode)
+    }
+
+    if likelihood_data is not None:
+        stages["insec_auth"] = lambda: get_risk_data_insec_auth_from_likelihoods(risk_calculator, likelihood_data)
+
+    if llm_test_mode:
+        for stage_name, stage in stages.items():
+            run_timed_stage(risk_calculator, stage_name, stage)
+    else:
+        with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+            futures = [executor.submit(propagate_context(run_timed_stage), risk_calculator, stage_name, stage) for stage_name, stage in stages.items()]
+
+            # Re-raise the exceptions of the stages
+            for future in futures:
+                future.result()
+
+    for stage_name, duration in risk_calculator.stage_durations.items():
+        print("Duration for gathering '" + stage_name + "' data: " + str(round(duration, 2)) + " seconds")
+
+    return risk_calculator
+
+
+# Run one stage of the data-gathering, and record its wall time in the RiskCalculator (and as span of the current trace)
+def run_timed_stage(risk_calculator: RiskCalculator, stage_name: str, stage: Callable[[], RiskCalculator]) -> None:
+    stage_start_time = time.perf_counter()
+
+    try:
+        with span("stage:" + stage_name):
+            stage()
+    finally:
+        risk_calculator.set_stage_duration(stage_name, time.perf_counter() - stage_start_time)
+
+
 # This method is used to convert string values to bool
 def str_to_bool(input: str) -> bool:
     # an integer value is expected in the string.
@@ -148,15 +281,514 @@ def str_to_bool(input: str) -> bool:
         return False
 
 
-# This method returns an LLMResearchRunner, depending on the selected data-gathering method
+# This method returns an LLMResearchRunner, depending on the selected data-gathering method.
+# The runners are kept warm in the registry, so that their clients are only created once per process.
 def get_research_runner(data_gathering_method: DataGatheringMethod) -> LLMResearcher:
-    match data_gathering_method:
-        case DataGatheringMethod.GEMINI_SEARCH_SEPARATE:
-            return (LLMResearcherGeminiSearch())
-        case DataGatheringMethod.GEMINI_DIRECT:
-            return (LLMResearcherGeminiDirect())
-        case DataGatheringMethod.GEMINI_CVE_DB:
-            return (LLMResearcherGeminiCVE())
+    return research_runner_registry.get_runner(data_gathering_method)
+
+
+# Assess a single CSP without any user interaction.
+# Returns the filled RiskCalculator, or None if the application is not a valid CSP.
+def assess_csp(csp_name: str, user_country: str, data_gathering_method: DataGatheringMethod,
+               cve_data_gathering_method: DataGatheringMethod = DataGatheringMethod.CVE_DB_DIRECT,
+               batched_questions: bool = False) -> RiskCalculator | None:
+    # All spans of the assessment are recorded in one trace
+    with start_trace("assessment", csp_name=csp_name, user_country=user_country, method=data_gathering_method.name):
+        likelihood_data: dict[str, bool] | None = None
+
+        if use_batched_questions(data_gathering_method, batched_questions):
+            likelihood_data = get_likelihood_data(csp_name, data_gathering_method)
+            valid_csp = likelihood_data["valid_csp"]
+        else:
+            valid_csp = is_valid_csp(csp_name, data_gathering_method)
+
+        if not valid_csp:
+            logger.info(csp_name + " is no valid cloud storage service. Skipping assessment.")
+            return None
+
+        risk_calculator = RiskCalculator(csp_name, user_country)
+
+        # the lack-of-control risk always needs to access the CVE db
+        risk_calculator = get_risk_data(risk_calculator, data_gathering_method, cve_data_gathering_method, likelihood_data=likelihood_data)
+
+        risk_calculator.get_risk()
+
+        return risk_calculator
+
+
+# Reassess a single CSP from its snapshot in the assessment store. Only the stale risk inputs (older than their maximum age,
+# or gathered with another method) are gathered again; the others are taken over from the snapshot. The CVEs of CVE_DB_DIRECT
+# are updated incrementally. The updated snapshot is stored, and the risks are re-scored.
+# Returns the filled RiskCalculator, or None if the application is not a valid CSP.
+def reassess_csp(csp_name: str, user_country: str, data_gathering_method: DataGatheringMethod,
+                 cve_data_gathering_method: DataGatheringMethod, assessment_store: AssessmentStore) -> RiskCalculator | None:
+    with start_trace("reassessment", csp_name=csp_name, user_country=user_country, method=data_gathering_method.name):
+        snapshot = assessment_store.get(csp_name)
+
+        if snapshot.is_fresh("valid_csp", data_gathering_method.name):
+            valid_csp: bool = snapshot.get_value("valid_csp")
+        else:
+            valid_csp = is_valid_csp(csp_name, data_gathering_method)
+            snapshot.set_value("valid_csp", valid_csp, data_gathering_method.name)
+
+        if not valid_csp:
+            assessment_store.put(snapshot)
+            logger.info(csp_name + " is no valid cloud storage service. Skipping assessment.")
+            return None
+
+        risk_calculator = RiskCalculator(csp_name, user_country)
+
+        # The snapshot stores the CVEs of the "lack of control" risk one by one. Therefore their details are kept.
+        stages: dict[str, Callable[[], RiskCalculator]] = {
+            "lack_of_control": lambda: refresh_risk_data(risk_calculator, snapshot, "lack_of_control", cve_data_gathering_method,
+                                                         lambda: get_risk_data_lack_of_control(risk_calculator, cve_data_gathering_method,
+                                                                                               keep_details=True)),
+            "insec_auth": lambda: refresh_risk_data(risk_calculator, snapshot, "insec_auth", data_gathering_method,
+                                                    lambda: get_risk_data_insec_auth(risk_calculator, data_gathering_method)),
+            "comp_issues": lambda: refresh_risk_data(risk_calculator, snapshot, "comp_issues", data_gathering_method,
+                                                     lambda: get_risk_data_comp_issues(risk_calculator, data_gathering_method))
+        }
+
+        if cve_data_gathering_method == DataGatheringMethod.CVE_DB_DIRECT:
+            stages["lack_of_control"] = lambda: refresh_risk_data_lack_of_control(risk_calculator, snapshot)
+
+        with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+            futures = [executor.submit(propagate_context(run_timed_stage), risk_calculator, stage_name, stage) for stage_name, stage in stages.items()]
+
+            # Re-raise the exceptions of the stages
+            for future in futures:
+                future.result()
+
+        assessment_store.put(snapshot)
+
+        risk_calculator.get_risk()
+
+        return risk_calculator
+
+
+# Take over the inputs of a risk dimension from the snapshot if they are fresh, otherwise gather them again (with gather_risk_data)
+# and store them in the snapshot
+def refresh_risk_data(risk_calculator: RiskCalculator, snapshot: AssessmentSnapshot, dimension: str, data_gathering_method: DataGatheringMethod,
+                      gather_risk_data: Callable[[], RiskCalculator]) -> RiskCalculator:
+    if snapshot.is_fresh(dimension, data_gathering_method.name):
+        snapshot.apply_to_risk_calculator(dimension, risk_calculator)
+    else:
+        gather_risk_data()
+        snapshot.set_value_from_risk_calculator(dimension, risk_calculator, data_gathering_method.name)
+
+    return risk_calculator
+
+
+# Evaluate the "Lack of Control" risk with CVE_DB_DIRECT from the snapshot. If the CVE data changed since the lastModified mark
+# of the snapshot, only the CVEs modified since then are requested and merged into the snapshot. All CVEs are requested
+# if the snapshot has none yet, or if they are older than their maximum age.
+def refresh_risk_data_lack_of_control(risk_calculator: RiskCalculator, snapshot: AssessmentSnapshot) -> RiskCalculator:
+    from cve_loader import CVE_PUBLISHED_PERIOD, CVELoader
+
+    cve_loader = CVELoader()
+    method_name: str = DataGatheringMethod.CVE_DB_DIRECT.name
+    nvd_mark: datetime = cve_loader.get_nvd_mark()
+    published_since: datetime = datetime.now() - CVE_PUBLISHED_PERIOD
+    snapshot_entry = snapshot.get("lack_of_control")
+
+    if snapshot_entry is not None and snapshot.is_fresh("lack_of_control", method_name):
+        previous_mark = datetime.fromisoformat(snapshot_entry["nvd_mark"])
+        changed_cve_records: list[list[Any]] = []
+
+        if nvd_mark > previous_mark:
+            changed_cve_records = [[cve.id, cve.published, cve.score[1]] for cve in cve_loader.search_CVEs(risk_calculator.csp_name,
+                                                                                                           modified_since=previous_mark)]
+
+        cve_records = merge_cve_records(snapshot_entry["value"]["cves"], changed_cve_records, published_since)
+
+        # CVEs, which are no longer in the publication period, are removed even if the CVE data did not change
+        if nvd_mark > previous_mark or len(cve_records) != len(snapshot_entry["value"]["cves"]):
+            snapshot.set_value("lack_of_control", {"cves": cve_records}, method_name, incremental=True, nvd_mark=nvd_mark.isoformat())
+    else:
+        cve_records = [[cve.id, cve.published, cve.score[1]] for cve in cve_loader.search_CVEs(risk_calculator.csp_name)]
+        snapshot.set_value("lack_of_control", {"cves": cve_records}, method_name, nvd_mark=nvd_mark.isoformat())
+
+    snapshot.apply_to_risk_calculator("lack_of_control", risk_calculator)
+
+    return risk_calculator
+
+
+# Read the input file for the batch mode.
+# Each row contains "csp_name,user_country". Empty rows and rows starting with "#" are ignored.
+def read_batch_input(input_file_name: str) -> list[tuple[str, str]]:
+    batch_input: list[tuple[str, str]] = []
+
+    with open(input_file_name, newline="") as infile:
+        for row in csv.reader(infile):
+            if len(row) == 0 or row[0].strip() == "" or row[0].startswith("#"):
+                continue
+
+            if len(row) < 2:
+                logger.warning("Ignoring batch input row without user country: " + str(row))
+                continue
+
+            batch_input.append((row[0].strip(), row[1].strip()))
+
+    return batch_input
+
+
+# Assess one CSP of a batch and convert the outcome to a result record.
+# Errors are recorded in the result, so that a single failing CSP does not abort the whole batch.
+# With an assessment store, the CSP is reassessed from its snapshot (the batched question mode is not used).
+def get_batch_result_record(csp_name: str, user_country: str, data_gathering_method: DataGatheringMethod,
+                            cve_data_gathering_method: DataGatheringMethod = DataGatheringMethod.CVE_DB_DIRECT,
+                            batched_questions: bool = False, assessment_store: AssessmentStore | None = None) -> dict[str, Any]:
+    try:
+        if assessment_store is not None:
+            risk_calculator = reassess_csp(csp_name, user_country, data_gathering_method, cve_data_gathering_method, assessment_store)
+        else:
+            risk_calculator = assess_csp(csp_name, user_country, data_gathering_method, cve_data_gathering_method, batched_questions)
+    except Exception as e:
+        logger.exception("Assessment failed for " + csp_name)
+        return {"csp_name": csp_name, "user_country": user_country, "valid_csp": None, "error": repr(e)}
+
+    if risk_calculator is None:
+        return {"csp_name": csp_name, "user_country": user_country, "valid_csp": False}
+
+    record: dict[str, Any] = {"valid_csp": True}
+    record.update(risk_calculator.get_result_record())
+
+    return record
+
+
+# Assess all CSPs listed in the input file concurrently (bounded by max_workers) and write one JSON record per CSP
+def run_batch_assessment(input_file_name: str, output_file_name: str, data_gathering_method: DataGatheringMethod,
+                         max_workers: int = BATCH_DEFAULT_MAX_WORKERS,
+                         cve_data_gathering_method: DataGatheringMethod = DataGatheringMethod.CVE_DB_DIRECT,
+                         batched_questions: bool = False, assessment_store: AssessmentStore | None = None) -> list[dict[str, Any]]:
+    batch_input = read_batch_input(input_file_name)
+
+    print("Starting batch assessment of " + str(len(batch_input)) + " CSPs with " + str(max_workers) + " workers...")
+    batch_start_time = time.perf_counter()
+    trace_collector.clear()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # executor.map keeps the order of the input file
+        results: list[dict[str, Any]] = list(executor.map(
+            lambda row: get_batch_result_record(row[0], row[1], data_gathering_method, cve_data_gathering_method, batched_questions, assessment_store),
+            batch_input))
+
+    batch_duration = time.perf_counter() - batch_start_time
+
+    write_batch_results(results, output_file_name, batch_duration, assessment_store)
+
+    return results
+
+
+# Write one JSON record per CSP to the output file, and print the statistics of the batch
+def write_batch_results(results: list[dict[str, Any]], output_file_name: str, batch_duration: float,
+                        assessment_store: AssessmentStore | None = None) -> None:
+    with open(output_file_name, "w") as outfile:
+        for result in results:
+            outfile.write(json.dumps(result) + "\n")
+
+    throughput: float = len(results) / batch_duration if batch_duration > 0 else 0.0
+    failed: int = sum(1 for result in results if "error" in result)
+
+    print("Batch assessment finished: " + str(len(results)) + " CSPs (" + str(failed) + " failed) in " +
+          str(round(batch_duration, 2)) + " seconds; throughput: " + str(round(throughput * 60, 2)) + " CSPs per minute")
+    print("Setup of research runners took: " + str(round(research_runner_registry.get_setup_duration(), 4)) + " seconds")
+    print_cache_stats()
+    print_span_percentiles()
+
+    if assessment_store is not None:
+        print("Assessment snapshots " + assessment_store.db_file_name + ": " + str(assessment_store.get_stats()))
+
+    print("Results written to: " + output_file_name)
+
+
+# Print the hit/miss counters of the LLM answer cache and of the caches used by the research runners,
+# and the counters of the rate limiters
+def print_cache_stats() -> None:
+    if research_runner_registry.answer_cache is not None:
+        print("LLM answer cache: " + str(research_runner_registry.answer_cache.get_stats()))
+
+    for data_gathering_method, runner in research_runner_registry.runners.items():
+        runner_stats = runner.get_stats()
+        if runner_stats:
+            print("Caches of " + data_gathering_method.name + ": " + str(runner_stats))
+
+    for backend, rate_limiter_stats in get_rate_limiter_stats().items():
+        print("Rate limiter " + backend + ": " + str(rate_limiter_stats))
+
+    cassette = get_active_cassette()
+    if cassette is not None:
+        print("Cassette " + cassette.file_name + ": " + str(cassette.get_stats()))
+
+
+# Print the latency percentiles and the metrics (tokens, documents, bytes) of the spans of all traces of the batch.
+# If a trace directory is set, they are also written to BATCH_TRACE_SUMMARY_FILE.
+def print_span_percentiles() -> None:
+    span_percentiles = get_span_percentiles(trace_collector.get_traces())
+
+    for name, values in span_percentiles.items():
+        print("Span " + name + ": " + ", ".join(key + "=" + str(round(value, 4)) for key, value in values.items()))
+
+    if trace_collector.trace_directory is not None:
+        with open(os.path.join(trace_collector.trace_directory, BATCH_TRACE_SUMMARY_FILE), "w") as outfile:
+            json.dump(span_percentiles, outfile, indent=2)
+
+
+#################################
+# Async Functions
+# Counterparts of the functions above, which run the research calls on one event loop instead of one thread per call.
+# There is no LLM-TEST-MODE, since it is interactive.
+#################################
+# Check if the provided application is a legitimate CSP
+async def ais_valid_csp(csp_name: str, data_gathering_method: DataGatheringMethod) -> bool:
+    research_runner: LLMResearcher = get_research_runner(data_gathering_method)
+
+    with span("valid_csp"):
+        result: str = await research_runner.aget_research_results(prm.PROMT_CHECK_CSP_GOOGLE.format(csp=csp_name),
+                                                                  prm.PROMT_CHECK_CSP_DATA_EXTRACT.format(csp=csp_name),
+                                                                  csp_name=csp_name
+                                                                  )
+
+    logger.info("Returning result from LLM: " + result)
+
+    return str_to_bool(result)
+
+
+# Batched question mode: ask all likelihood questions of a CSP (valid CSP, MFA, SSO) in one request
+async def aget_likelihood_data(csp_name: str, data_gathering_method: DataGatheringMethod) -> dict[str, bool]:
+    research_runner: LLMResearcher = get_research_runner(data_gathering_method)
+
+    with span("likelihood_questions"):
+        results: dict[str, str] = await research_runner.aget_likelihood_results(get_likelihood_questions(csp_name), csp_name=csp_name)
+
+    logger.info("Returning result from LLM: " + str(results))
+
+    return {name: str_to_bool(result) for name, result in results.items()}
+
+
+# Evaluate the "Lack of Control" risk
+async def aget_risk_data_lack_of_control(risk_calculator: RiskCalculator, data_gathering_method: DataGatheringMethod) -> RiskCalculator:
+    csp_name: str = risk_calculator.csp_name
+
+    if data_gathering_method == DataGatheringMethod.CVE_DB_DIRECT:
+        from cve_loader import CVELoader
+        # The CVEs are streamed from the CVE db to the RiskCalculator in a worker thread
+        await asyncio.to_thread(risk_calculator.set_risk_params_lack_of_control, CVELoader().iter_CVE_entries_for_string(csp_name))
+        return risk_calculator
+
+    research_runner: LLMResearcher = get_research_runner(data_gathering_method)
+
+    result_control = await research_runner.aget_research_results(csp_name,
+                                                                 prm.PROMT_CHECK_RISK_LACK_OF_CONTROL_DATA_EXTRACT.format(csp=csp_name,
+                                                                                                                          current_date=date.today()),
+                                                                 csp_name=csp_name
+                                                                 )
+
+    logger.info("Returning result from LLM: " + result_control)
+
+    risk_calculator.set_risk_params_lack_of_control(get_cve_list_from_llm_result(result_control))
+
+    return risk_calculator
+
+
+# Evaluate the "Insec Auth" risk. Both questions are researched concurrently.
+async def aget_risk_data_insec_auth(risk_calculator: RiskCalculator, data_gathering_method: DataGatheringMethod) -> RiskCalculator:
+    csp_name = risk_calculator.csp_name
+
+    research_runner: LLMResearcher = get_research_runner(data_gathering_method)
+
+    result_mfa, result_proto = await asyncio.gather(
+        research_runner.aget_research_results(prm.PROMT_CHECK_RISK_INSEC_AUTH_1_GOOGLE.format(csp=csp_name),
+                                              prm.PROMT_CHECK_RISK_INSEC_AUTH_1_DATA_EXTRACT.format(csp=csp_name),
+                                              csp_name=csp_name),
+        research_runner.aget_research_results(prm.PROMT_CHECK_RISK_INSEC_AUTH_2_GOOGLE.format(csp=csp_name),
+                                              prm.PROMT_CHECK_RISK_INSEC_AUTH_2_DATA_EXTRACT.format(csp=csp_name),
+                                              csp_name=csp_name)
+    )
+
+    logger.info("Returning result from LLM: " + result_mfa + " / " + result_proto)
+
+    risk_calculator.set_risk_params_insec_auth(str_to_bool(result_mfa), str_to_bool(result_proto))
+
+    return risk_calculator
+
+
+# Evaluate the "Compliance Issues" risk
+async def aget_risk_data_comp_issues(risk_calculator: RiskCalculator, data_gathering_method: DataGatheringMethod) -> RiskCalculator:
+    csp_name = risk_calculator.csp_name
+
+    research_runner: LLMResearcher = get_research_runner(data_gathering_method)
+
+    result_default_countries: str = await research_runner.aget_research_results(prm.PROMT_CHECK_RISK_COMP_ISSUES_1_GOOGLE.format(csp=csp_name),
+                                                                                prm.PROMT_CHECK_RISK_COMP_ISSUES_1_DATA_EXTRACT.format(csp=csp_name),
+                                                                                csp_name=csp_name
+                                                                                )
+
+    logger.info("Returning result from LLM: " + result_default_countries)
+
+    risk_calculator.set_risk_params_comp_issues(result_default_countries.split(";"), "unknown")
+
+    return risk_calculator
+
+
+# Gather the data for all risks concurrently, and record the wall time of each stage
+async def aget_risk_data(risk_calculator: RiskCalculator, data_gathering_method: DataGatheringMethod,
+                         cve_data_gathering_method: DataGatheringMethod = DataGatheringMethod.CVE_DB_DIRECT,
+                         likelihood_data: dict[str, bool] | None = None) -> RiskCalculator:
+    stages: dict[str, Awaitable[RiskCalculator]] = {
+        "lack_of_control": aget_risk_data_lack_of_control(risk_calculator, cve_data_gathering_method),
+        "insec_auth": (aget_risk_data_insec_auth(risk_calculator, data_gathering_method) if likelihood_data is None
+                       else asyncio.to_thread(get_risk_data_insec_auth_from_likelihoods, risk_calculator, likelihood_data)),
+        "comp_issues": aget_risk_data_comp_issues(risk_calculator, data_gathering_method)
+    }
+
+    await asyncio.gather(*[arun_timed_stage(risk_calculator, stage_name, stage) for stage_name, stage in stages.items()])
+
+    return risk_calculator
+
+
+# Run one stage of the data-gathering, and record its wall time in the RiskCalculator (and as span of the current trace)
+async def arun_timed_stage(risk_calculator: RiskCalculator, stage_name: str, stage: Awaitable[RiskCalculator]) -> None:
+    stage_start_time = time.perf_counter()
+
+    try:
+        with span("stage:" + stage_name):
+            await stage
+    finally:
+        risk_calculator.set_stage_duration(stage_name, time.perf_counter() - stage_start_time)
+
+
+# Assess a single CSP without any user interaction.
+# Returns the filled RiskCalculator, or None if the application is not a valid CSP.
+async def aassess_csp(csp_name: str, user_country: str, data_gathering_method: DataGatheringMethod,
+                      cve_data_gathering_method: DataGatheringMethod = DataGatheringMethod.CVE_DB_DIRECT,
+                      batched_questions: bool = False) -> RiskCalculator | None:
+    # All spans of the assessment are recorded in one trace
+    with start_trace("assessment", csp_name=csp_name, user_country=user_country, method=data_gathering_method.name):
+        likelihood_data: dict[str, bool] | None = None
+
+        if use_batched_questions(data_gathering_method, batched_questions):
+            likelihood_data = await aget_likelihood_data(csp_name, data_gathering_method)
+            valid_csp = likelihood_data["valid_csp"]
+        else:
+            valid_csp = await ais_valid_csp(csp_name, data_gathering_method)
+
+        if not valid_csp:
+            logger.info(csp_name + " is no valid cloud storage service. Skipping assessment.")
+            return None
+
+        risk_calculator = RiskCalculator(csp_name, user_country)
+        risk_calculator = await aget_risk_data(risk_calculator, data_gathering_method, cve_data_gathering_method, likelihood_data)
+
+        risk_calculator.get_risk()
+
+        return risk_calculator
+
+
+# Assess one CSP of a batch and convert the outcome to a result record.
+# The semaphore limits the number of CSPs assessed at the same time.
+async def aget_batch_result_record(csp_name: str, user_country: str, data_gathering_method: DataGatheringMethod,
+                                   cve_data_gathering_method: DataGatheringMethod, semaphore: asyncio.Semaphore,
+                                   batched_questions: bool = False, assessment_store: AssessmentStore | None = None) -> dict[str, Any]:
+    async with semaphore:
+        try:
+            if assessment_store is not None:
+                # The reassessment gathers only a few inputs. It runs in a worker thread, instead of having a counterpart on the event loop.
+                risk_calculator = await asyncio.to_thread(propagate_context(reassess_csp), csp_name, user_country, data_gathering_method,
+                                                          cve_data_gathering_method, assessment_store)
+            else:
+                risk_calculator = await aassess_csp(csp_name, user_country, data_gathering_method, cve_data_gathering_method, batched_questions)
+        except Exception as e:
+            logger.exception("Assessment failed for " + csp_name)
+            return {"csp_name": csp_name, "user_country": user_country, "valid_csp": None, "error": repr(e)}
+
+    if risk_calculator is None:
+        return {"csp_name": csp_name, "user_country": user_country, "valid_csp": False}
+
+    record: dict[str, Any] = {"valid_csp": True}
+    record.update(risk_calculator.get_result_record())
+
+    return record
+
+
+# Assess all CSPs listed in the input file on one event loop (bounded by max_concurrency),
+# and write one JSON record per CSP
+async def arun_batch_assessment(input_file_name: str, output_file_name: str, data_gathering_method: DataGatheringMethod,
+                                max_concurrency: int = ASYNC_DEFAULT_MAX_CONCURRENCY,
+                                cve_data_gathering_method: DataGatheringMethod = DataGatheringMethod.CVE_DB_DIRECT,
+                                batched_questions: bool = False, assessment_store: AssessmentStore | None = None) -> list[dict[str, Any]]:
+    batch_input = read_batch_input(input_file_name)
+
+    print("Starting async batch assessment of " + str(len(batch_input)) + " CSPs with a concurrency of " + str(max_concurrency) + "...")
+    batch_start_time = time.perf_counter()
+    trace_collector.clear()
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    # asyncio.gather keeps the order of the input file
+    results: list[dict[str, Any]] = list(await asyncio.gather(
+        *[aget_batch_result_record(csp_name, user_country, data_gathering_method, cve_data_gathering_method, semaphore, batched_questions,
+                                   assessment_store)
+          for csp_name, user_country in batch_input]))
+
+    batch_duration = time.perf_counter() - batch_start_time
+
+    write_batch_results(results, output_file_name, batch_duration, assessment_store)
+
+    return results
+
+
+#################################
+# Command-line Functions
+#################################
+# This method parses the command-line arguments. Without arguments, the interactive mode is used.
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Assesses the risk to data confidentiality when using cloud storage services.")
+    parser.add_argument("--batch", metavar="INPUT_FILE",
+                        help="run headless and assess all CSPs in INPUT_FILE (one 'csp_name,user_country' row per CSP)")
+    parser.add_argument("--output", default=BATCH_DEFAULT_OUTPUT_FILE,
+                        help="file for the batch results, one JSON record per CSP (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="maximum number of CSPs assessed concurrently (default: " + str(BATCH_DEFAULT_MAX_WORKERS) +
+                             ", with --asyncio: " + str(ASYNC_DEFAULT_MAX_CONCURRENCY) + ")")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="run the batch assessment on one asyncio event loop instead of a thread pool")
+    parser.add_argument("--method", type=int, choices=[1, 2], default=1,
+                        help="data-gathering method: 1 - GEMINI_SEARCH_SEPARATE, 2 - GEMINI_DIRECT (default: %(default)s)")
+    parser.add_argument("--cve-method", type=int, choices=[3, 4], default=4,
+                        help="data-gathering method for the 'lack of control' risk: 3 - GEMINI_CVE_DB, 4 - CVE_DB_DIRECT (default: %(default)s)")
+    parser.add_argument("--batched-questions", action="store_true",
+                        help="with method 2, ask all likelihood questions of a CSP (valid CSP, MFA, SSO) in one LLM request")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="do not use cached LLM answers from previous runs")
+    parser.add_argument("--compress-context", action="store_true",
+                        help="compress the retrieved documents to the sentences relevant for a question within a token budget "
+                             "(methods 1 and 3). Cassettes must be recorded with the same setting.")
+    parser.add_argument("--trace-dir", metavar="DIRECTORY",
+                        help="write a JSON trace (stage latencies, tokens, documents, bytes) per assessment to DIRECTORY")
+    parser.add_argument("--cassette", metavar="CASSETTE_FILE",
+                        help="record the requests to Gemini, the google search, the web pages and the NVD to CASSETTE_FILE, "
+                             "or replay them from it (see --cassette-mode). The LLM answer cache is not used.")
+    parser.add_argument("--cassette-mode", choices=CASSETTE_MODES, default=CASSETTE_MODE_REPLAY,
+                        help="record or replay the cassette (default: %(default)s)")
+    parser.add_argument("--refresh", action="store_true",
+                        help="reassess the CSPs from their snapshots of previous assessments: only the stale risk inputs are gathered again, "
+                             "and only the CVEs changed since the last assessment are requested (see --snapshot-db)")
+    parser.add_argument("--snapshot-db", default=ASSESSMENT_STORE_DB_FILE,
+                        help="file of the assessment snapshots used by --refresh (default: %(default)s)")
+    parser.add_argument("--serve", action="store_true",
+                        help="run as a daemon with a local HTTP API for submitting assessments and polling their results. "
+                             "The research runners, caches and vector stores stay warm between the assessments.")
+    parser.add_argument("--host", default=SERVICE_DEFAULT_HOST,
+                        help="address of the HTTP API of the daemon (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=SERVICE_DEFAULT_PORT,
+                        help="port of the HTTP API of the daemon (default: %(default)s)")
+    parser.add_argument("--max-queue", type=int, default=SERVICE_DEFAULT_MAX_QUEUE,
+                        help="maximum number of queued and running assessments of the daemon (default: %(default)s)")
+    parser.add_argument("--gc-collections", action="store_true",
+                        help="delete expired and orphaned collections from the vector store, then exit")
+
+    return parser.parse_args(argv)
 
 
 # This method asks the user which data-gathering method he wants to use
@@ -200,6 +832,8 @@ def get_from_usr_llm_test_mode() -> bool:
 # Main
 #################################
 def main():
+    args = parse_args(sys.argv[1:])
+
     # --- Logging setup
     logging.basicConfig(filename='analyser.log', level=logging.DEBUG, format=LOG_FORMAT)
 
@@ -209,8 +843,60 @@ def main():
     # Prevent logging of lang-chain deprecation warnings (new package is not compatible currently)
     warnings.filterwarnings("ignore", category=DeprecationWarning)
 
-    # Clear chroma vector store -> clear data from previous runs
-    os.system('rm -rdf chroma_db_oai/')
+    # The command line caches the LLM answers by default. A cached answer would hide the requests from the cassette.
+    # The cassette itself holds the answers.
+    if not (args.no_cache or args.cassette):
+        research_runner_registry.answer_cache = LLMAnswerCache()
+
+    research_runner_registry.context_compression = args.compress_context
+
+    if args.cassette:
+        set_active_cassette(Cassette(args.cassette, args.cassette_mode))
+
+    if args.trace_dir:
+        os.makedirs(args.trace_dir, exist_ok=True)
+        trace_collector.trace_directory = args.trace_dir
+
+    # The vector store is kept between runs. Expired collections are rebuilt automatically, and can be removed with --gc-collections.
+    if args.gc_collections:
+        import chromadb
+        from vector_store import VectorStoreManager
+
+        deleted_collections = VectorStoreManager(chromadb.PersistentClient(path=CHROMA_PERSIST_DIRECTORY)).collect_garbage()
+        print("Deleted " + str(len(deleted_collections)) + " collections from the vector store.")
+        return
+
+    assessment_store: AssessmentStore | None = AssessmentStore(args.snapshot_db) if args.refresh else None
+
+    # --- daemon mode
+    if args.serve:
+        service = AssessmentService(partial(get_batch_result_record, assessment_store=assessment_store), research_runner_registry,
+                                    args.workers or BATCH_DEFAULT_MAX_WORKERS, args.max_queue)
+
+        try:
+            run_service(service, args.host, args.port, [DataGatheringMethod(args.method), DataGatheringMethod(args.cve_method)])
+        finally:
+            if assessment_store is not None:
+                assessment_store.close()
+            save_active_cassette()
+        return
+
+    # --- headless batch mode
+    if args.batch:
+        try:
+            if args.asyncio:
+                asyncio.run(arun_batch_assessment(args.batch, args.output, DataGatheringMethod(args.method),
+                                                  args.workers or ASYNC_DEFAULT_MAX_CONCURRENCY, DataGatheringMethod(args.cve_method),
+                                                  args.batched_questions, assessment_store))
+            else:
+                run_batch_assessment(args.batch, args.output, DataGatheringMethod(args.method), args.workers or BATCH_DEFAULT_MAX_WORKERS,
+                                     DataGatheringMethod(args.cve_method), args.batched_questions, assessment_store)
+        finally:
+            if assessment_store is not None:
+                assessment_store.close()
+            research_runner_registry.close()
+            save_active_cassette()
+        return
 
     # --- accept user input
     print("Welcome to CloudRiskAnalyser")
@@ -223,24 +909,38 @@ def main():
     # ask the user if he wants to use llm-test mode
     llm_test_mode = get_from_usr_llm_test_mode()
 
-    # --- find out if data is a valid CSP
-    print("Starting assessment...")
-    if (is_valid_csp(application_name, data_gathering_method, llm_test_mode)):
-        print(application_name + " is a valid cloud storage service. Continuing...")
-        risk_calculator = RiskCalculator(application_name, user_country)
-    else:
-        print(application_name + " is no valid cloud storage service. Please try again.")
-        sys.exit()
-
-    # --- gather data for assessing risk
-    risk_calculator = get_risk_data_lack_of_control(risk_calculator, DataGatheringMethod.GEMINI_CVE_DB, llm_test_mode)
-
-    risk_calculator = get_risk_data_insec_auth(risk_calculator, data_gathering_method, llm_test_mode)
-
-    risk_calculator = get_risk_data_comp_issues(risk_calculator, data_gathering_method, llm_test_mode)
-
-    # --- calculate result
-    risk_calculator = risk_calculator.get_risk()
+    with start_trace("assessment", csp_name=application_name, user_country=user_country, method=data_gathering_method.name):
+        # --- find out if data is a valid CSP
+        print("Starting assessment...")
+        likelihood_data: dict[str, bool] | None = None
+
+        if use_batched_questions(data_gathering_method, args.batched_questions, llm_test_mode):
+            likelihood_data = get_likelihood_data(application_name, data_gathering_method)
+            valid_csp = likelihood_data["valid_csp"]
+        else:
+            valid_csp = is_valid_csp(application_name, data_gathering_method, llm_test_mode)
+
+        if valid_csp:
+            print(application_name + " is a valid cloud storage service. Continuing...")
+            risk_calculator = RiskCalculator(application_name, user_country)
+        else:
+            print(application_name + " is no valid cloud storage service. Please try again.")
+            save_active_cassette()
+            sys.exit()
+
+        # --- gather data for assessing risk
+        # The CVEs are reported one by one (with debug logging)
+        risk_calculator = get_risk_data(risk_calculator, data_gathering_method, DataGatheringMethod(args.cve_method), llm_test_mode, likelihood_data,
+                                        keep_details=True)
+
+        # --- calculate result
+        risk_calculator.get_risk()
+
+    print("Setup of research runners took: " + str(round(research_runner_registry.get_setup_duration(), 4)) + " seconds")
+    print_cache_stats()
+
+    research_runner_registry.close()
+    save_active_cassette()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,205 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from datetime import datetime
+from typing import Any
+
+# Own modules
+from risk_calculator import CVEEntry, RiskCalculator
+
+
+#################################
+# Global variables
+#################################
+logger = logging.getLogger(__name__)
+
+
+#################################
+# Constants
+#################################
+ASSESSMENT_STORE_DB_FILE: str = "assessment_snapshots.db"
+
+# Risk inputs stored in a snapshot. "valid_csp" is the result of the CSP validity check.
+SNAPSHOT_DIMENSIONS: list[str] = ["valid_csp", "lack_of_control", "insec_auth", "comp_issues"]
+
+# Maximum age (in seconds) of the risk inputs. Older inputs are gathered again.
+# The CVEs of CVE_DB_DIRECT are updated incrementally on every reassessment; they are only loaded completely after their maximum age.
+SNAPSHOT_MAX_AGES: dict[str, int] = {
+    "valid_csp": 30 * 24 * 3600,
+    "lack_of_control": 30 * 24 * 3600,
+    "insec_auth": 30 * 24 * 3600,
+    "comp_issues": 14 * 24 * 3600
+}
+
+
+#################################
+# This class holds the risk inputs of one CSP, each with the data-gathering method and the time it was gathered (its source timestamp).
+# The CVEs are stored as [cve_id, published, cvss_score] records, so that they can be updated incrementally.
+#################################
+class AssessmentSnapshot():
+    def __init__(self, csp_name: str, dimensions: dict[str, dict[str, Any]] | None = None) -> None:
+        self.csp_name = csp_name
+        self.dimensions: dict[str, dict[str, Any]] = dimensions if dimensions is not None else {}
+
+        # Dimensions gathered (or updated incrementally) in this process. The stages of an assessment set them concurrently.
+        self.refreshed: list[str] = []
+        self.incremental: list[str] = []
+        self.lock = threading.Lock()
+
+    # Check if the dimension was gathered with the data-gathering method, and is younger than its maximum age
+    def is_fresh(self, dimension: str, method_name: str, now: float | None = None) -> bool:
+        with self.lock:
+            entry = self.dimensions.get(dimension)
+
+        if entry is None or entry["method"] != method_name:
+            return False
+
+        age: float = (now if now is not None else time.time()) - entry["fetched_at"]
+        return age < SNAPSHOT_MAX_AGES[dimension]
+
+    def get(self, dimension: str) -> dict[str, Any] | None:
+        with self.lock:
+            return self.dimensions.get(dimension)
+
+    def get_value(self, dimension: str) -> Any:
+        with self.lock:
+            return self.dimensions[dimension]["value"]
+
+    # Store a gathered dimension. An incremental update keeps the source timestamp of the last complete gathering.
+    def set_value(self, dimension: str, value: Any, method_name: str, incremental: bool = False, **metadata: Any) -> None:
+        with self.lock:
+            fetched_at: float = self.dimensions[dimension]["fetched_at"] if incremental else time.time()
+            self.dimensions[dimension] = {"value": value, "method": method_name, "fetched_at": fetched_at, "updated_at": time.time()}
+            self.dimensions[dimension].update(metadata)
+
+            (self.incremental if incremental else self.refreshed).append(dimension)
+
+    # Store the inputs of a dimension, which were set in the RiskCalculator
+    def set_value_from_risk_calculator(self, dimension: str, risk_calculator: RiskCalculator, method_name: str) -> None:
+        match dimension:
+            case "lack_of_control":
+                self.set_value(dimension, {"cves": [[cve.cve_id, None, cve.cvss_score] for cve in risk_calculator.cve_list]}, method_name)
+            case "insec_auth":
+                self.set_value(dimension, {"csp_supports_mfa": risk_calculator.csp_supports_mfa,
+                                           "csp_supports_auth_protocols": risk_calculator.csp_supports_auth_protocols}, method_name)
+            case "comp_issues":
+                self.set_value(dimension, {"csp_default_countries": risk_calculator.csp_default_countries}, method_name)
+            case _:
+                raise ValueError("No risk inputs for dimension " + dimension)
+
+    # Set the stored inputs of a dimension in the RiskCalculator
+    def apply_to_risk_calculator(self, dimension: str, risk_calculator: RiskCalculator) -> None:
+        value = self.get_value(dimension)
+
+        match dimension:
+            case "lack_of_control":
+                risk_calculator.set_risk_params_lack_of_control(get_cve_entries(value["cves"]))
+            case "insec_auth":
+                risk_calculator.set_risk_params_insec_auth(value["csp_supports_mfa"], value["csp_supports_auth_protocols"])
+            case "comp_issues":
+                risk_calculator.set_risk_params_comp_issues(value["csp_default_countries"], ["unknown"])
+            case _:
+                raise ValueError("No risk inputs for dimension " + dimension)
+
+    def to_json(self) -> str:
+        with self.lock:
+            return json.dumps({"csp_name": self.csp_name, "dimensions": self.dimensions})
+
+
+#################################
+# This class stores one assessment snapshot per CSP on disk (sqlite), so that a reassessment only needs to gather the stale inputs.
+#################################
+class AssessmentStore():
+    def __init__(self, db_file_name: str = ASSESSMENT_STORE_DB_FILE) -> None:
+        self.db_file_name = db_file_name
+
+        # Number of dimensions reused from the snapshots, gathered again, and updated incrementally in this process
+        self.reused: dict[str, int] = {dimension: 0 for dimension in SNAPSHOT_DIMENSIONS}
+        self.refreshed: dict[str, int] = {dimension: 0 for dimension in SNAPSHOT_DIMENSIONS}
+        self.incremental: dict[str, int] = {dimension: 0 for dimension in SNAPSHOT_DIMENSIONS}
+
+        # The connection is opened on first use, and shared by all threads
+        self.connection: sqlite3.Connection | None = None
+        self.lock = threading.Lock()
+
+    # Open the database, and create the table if it does not exist yet
+    def get_connection(self) -> sqlite3.Connection:
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.db_file_name, check_same_thread=False)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS assessment_snapshots ("
+                                    "snapshot_key TEXT PRIMARY KEY, "
+                                    "snapshot TEXT NOT NULL, "
+                                    "updated_at REAL NOT NULL)")
+            self.connection.commit()
+
+        return self.connection
+
+    # Snapshots are keyed by the CSP name, independent of case and surrounding whitespace
+    def get_key(self, csp_name: str) -> str:
+        return csp_name.strip().casefold()
+
+    # Return the snapshot of the CSP. If there is none yet, an empty snapshot is returned.
+    def get(self, csp_name: str) -> AssessmentSnapshot:
+        with self.lock:
+            row = self.get_connection().execute("SELECT snapshot FROM assessment_snapshots WHERE snapshot_key = ?",
+                                                (self.get_key(csp_name),)).fetchone()
+
+        if row is None:
+            return AssessmentSnapshot(csp_name)
+
+        snapshot_data: dict[str, Any] = json.loads(row[0])
+        return AssessmentSnapshot(csp_name, snapshot_data["dimensions"])
+
+    # Store the snapshot, and count its reused and refreshed dimensions
+    def put(self, snapshot: AssessmentSnapshot) -> None:
+        snapshot_json = snapshot.to_json()
+
+        with self.lock:
+            connection = self.get_connection()
+            connection.execute("INSERT OR REPLACE INTO assessment_snapshots VALUES (?, ?, ?)",
+                               (self.get_key(snapshot.csp_name), snapshot_json, time.time()))
+            connection.commit()
+
+            for dimension in snapshot.dimensions:
+                if dimension in snapshot.refreshed:
+                    self.refreshed[dimension] += 1
+                elif dimension in snapshot.incremental:
+                    self.incremental[dimension] += 1
+                else:
+                    self.reused[dimension] += 1
+
+    # Counters of this process
+    def get_stats(self) -> dict[str, Any]:
+        with self.lock:
+            return {"reused": dict(self.reused), "refreshed": dict(self.refreshed), "incremental": dict(self.incremental)}
+
+    # Close the database connection. It is reopened on the next access.
+    def close(self) -> None:
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+#################################
+# Functions
+#################################
+# Merge the records of changed CVEs (e.g. modified since the lastModified mark of the snapshot) into the CVE records of a snapshot.
+# Changed CVEs replace their previous records. CVEs published before published_since are removed.
+def merge_cve_records(cve_records: list[list[Any]], changed_cve_records: list[list[Any]], published_since: datetime) -> list[list[Any]]:
+    merged_records: dict[str, list[Any]] = {cve_record[0]: cve_record for cve_record in cve_records}
+
+    for cve_record in changed_cve_records:
+        merged_records[cve_record[0]] = cve_record
+
+    return sorted((cve_record for cve_record in merged_records.values()
+                   if cve_record[1] is None or datetime.fromisoformat(cve_record[1]) >= published_since),
+                  key=lambda cve_record: (cve_record[1] or "", cve_record[0]))
+
+
+# Convert the CVE records of a snapshot to CVE entries. CVEs without CVSS score are ignored.
+def get_cve_entries(cve_records: list[list[Any]]) -> list[CVEEntry]:
+    return [CVEEntry(cve_id, float(cvss_score)) for cve_id, published, cvss_score in cve_records if cvss_score is not None]
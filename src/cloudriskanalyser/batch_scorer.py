@@ -0,0 +1,220 @@
+#!/usr/bin/python
+import argparse
+import json
+import logging
+import time
+
+import numpy as np
+
+from numpy.typing import NDArray
+from typing import Any
+
+# Own modules
+from jurisdictions import JURISDICTION_GDPR, UNKNOWN_COUNTRY, jurisdiction_index
+from risk_calculator import CVSS_THRESHOLD_CHEAP_AND_LAZY, CVSS_THRESHOLD_HONEST_BUT_CURIOUS, RiskCalculator, RiskLevel
+
+#################################
+# Global variables
+#################################
+logger = logging.getLogger(__name__)
+
+
+#################################
+# Constants
+#################################
+# Code of a missing value in the flag and country columns (missing CVSS totals are NaN)
+NA_CODE: int = -1
+# Code of the country "unknown" (all names, see jurisdictions.UNKNOWN_COUNTRY_ALIASES)
+UNKNOWN_COUNTRY_CODE: int = 0
+
+# Names of the risk levels, indexed by their value
+RISK_LEVEL_NAMES: NDArray[np.str_] = np.array([risk_level.name for risk_level in sorted(RiskLevel, key=lambda risk_level: risk_level.value)])
+
+RISK_RESULT_FIELDS: list[str] = ["risk_lack_of_control", "risk_insec_auth", "risk_comp_issues", "risk_overall"]
+
+
+#################################
+# This class stores the inputs of many assessments in columns (NumPy arrays), so that they can be scored at once.
+# Countries are stored as codes of their keys in the jurisdiction index, so that different names of the same country have the same code.
+# The (distinct) countries of a CSP are a row of csp_countries, padded with NA_CODE.
+# csp_countries_set is False for CSPs without country list (unlike an empty list, this results in NA).
+#################################
+class RiskInputBatch():
+    def __init__(self, cvss_totals: NDArray[np.float64], supports_mfa: NDArray[np.int8], supports_auth_protocols: NDArray[np.int8],
+                 user_countries: NDArray[np.int32], csp_countries: NDArray[np.int32], csp_countries_set: NDArray[np.bool_],
+                 country_keys: list[str]) -> None:
+        self.cvss_totals = cvss_totals
+        self.supports_mfa = supports_mfa
+        self.supports_auth_protocols = supports_auth_protocols
+        self.user_countries = user_countries
+        self.csp_countries = csp_countries
+        self.csp_countries_set = csp_countries_set
+        self.country_keys = country_keys
+
+        # Country code -> True if the country is subject to the GDPR
+        gdpr_countries = jurisdiction_index.groups[JURISDICTION_GDPR]
+        self.gdpr_countries: NDArray[np.bool_] = np.array([country_key in gdpr_countries for country_key in country_keys], dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.cvss_totals)
+
+    # Create the columns from result records (see RiskCalculator.get_result_record()).
+    # A missing input (None) is stored as NA, so that the corresponding risk is NA.
+    @classmethod
+    def from_records(cls, records: list[dict[str, Any]]) -> "RiskInputBatch":
+        country_codes: dict[str, int] = {UNKNOWN_COUNTRY: UNKNOWN_COUNTRY_CODE}
+        country_keys: list[str] = [UNKNOWN_COUNTRY]
+
+        def get_country_code(country_name: str) -> int:
+            country_key = jurisdiction_index.get_country_key(country_name)
+
+            if country_key not in country_codes:
+                country_codes[country_key] = len(country_keys)
+                country_keys.append(country_key)
+
+            return country_codes[country_key]
+
+        def get_flag(value: bool | None) -> int:
+            return NA_CODE if value is None else int(bool(value))
+
+        max_countries: int = max((len(record.get("csp_default_countries") or []) for record in records), default=0)
+
+        cvss_totals = np.full(len(records), np.nan, dtype=np.float64)
+        supports_mfa = np.full(len(records), NA_CODE, dtype=np.int8)
+        supports_auth_protocols = np.full(len(records), NA_CODE, dtype=np.int8)
+        user_countries = np.full(len(records), NA_CODE, dtype=np.int32)
+        # At least one column, so that the first country can be compared with the user country
+        csp_countries = np.full((len(records), max_countries + 1), NA_CODE, dtype=np.int32)
+        csp_countries_set = np.zeros(len(records), dtype=bool)
+
+        for index, record in enumerate(records):
+            if record.get("cvss_total") is not None:
+                cvss_totals[index] = record["cvss_total"]
+
+            supports_mfa[index] = get_flag(record.get("csp_supports_mfa"))
+            supports_auth_protocols[index] = get_flag(record.get("csp_supports_auth_protocols"))
+
+            if record.get("user_country"):
+                user_countries[index] = get_country_code(record["user_country"])
+
+            if record.get("csp_default_countries") is not None:
+                csp_countries_set[index] = True
+                for column, country_code in enumerate(dict.fromkeys(get_country_code(country_name) for country_name in record["csp_default_countries"])):
+                    csp_countries[index, column] = country_code
+
+        return cls(cvss_totals, supports_mfa, supports_auth_protocols, user_countries, csp_countries, csp_countries_set, country_keys)
+
+    # Create the columns from the inputs of RiskCalculators
+    @classmethod
+    def from_risk_calculators(cls, risk_calculators: list[RiskCalculator]) -> "RiskInputBatch":
+        return cls.from_records([risk_calculator.get_result_record() for risk_calculator in risk_calculators])
+
+
+#################################
+# Functions
+#################################
+# Score all assessments of the batch with the rules of RiskCalculator.get_risk(). The CVSS thresholds can be changed (e.g. for what-if runs).
+# Returns the risk levels (values of RiskLevel) per risk: "risk_lack_of_control", "risk_insec_auth", "risk_comp_issues" and "risk_overall".
+def score_risk_batch(batch: RiskInputBatch, cvss_threshold_honest_but_curious: float = CVSS_THRESHOLD_HONEST_BUT_CURIOUS,
+                     cvss_threshold_cheap_and_lazy: float = CVSS_THRESHOLD_CHEAP_AND_LAZY) -> dict[str, NDArray[np.int8]]:
+    na = RiskLevel.NA.value
+
+    # 'lack of control': HONEST_BUT_CURIOUS -> low, CHEAP_AND_LAZY -> medium, MALICIOUS -> high
+    risk_lack_of_control = np.select([np.isnan(batch.cvss_totals),
+                                      batch.cvss_totals <= cvss_threshold_honest_but_curious,
+                                      batch.cvss_totals <= cvss_threshold_cheap_and_lazy],
+                                     [na, RiskLevel.LOW.value, RiskLevel.MEDIUM.value], RiskLevel.HIGH.value).astype(np.int8)
+
+    # 'insec auth': MFA or SSO protocols -> low, neither -> high
+    risk_insec_auth = np.select([(batch.supports_mfa == NA_CODE) | (batch.supports_auth_protocols == NA_CODE),
+                                 (batch.supports_mfa == 1) | (batch.supports_auth_protocols == 1)],
+                                [na, RiskLevel.LOW.value], RiskLevel.HIGH.value).astype(np.int8)
+
+    # 'comp issues' (distinct countries): unknown -> high, only the user country -> low, all countries in the GDPR area (like the user country) -> medium-low,
+    # one other country -> medium, multiple other countries -> high
+    csp_countries = batch.csp_countries
+    padding = csp_countries == NA_CODE
+    country_count = np.count_nonzero(~padding, axis=1)
+    comp_issues_set = batch.csp_countries_set & (batch.user_countries != NA_CODE)
+
+    has_unknown_country = np.any(csp_countries == UNKNOWN_COUNTRY_CODE, axis=1)
+    only_user_country = (country_count == 1) & (csp_countries[:, 0] == batch.user_countries)
+    all_gdpr_countries = batch.gdpr_countries[batch.user_countries] & np.all(batch.gdpr_countries[csp_countries] | padding, axis=1)
+
+    risk_comp_issues = np.select([~comp_issues_set, has_unknown_country, only_user_country, all_gdpr_countries, country_count == 1],
+                                 [na, RiskLevel.HIGH.value, RiskLevel.LOW.value, RiskLevel.MEDIUM_LOW.value, RiskLevel.MEDIUM.value],
+                                 RiskLevel.HIGH.value).astype(np.int8)
+
+    # Overall: rounded average of the three risks (like round() in RiskCalculator.get_risk(), halves are rounded to even).
+    # If one risk is NA, the overall risk is NA. If all risks are high, the rounding results in 6, which is limited to HIGH.
+    risk_average = (risk_lack_of_control.astype(np.int64) + risk_insec_auth + risk_comp_issues) / 3
+    risk_overall = np.where((risk_lack_of_control == na) | (risk_insec_auth == na) | (risk_comp_issues == na),
+                            na, np.minimum(np.round(risk_average + 0.5), RiskLevel.HIGH.value)).astype(np.int8)
+
+    return {
+        "risk_lack_of_control": risk_lack_of_control,
+        "risk_insec_auth": risk_insec_auth,
+        "risk_comp_issues": risk_comp_issues,
+        "risk_overall": risk_overall
+    }
+
+
+# Convert risk levels (values of RiskLevel) to their names
+def get_risk_level_names(risk_levels: NDArray[np.int8]) -> list[str]:
+    risk_level_names: list[str] = RISK_LEVEL_NAMES[risk_levels].tolist()
+    return risk_level_names
+
+
+# Re-score result records (e.g. of a batch run) and return copies with the new risk levels.
+# Records of invalid CSPs and failed assessments are returned unchanged.
+def rescore_records(records: list[dict[str, Any]], cvss_threshold_honest_but_curious: float = CVSS_THRESHOLD_HONEST_BUT_CURIOUS,
+                    cvss_threshold_cheap_and_lazy: float = CVSS_THRESHOLD_CHEAP_AND_LAZY) -> list[dict[str, Any]]:
+    assessed_indexes: list[int] = [index for index, record in enumerate(records) if record.get("valid_csp", True) and "error" not in record]
+    batch = RiskInputBatch.from_records([records[index] for index in assessed_indexes])
+    risk_levels = score_risk_batch(batch, cvss_threshold_honest_but_curious, cvss_threshold_cheap_and_lazy)
+
+    rescored_records: list[dict[str, Any]] = [dict(record) for record in records]
+
+    for field in RISK_RESULT_FIELDS:
+        for index, risk_level_name in zip(assessed_indexes, get_risk_level_names(risk_levels[field])):
+            rescored_records[index][field] = risk_level_name
+
+    return rescored_records
+
+
+#################################
+# Main
+#################################
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Re-scores the results of batch assessments (e.g. with other CVSS thresholds).")
+    parser.add_argument("input", help="file with the batch results, one JSON record per CSP")
+    parser.add_argument("--output", default=None, help="file for the re-scored results (default: print the changed risk levels)")
+    parser.add_argument("--cvss-thresholds", type=float, nargs=2, metavar=("LOW", "MEDIUM"),
+                        default=[CVSS_THRESHOLD_HONEST_BUT_CURIOUS, CVSS_THRESHOLD_CHEAP_AND_LAZY],
+                        help="total CVSS score up to which the 'lack of control' risk is low and medium (default: %(default)s)")
+    args = parser.parse_args()
+
+    with open(args.input) as infile:
+        records: list[dict[str, Any]] = [json.loads(line) for line in infile if line.strip()]
+
+    scoring_start_time = time.perf_counter()
+    rescored_records = rescore_records(records, args.cvss_thresholds[0], args.cvss_thresholds[1])
+    scoring_duration = time.perf_counter() - scoring_start_time
+
+    changed_records = [rescored_record for record, rescored_record in zip(records, rescored_records)
+                       if any(record.get(field) != rescored_record.get(field) for field in RISK_RESULT_FIELDS)]
+
+    if args.output:
+        with open(args.output, "w") as outfile:
+            for rescored_record in rescored_records:
+                outfile.write(json.dumps(rescored_record) + "\n")
+    else:
+        for rescored_record in changed_records:
+            print(rescored_record["csp_name"] + ": " + ", ".join(field + "=" + str(rescored_record[field]) for field in RISK_RESULT_FIELDS))
+
+    print("Re-scored " + str(len(records)) + " records in " + str(round(scoring_duration * 1000, 2)) + " milliseconds; " +
+          str(len(changed_records)) + " changed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,450 @@
+#!/usr/bin/python
+import argparse
+import chromadb
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from langchain_community.utilities.google_search import GoogleSearchAPIWrapper
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from nvdlib.classes import CVE
+from typing import Any, Iterator
+
+# Own modules
+import analyser
+from cve_loader import set_default_nvd_mirror
+from embedding_cache import get_cached_embeddings
+from instrumentation import get_percentile
+from llm_cache import LLMAnswerCache
+from llm_researcher import DataGatheringMethod, LLMResearcher, LLMResearcherRegistry
+from llm_researcher_cve import LLMResearcherGeminiCVE
+from llm_researcher_direct import LLMResearcherGeminiDirect
+from llm_researcher_search import LLMResearcherGeminiSearch
+from nvd_mirror import NVDMirror, cve_dict_to_nvd_object
+from page_fetcher import PageFetcher
+from risk_calculator import RiskCalculator
+from search_cache import SearchResultCache
+
+
+#################################
+# Global variables
+#################################
+logger = logging.getLogger(__name__)
+
+
+#################################
+# Constants
+#################################
+BENCHMARK_CSP_COUNTS: list[int] = [1, 100]
+BENCHMARK_CVE_COUNTS: list[int] = [10, 5000]
+BENCHMARK_CACHE_STATES: list[str] = ["cold", "warm"]
+BENCHMARK_DEFAULT_WORKERS: int = 4
+BENCHMARK_DEFAULT_OUTPUT_FILE: str = "benchmark_results.json"
+
+BENCHMARK_PERCENTILES: list[int] = [50, 90, 99]
+BENCHMARK_EMBEDDING_SIZE: int = 64
+BENCHMARK_MODEL_NAME: str = "benchmark"
+
+# Functions of an assessment, whose latency is reported separately
+BENCHMARK_STAGES: list[str] = ["is_valid_csp", "lack_of_control", "insec_auth", "comp_issues", "get_risk"]
+
+# Dependencies of the backends, which are only imported when a research runner (or the CVE loader) needs them
+BENCHMARK_LAZY_MODULES: list[str] = ["chromadb", "langchain_chroma", "langchain_community", "langchain_core", "langchain_google_genai", "nvdlib"]
+# Maximum time for "import analyser" in a fresh interpreter (cold start of the CLI, e.g. for cron jobs)
+BENCHMARK_IMPORT_TIME_BUDGET: float = 2.0
+BENCHMARK_IMPORT_REPETITIONS: int = 3
+
+
+# Answer of the stand-in LLM. The answer only depends on the type of the question, so that every assessment takes the same path.
+def get_benchmark_answer(prompt: str) -> str:
+    # Search questions of the web research (see WebResearchRetriever). They are unique per question, like the ones of the LLM.
+    if "Google search queries" in prompt:
+        prompt_hash: str = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return "1. What about " + prompt_hash[:12] + "?\n2. What about " + prompt_hash[12:24] + "?"
+
+    if "CVE-Number" in prompt:
+        return "CVE-2024-0001;7.5\nCVE-2024-0002;5.3\nCVE-2024-0003;9.8"
+
+    if "In which countries" in prompt:
+        return "Switzerland;Germany"
+
+    return "90"
+
+
+# Return a synthetic CVE record (NVD API format) for a CSP. The records are published within the last year,
+# so that they are all considered for the "lack of control" risk.
+def get_benchmark_cve_dict(csp_name: str, index: int) -> dict[str, Any]:
+    published: str = (datetime.now() - timedelta(days=1 + index % 365)).isoformat(timespec="milliseconds")
+
+    return {
+        "id": "CVE-2024-" + str(100000 + index),
+        "sourceIdentifier": "cve@mitre.org",
+        "published": published,
+        "lastModified": published,
+        "vulnStatus": "Analyzed",
+        "descriptions": [{"lang": "en", "value": "A vulnerability in " + csp_name + " allows remote attackers to read the files of " +
+                                                 "other users (benchmark record " + str(index) + ")."}],
+        "metrics": {"cvssMetricV31": [{"source": "nvd@nist.gov", "type": "Primary", "exploitabilityScore": 3.9, "impactScore": 3.6,
+                                       "cvssData": {"version": "3.1", "vectorString": "AV:N/AC:L", "baseScore": 1 + index % 90 / 10,
+                                                    "baseSeverity": "MEDIUM", "attackVector": "NETWORK", "attackComplexity": "LOW",
+                                                    "privilegesRequired": "NONE", "userInteraction": "NONE", "scope": "UNCHANGED",
+                                                    "confidentialityImpact": "HIGH", "integrityImpact": "NONE", "availabilityImpact": "NONE"}}]},
+        "references": [{"url": "https://example.com/advisory/" + str(index)}]
+    }
+
+
+#################################
+# Stand-in for the Gemini chat models. It answers after a configurable latency, and reports an estimate of the tokens.
+#################################
+class BenchmarkChatModel(BaseChatModel):
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "benchmark"
+
+    def _generate(self, messages: list[BaseMessage], stop: list[str] | None = None, run_manager: CallbackManagerForLLMRun | None = None,
+                  **kwargs: Any) -> ChatResult:
+        prompt: str = "\n".join(str(message.content) for message in messages)
+        answer: str = get_benchmark_answer(prompt)
+
+        time.sleep(self.latency)
+
+        # Roughly 4 characters per token
+        usage_metadata = {"input_tokens": len(prompt) // 4, "output_tokens": len(answer) // 4, "total_tokens": (len(prompt) + len(answer)) // 4}
+
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer, usage_metadata=usage_metadata))])
+
+
+#################################
+# Stand-in for the Google embedding model (deterministic vectors, with a configurable latency per request)
+#################################
+class BenchmarkEmbeddings(DeterministicFakeEmbedding):
+    latency: float = 0.0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        time.sleep(self.latency)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        time.sleep(self.latency)
+        return super().embed_query(text)
+
+
+#################################
+# Stand-in for the Google Custom Search API. It returns links to the pages of the local page server.
+#################################
+class BenchmarkSearch(GoogleSearchAPIWrapper):
+    base_url: str = ""
+    page_count: int = 100
+    latency: float = 0.0
+
+    def results(self, query: str, num_results: int, search_params: dict[str, str] | None = None) -> list[dict[str, Any]]:
+        time.sleep(self.latency)
+
+        # Each query finds other pages, and some pages are found by several queries (like on google)
+        first_page: int = int(hashlib.sha256(query.encode("utf-8")).hexdigest(), 16) % self.page_count
+
+        return [{"title": "Page " + str(page), "link": self.base_url + "/page/" + str(page)}
+                for page in [(first_page + offset) % self.page_count for offset in range(min(num_results, self.page_count))]]
+
+
+#################################
+# Stand-in for the NVD. It returns cve_count synthetic CVEs for every search string, after a configurable latency.
+# The CVEs are converted to nvdlib objects like the ones of the NVD API or the local mirror.
+#################################
+class BenchmarkNVDMirror(NVDMirror):
+    def __init__(self, cve_count: int, latency: float = 0.0) -> None:
+        super().__init__(":memory:")
+        self.cve_count = cve_count
+        self.latency = latency
+
+    def iter_search_keyword(self, search_string: str, published_since: datetime | None = None,
+                            modified_since: datetime | None = None) -> Iterator[CVE]:
+        time.sleep(self.latency)
+
+        for index in range(self.cve_count):
+            cve_dict = get_benchmark_cve_dict(search_string, index)
+
+            if (published_since is None or datetime.fromisoformat(cve_dict["published"]) >= published_since) and \
+               (modified_since is None or datetime.fromisoformat(cve_dict["lastModified"]) >= modified_since):
+                yield cve_dict_to_nvd_object(cve_dict)
+
+
+#################################
+# HTTP handler of the local page server. Every page has a different text, and is answered after the latency of the server.
+#################################
+class BenchmarkPageHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        time.sleep(getattr(self.server, "latency", 0.0))
+
+        paragraphs: str = "".join("<p>Paragraph " + str(index) + " of " + self.path + ": the service supports MFA, SSO with SAML " +
+                                  "and stores the data of its users in Switzerland and Germany.</p>" for index in range(20))
+        body: bytes = ("<html><body><h1>" + self.path + "</h1>" + paragraphs + "</body></html>").encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"' + hashlib.sha256(body).hexdigest()[:16] + '"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+# Run the local page server in a background thread, and yield its base URL
+@contextmanager
+def start_page_server(latency: float = 0.0) -> Iterator[str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BenchmarkPageHandler)
+    setattr(server, "latency", latency)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+
+    try:
+        yield "http://127.0.0.1:" + str(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+#################################
+# This registry creates the research runners with the local stand-ins instead of the Google services.
+# All caches (answers, searches, pages, embeddings, vector store) are stored in the work directory,
+# so that a second run with the same work directory uses warm caches.
+#################################
+class BenchmarkResearcherRegistry(LLMResearcherRegistry):
+    def __init__(self, work_directory: str, search_base_url: str, latencies: dict[str, float], context_compression: bool = False) -> None:
+        super().__init__(LLMAnswerCache(os.path.join(work_directory, "llm_cache.db")), context_compression)
+        self.work_directory = work_directory
+        self.search_base_url = search_base_url
+        self.latencies = latencies
+        self.chroma_client = chromadb.PersistentClient(path=os.path.join(work_directory, "chroma_db"))
+
+    def create_runner(self, data_gathering_method: DataGatheringMethod) -> LLMResearcher:
+        llm = BenchmarkChatModel(latency=self.latencies["llm"])
+        embeddings = get_cached_embeddings(BenchmarkEmbeddings(size=BENCHMARK_EMBEDDING_SIZE, latency=self.latencies["embedding"]),
+                                           BENCHMARK_MODEL_NAME, os.path.join(self.work_directory, "embedding_cache"))
+
+        match data_gathering_method:
+            case DataGatheringMethod.GEMINI_SEARCH_SEPARATE:
+                return LLMResearcherGeminiSearch(llm, embeddings, self.chroma_client,
+                                                 BenchmarkSearch.model_construct(base_url=self.search_base_url, latency=self.latencies["search"]),
+                                                 SearchResultCache(os.path.join(self.work_directory, "search_cache.db")),
+                                                 PageFetcher(os.path.join(self.work_directory, "page_cache.db")), self.context_compression)
+            case DataGatheringMethod.GEMINI_DIRECT:
+                return LLMResearcherGeminiDirect(llm)
+            case DataGatheringMethod.GEMINI_CVE_DB:
+                return LLMResearcherGeminiCVE(llm, embeddings, self.chroma_client, context_compression=self.context_compression)
+            case _:
+                raise ValueError("No research runner available for " + data_gathering_method.name)
+
+
+# Assess one CSP like the analyser (valid CSP, the three risks, risk calculation), and return the latency of each stage
+def assess_benchmark_csp(csp_name: str, data_gathering_method: DataGatheringMethod,
+                         cve_data_gathering_method: DataGatheringMethod) -> dict[str, float]:
+    durations: dict[str, float] = {}
+    risk_calculator = RiskCalculator(csp_name, "Switzerland")
+
+    stage_start_time = time.perf_counter()
+    analyser.is_valid_csp(csp_name, data_gathering_method)
+    durations["is_valid_csp"] = time.perf_counter() - stage_start_time
+
+    stage_start_time = time.perf_counter()
+    analyser.get_risk_data_lack_of_control(risk_calculator, cve_data_gathering_method)
+    durations["lack_of_control"] = time.perf_counter() - stage_start_time
+
+    stage_start_time = time.perf_counter()
+    analyser.get_risk_data_insec_auth(risk_calculator, data_gathering_method)
+    durations["insec_auth"] = time.perf_counter() - stage_start_time
+
+    stage_start_time = time.perf_counter()
+    analyser.get_risk_data_comp_issues(risk_calculator, data_gathering_method)
+    durations["comp_issues"] = time.perf_counter() - stage_start_time
+
+    stage_start_time = time.perf_counter()
+    risk_calculator.get_risk()
+    durations["get_risk"] = time.perf_counter() - stage_start_time
+
+    durations["assessment"] = sum(durations.values())
+
+    return durations
+
+
+# Latency percentiles of a list of durations
+def get_latency_percentiles(durations: list[float]) -> dict[str, float]:
+    sorted_durations = sorted(durations)
+    latency_percentiles: dict[str, float] = {"p" + str(percentile): get_percentile(sorted_durations, percentile)
+                                             for percentile in BENCHMARK_PERCENTILES}
+    latency_percentiles["max"] = sorted_durations[-1]
+
+    return latency_percentiles
+
+
+# Run one scenario: assess csp_count CSPs (max_workers concurrently) against the stand-ins, with cve_count CVEs per CSP.
+# The caches in the work directory are used (and filled), so a second run with the same work directory is a run with warm caches.
+def run_scenario(csp_count: int, cve_count: int, work_directory: str, cache_state: str = "cold",
+                 data_gathering_method: DataGatheringMethod = DataGatheringMethod.GEMINI_SEARCH_SEPARATE,
+                 cve_data_gathering_method: DataGatheringMethod = DataGatheringMethod.CVE_DB_DIRECT,
+                 max_workers: int = BENCHMARK_DEFAULT_WORKERS, latencies: dict[str, float] | None = None,
+                 context_compression: bool = False) -> dict[str, Any]:
+    latencies = {"llm": 0.0, "embedding": 0.0, "search": 0.0, "page": 0.0, "nvd": 0.0, **(latencies or {})}
+    csp_names: list[str] = ["BenchmarkCSP" + str(index) for index in range(csp_count)]
+
+    original_registry = analyser.research_runner_registry
+    set_default_nvd_mirror(BenchmarkNVDMirror(cve_count, latencies["nvd"]))
+
+    try:
+        with start_page_server(latencies["page"]) as base_url:
+            registry = BenchmarkResearcherRegistry(work_directory, base_url, latencies, context_compression)
+            analyser.research_runner_registry = registry
+
+            tracemalloc.start()
+            scenario_start_time = time.perf_counter()
+
+            # The output of the assessments (e.g. one line per CVE) is discarded, but still formatted
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull), ThreadPoolExecutor(max_workers=max_workers) as executor:
+                durations: list[dict[str, float]] = list(executor.map(
+                    lambda csp_name: assess_benchmark_csp(csp_name, data_gathering_method, cve_data_gathering_method), csp_names))
+
+            scenario_duration = time.perf_counter() - scenario_start_time
+            peak_memory: int = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            runner_stats = {method.name: runner.get_stats() for method, runner in registry.runners.items()}
+            answer_cache_stats = registry.answer_cache.get_stats() if registry.answer_cache is not None else {}
+            registry.close()
+    finally:
+        analyser.research_runner_registry = original_registry
+        set_default_nvd_mirror(None)
+
+    return {
+        "scenario": str(csp_count) + " CSPs, " + str(cve_count) + " CVEs, " + cache_state + " caches",
+        "csps": csp_count,
+        "cves": cve_count,
+        "caches": cache_state,
+        "duration": scenario_duration,
+        "throughput_per_minute": csp_count / scenario_duration * 60 if scenario_duration > 0 else 0.0,
+        "latency": get_latency_percentiles([csp_durations["assessment"] for csp_durations in durations]),
+        "stage_latency": {stage: get_latency_percentiles([csp_durations[stage] for csp_durations in durations]) for stage in BENCHMARK_STAGES},
+        "peak_memory_mb": peak_memory / 1024 / 1024,
+        "answer_cache": answer_cache_stats,
+        "runners": runner_stats
+    }
+
+
+# Run all combinations of the scenarios. Each combination of CSPs and CVEs gets its own work directory,
+# which is first used with cold caches, and then again with warm caches.
+def run_benchmark(csp_counts: list[int], cve_counts: list[int], cache_states: list[str], base_directory: str,
+                  **scenario_args: Any) -> list[dict[str, Any]]:
+    results: list[dict[str, Any]] = []
+
+    for csp_count in csp_counts:
+        for cve_count in cve_counts:
+            work_directory = tempfile.mkdtemp(prefix="benchmark_" + str(csp_count) + "_" + str(cve_count) + "_", dir=base_directory)
+
+            for cache_state in cache_states:
+                logger.info("Running benchmark scenario with " + str(csp_count) + " CSPs, " + str(cve_count) + " CVEs, " + cache_state + " caches")
+                result = run_scenario(csp_count, cve_count, work_directory, cache_state, **scenario_args)
+                print_scenario_result(result)
+                results.append(result)
+
+    return results
+
+
+# Print the key figures of a scenario
+def print_scenario_result(result: dict[str, Any]) -> None:
+    print(result["scenario"] + ": " + str(round(result["duration"], 2)) + " seconds, throughput: " +
+          str(round(result["throughput_per_minute"], 1)) + " CSPs per minute, latency: " +
+          ", ".join(key + "=" + str(round(value, 4)) for key, value in result["latency"].items()) +
+          ", peak memory: " + str(round(result["peak_memory_mb"], 1)) + " MB")
+
+    for stage, latency in result["stage_latency"].items():
+        print("  " + stage + ": " + ", ".join(key + "=" + str(round(value, 4)) for key, value in latency.items()))
+
+
+# Import a module in fresh interpreters, and return the fastest import time and the lazy backend modules loaded by the import.
+# The fastest of several runs is used, since the first run also measures the cold file-system cache.
+def measure_import_time(module_name: str = "analyser", repetitions: int = BENCHMARK_IMPORT_REPETITIONS) -> dict[str, Any]:
+    code: str = ("import json, sys, time\n"
+                 "start = time.perf_counter()\n"
+                 "import " + module_name + "\n"
+                 "print(json.dumps({'import_time': time.perf_counter() - start, "
+                 "'lazy_modules_loaded': [name for name in " + repr(BENCHMARK_LAZY_MODULES) + " if name in sys.modules]}))\n")
+
+    measurements: list[dict[str, Any]] = []
+    for repetition in range(repetitions):
+        process = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                 capture_output=True, text=True, check=True)
+        measurements.append(json.loads(process.stdout.strip().splitlines()[-1]))
+
+    return {
+        "module": module_name,
+        "import_time": min(measurement["import_time"] for measurement in measurements),
+        "lazy_modules_loaded": measurements[0]["lazy_modules_loaded"]
+    }
+
+
+#################################
+# Main
+#################################
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks the assessment pipeline offline, with local stand-ins for Gemini, "
+                                                 "the Custom Search API, the web pages and the NVD.")
+    parser.add_argument("--csps", type=int, nargs="+", default=BENCHMARK_CSP_COUNTS, help="numbers of CSPs (default: %(default)s)")
+    parser.add_argument("--cves", type=int, nargs="+", default=BENCHMARK_CVE_COUNTS, help="numbers of CVEs per CSP (default: %(default)s)")
+    parser.add_argument("--caches", nargs="+", choices=BENCHMARK_CACHE_STATES, default=BENCHMARK_CACHE_STATES,
+                        help="cache states; 'warm' reuses the caches of the preceding cold run (default: %(default)s)")
+    parser.add_argument("--method", type=int, choices=[1, 2], default=1,
+                        help="data-gathering method: 1 - GEMINI_SEARCH_SEPARATE, 2 - GEMINI_DIRECT (default: %(default)s)")
+    parser.add_argument("--cve-method", type=int, choices=[3, 4], default=4,
+                        help="data-gathering method for the 'lack of control' risk: 3 - GEMINI_CVE_DB, 4 - CVE_DB_DIRECT (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=BENCHMARK_DEFAULT_WORKERS, help="CSPs assessed concurrently (default: %(default)s)")
+    for service in ["llm", "embedding", "search", "page", "nvd"]:
+        parser.add_argument("--" + service + "-latency", type=float, default=0.0, help="latency of the " + service + " stand-in in seconds")
+    parser.add_argument("--compress-context", action="store_true",
+                        help="compress the retrieved documents to a token budget per question (see the analyser)")
+    parser.add_argument("--work-dir", default=None, help="directory for the caches of the scenarios (default: a temporary directory)")
+    parser.add_argument("--output", default=BENCHMARK_DEFAULT_OUTPUT_FILE, help="file for the results as JSON (default: %(default)s)")
+    parser.add_argument("--import-time", action="store_true",
+                        help="only measure the time for importing the analyser (budget: " + str(BENCHMARK_IMPORT_TIME_BUDGET) + " seconds)")
+    args = parser.parse_args()
+
+    if args.import_time:
+        import_time = measure_import_time()
+        print("Import of " + import_time["module"] + ": " + str(round(import_time["import_time"], 3)) + " seconds, lazy modules loaded: " +
+              str(import_time["lazy_modules_loaded"]))
+        return
+
+    logging.basicConfig(filename="benchmark.log", level=logging.INFO)
+
+    latencies: dict[str, float] = {service: getattr(args, service + "_latency") for service in ["llm", "embedding", "search", "page", "nvd"]}
+    base_directory: str = args.work_dir or tempfile.mkdtemp(prefix="cloudriskanalyser_benchmark_")
+
+    results = run_benchmark(args.csps, args.cves, args.caches, base_directory, data_gathering_method=DataGatheringMethod(args.method),
+                            cve_data_gathering_method=DataGatheringMethod(args.cve_method), max_workers=args.workers, latencies=latencies,
+                            context_compression=args.compress_context)
+
+    with open(args.output, "w") as outfile:
+        json.dump(results, outfile, indent=2)
+
+    print("Results written to: " + args.output)
+
+
+if __name__ == "__main__":
+    main()
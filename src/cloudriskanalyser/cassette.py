@@ -0,0 +1,168 @@
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from array import array
+from typing import Any, Callable, TypeVar
+
+
+#################################
+# Global variables
+#################################
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Cassette used by the research runners and the CVE loaders of this process. See set_active_cassette().
+active_cassette: "Cassette | None" = None
+
+
+#################################
+# Constants
+#################################
+CASSETTE_MODE_RECORD: str = "record"
+CASSETTE_MODE_REPLAY: str = "replay"
+CASSETTE_MODES: list[str] = [CASSETTE_MODE_RECORD, CASSETTE_MODE_REPLAY]
+
+CASSETTE_FORMAT_VERSION: int = 1
+
+
+#################################
+# This class stores the requests to the external services (LLM, embeddings, google search, web pages, NVD) and their responses
+# in a cassette file (gzip-compressed JSON).
+# In record mode, the requests are sent to the services and the responses are added to the cassette. In replay mode, the
+# responses are served from the cassette, without any access to the services. A request without recorded response raises a LookupError.
+# Identical requests are replayed in the order in which they were recorded (the last response is repeated afterwards).
+#################################
+class Cassette():
+    def __init__(self, file_name: str, mode: str = CASSETTE_MODE_REPLAY) -> None:
+        if mode not in CASSETTE_MODES:
+            raise ValueError("Invalid cassette mode: " + mode)
+
+        self.file_name = file_name
+        self.mode = mode
+
+        # Request key -> recorded responses
+        self.interactions: dict[str, list[Any]] = {}
+        self.replay_positions: dict[str, int] = {}
+
+        self.recorded: int = 0
+        self.replayed: int = 0
+        self.lock = threading.Lock()
+
+        if mode == CASSETTE_MODE_REPLAY:
+            self.load()
+
+    def is_recording(self) -> bool:
+        return self.mode == CASSETTE_MODE_RECORD
+
+    # Create the key of an interaction. The kind (e.g. "search") is kept readable, the request is hashed.
+    def get_key(self, kind: str, request: dict[str, Any]) -> str:
+        request_json: str = json.dumps(request, sort_keys=True, default=str)
+
+        return kind + ":" + hashlib.sha256(request_json.encode("utf-8")).hexdigest()
+
+    # Add the response to a request
+    def record(self, kind: str, request: dict[str, Any], response: Any) -> None:
+        key = self.get_key(kind, request)
+
+        with self.lock:
+            self.interactions.setdefault(key, []).append(response)
+            self.recorded += 1
+
+    # Return the recorded response to a request
+    def replay(self, kind: str, request: dict[str, Any]) -> Any:
+        key = self.get_key(kind, request)
+
+        with self.lock:
+            responses = self.interactions.get(key)
+
+            if not responses:
+                raise LookupError("No recorded " + kind + " response in cassette " + self.file_name + " for: " + json.dumps(request, default=str)[:500])
+
+            position = self.replay_positions.get(key, 0)
+            self.replay_positions[key] = position + 1
+            self.replayed += 1
+
+            return responses[min(position, len(responses) - 1)]
+
+    # Record or replay a request. In record mode, function sends the request to the service. The response is converted to JSON
+    # with encode, and back with decode.
+    def call(self, kind: str, request: dict[str, Any], function: Callable[[], T], encode: Callable[[T], Any] = lambda response: response,
+             decode: Callable[[Any], T] = lambda response: response) -> T:
+        if self.is_recording():
+            response = function()
+            self.record(kind, request, encode(response))
+            return response
+
+        return decode(self.replay(kind, request))
+
+    # Load the interactions from the cassette file
+    def load(self) -> None:
+        with gzip.open(self.file_name, "rt", encoding="utf-8") as infile:
+            cassette_data: dict[str, Any] = json.load(infile)
+
+        if cassette_data.get("version") != CASSETTE_FORMAT_VERSION:
+            raise ValueError("Unsupported cassette version in " + self.file_name + ": " + str(cassette_data.get("version")))
+
+        with self.lock:
+            self.interactions = cassette_data["interactions"]
+            self.replay_positions.clear()
+
+    # Write the interactions to the cassette file. The file is replaced atomically.
+    def save(self) -> None:
+        with self.lock:
+            cassette_json: str = json.dumps({"version": CASSETTE_FORMAT_VERSION, "interactions": self.interactions},
+                                            separators=(",", ":"), default=str)
+
+        directory: str = os.path.dirname(os.path.abspath(self.file_name))
+        file_descriptor, temp_file_name = tempfile.mkstemp(dir=directory, prefix=".cassette_")
+
+        try:
+            with os.fdopen(file_descriptor, "wb") as outfile:
+                outfile.write(gzip.compress(cassette_json.encode("utf-8")))
+            os.replace(temp_file_name, self.file_name)
+        except BaseException:
+            os.remove(temp_file_name)
+            raise
+
+        logger.info("Cassette written to " + self.file_name + ": " + str(self.get_stats()))
+
+    def get_stats(self) -> dict[str, Any]:
+        with self.lock:
+            return {
+                "mode": self.mode,
+                "interactions": sum(len(responses) for responses in self.interactions.values()),
+                "recorded": self.recorded,
+                "replayed": self.replayed
+            }
+
+
+# Set the cassette, which is used by all research runners and CVE loaders created afterwards. None disables the cassette.
+def set_active_cassette(cassette: Cassette | None) -> None:
+    global active_cassette
+    active_cassette = cassette
+
+
+def get_active_cassette() -> Cassette | None:
+    return active_cassette
+
+
+# Save the active cassette (only needed in record mode)
+def save_active_cassette() -> None:
+    if active_cassette is not None and active_cassette.is_recording():
+        active_cassette.save()
+
+
+# Embeddings are stored as base64-encoded float32 arrays, which is about 5 times smaller than JSON numbers
+def encode_embedding(embedding: list[float]) -> str:
+    return base64.b64encode(array("f", embedding).tobytes()).decode("ascii")
+
+
+def decode_embedding(encoded_embedding: str) -> list[float]:
+    return array("f", base64.b64decode(encoded_embedding)).tolist()
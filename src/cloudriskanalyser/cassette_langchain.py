@@ -0,0 +1,99 @@
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel, LanguageModelInput
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import Runnable
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import ConfigDict
+from typing import Any, Sequence
+
+# Own modules
+# The langchain models of the cassettes are kept apart from cassette.py, so that the CLI starts without importing langchain
+from cassette import Cassette, decode_embedding, encode_embedding
+
+
+#################################
+# This chat model records the requests to another chat model (or replays them). In replay mode, no chat model is needed.
+# Tools (e.g. for structured output) are bound in the OpenAI format, so that the requests do not depend on the wrapped model.
+#################################
+class CassetteChatModel(BaseChatModel):
+    cassette: Cassette
+    model_name: str
+    chat_model: BaseChatModel | None = None
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette"
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return {"model_name": self.model_name}
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any) -> Runnable[LanguageModelInput, BaseMessage]:
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def get_request(self, messages: list[BaseMessage], stop: list[str] | None, kwargs: dict[str, Any]) -> dict[str, Any]:
+        return {"model": self.model_name, "messages": [message_to_dict(message) for message in messages], "stop": stop, "kwargs": kwargs}
+
+    # The wrapped model is invoked (instead of calling its _generate), so that its rate limiter and callbacks are used
+    def _generate(self, messages: list[BaseMessage], stop: list[str] | None = None, run_manager: CallbackManagerForLLMRun | None = None,
+                  **kwargs: Any) -> ChatResult:
+        message: BaseMessage = self.cassette.call("llm", self.get_request(messages, stop, kwargs),
+                                                  lambda: self.get_chat_model().invoke(messages, stop=stop, **kwargs),
+                                                  message_to_dict, lambda response: messages_from_dict([response])[0])
+
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: list[BaseMessage], stop: list[str] | None = None,
+                         run_manager: AsyncCallbackManagerForLLMRun | None = None, **kwargs: Any) -> ChatResult:
+        request = self.get_request(messages, stop, kwargs)
+
+        if self.cassette.is_recording():
+            message: BaseMessage = await self.get_chat_model().ainvoke(messages, stop=stop, **kwargs)
+            self.cassette.record("llm", request, message_to_dict(message))
+        else:
+            message = messages_from_dict([self.cassette.replay("llm", request)])[0]
+
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def get_chat_model(self) -> BaseChatModel:
+        if self.chat_model is None:
+            raise ValueError("Recording needs a chat model")
+
+        return self.chat_model
+
+
+#################################
+# These embeddings record the embeddings of another embedding model (or replay them). In replay mode, no embedding model is needed.
+# Each text is recorded separately, so that the texts can be embedded in different batches when replaying.
+#################################
+class CassetteEmbeddings(Embeddings):
+    def __init__(self, cassette: Cassette, model_name: str, embeddings: Embeddings | None = None) -> None:
+        self.cassette = cassette
+        self.model_name = model_name
+        self.embeddings = embeddings
+
+    def get_embeddings(self) -> Embeddings:
+        if self.embeddings is None:
+            raise ValueError("Recording needs an embedding model")
+
+        return self.embeddings
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not self.cassette.is_recording():
+            return [decode_embedding(self.cassette.replay("embedding", {"model": self.model_name, "task": "document", "text": text}))
+                    for text in texts]
+
+        embeddings = self.get_embeddings().embed_documents(texts)
+        for text, embedding in zip(texts, embeddings):
+            self.cassette.record("embedding", {"model": self.model_name, "task": "document", "text": text}, encode_embedding(embedding))
+
+        return embeddings
+
+    def embed_query(self, text: str) -> list[float]:
+        embedding: list[float] = self.cassette.call("embedding", {"model": self.model_name, "task": "query", "text": text},
+                                                    lambda: self.get_embeddings().embed_query(text), encode_embedding, decode_embedding)
+        return embedding
@@ -0,0 +1,152 @@
+import logging
+import math
+import re
+
+from langchain.retrievers import ContextualCompressionRetriever
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import BaseDocumentCompressor, Document
+from langchain_core.retrievers import BaseRetriever
+from typing import Sequence
+
+# Own modules
+from instrumentation import add_span_metrics
+
+
+#################################
+# Global variables
+#################################
+logger = logging.getLogger(__name__)
+
+
+#################################
+# Constants
+#################################
+# Average number of characters per token, used to estimate the tokens of a context (no tokenizer request is needed)
+CHARS_PER_TOKEN: int = 4
+
+# Keywords of the sentences, which are relevant for a question type. The type of a question is the one with the most keywords in it.
+QUESTION_KEYWORDS: dict[str, list[str]] = {
+    "valid_csp": ["cloud", "storage", "store", "file", "sync", "backup", "share", "upload"],
+    "mfa": ["mfa", "multi-factor", "multifactor", "two-factor", "2fa", "two-step", "2-step", "authenticator", "security key", "one-time",
+            "totp", "passkey", "verification code"],
+    "sso": ["sso", "single sign-on", "single sign on", "saml", "oauth", "openid", "oidc", "identity provider", "idp", "active directory",
+            "entra", "okta"],
+    "data_location": ["data center", "datacenter", "data centre", "region", "location", "located", "hosted", "stored", "store", "country",
+                      "countries", "residency", "gdpr", "europe", "united states", "server"],
+    "cve": ["cve", "cvss", "vulnerab"]
+}
+
+# Maximum number of (estimated) tokens of the context passed to the LLM per question type
+CONTEXT_TOKEN_BUDGETS: dict[str, int] = {
+    "valid_csp": 1000,
+    "mfa": 1500,
+    "sso": 1500,
+    "data_location": 2500,
+    # One compact record per CVE (at most about 150 tokens) for the default CVE_RETRIEVAL_K of 20. A larger CVE_RETRIEVAL_K needs a larger budget.
+    "cve": 3000
+}
+CONTEXT_DEFAULT_TOKEN_BUDGET: int = 2000
+
+# Question types, whose documents are already compact records. They are passed completely (up to the token budget).
+RECORD_QUESTION_TYPES: list[str] = ["cve"]
+
+QUESTION_KEYWORD_PATTERNS: dict[str, re.Pattern[str]] = {
+    question_type: re.compile(r"\b(?:" + "|".join(re.escape(keyword) for keyword in keywords) + ")", re.IGNORECASE)
+    for question_type, keywords in QUESTION_KEYWORDS.items()
+}
+
+SENTENCE_SEPARATOR: re.Pattern[str] = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+#################################
+# This class compresses the retrieved documents extractively before they are passed to the LLM: only the sentences
+# with keywords of the question type are kept (e.g. MFA or SSO), and the context is limited to the token budget
+# of the question type. The documents keep their metadata, so that the sources can still be cited.
+#################################
+class ExtractiveCompressor(BaseDocumentCompressor):
+    token_budgets: dict[str, int] = CONTEXT_TOKEN_BUDGETS
+
+    def compress_documents(self, documents: Sequence[Document], query: str, callbacks: Callbacks | None = None) -> Sequence[Document]:
+        question_type = get_question_type(query)
+        token_budget: int = self.token_budgets.get(question_type, CONTEXT_DEFAULT_TOKEN_BUDGET)
+
+        compressed_documents = compress_documents(documents, question_type, token_budget)
+
+        context_tokens: int = sum(estimate_tokens(document.page_content) for document in documents)
+        compressed_context_tokens: int = sum(estimate_tokens(document.page_content) for document in compressed_documents)
+
+        logger.info("Compressed the context of a '" + question_type + "' question from " + str(context_tokens) + " to " +
+                    str(compressed_context_tokens) + " tokens (budget: " + str(token_budget) + ")")
+        add_span_metrics(context_tokens=context_tokens, compressed_context_tokens=compressed_context_tokens)
+
+        return compressed_documents
+
+
+#################################
+# Functions
+#################################
+# Wrap a retriever, so that its documents are compressed (see ExtractiveCompressor)
+def get_compressing_retriever(base_retriever: BaseRetriever, token_budgets: dict[str, int] | None = None) -> BaseRetriever:
+    compressor = ExtractiveCompressor(token_budgets=token_budgets) if token_budgets is not None else ExtractiveCompressor()
+
+    return ContextualCompressionRetriever(base_compressor=compressor, base_retriever=base_retriever)
+
+
+# Estimate the number of tokens of a text
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+# Return the type of a question (key of QUESTION_KEYWORDS), or "default" if it contains no keyword
+def get_question_type(question: str) -> str:
+    keyword_counts: dict[str, int] = {question_type: len(pattern.findall(question)) for question_type, pattern in QUESTION_KEYWORD_PATTERNS.items()}
+    question_type = max(keyword_counts, key=lambda question_type: keyword_counts[question_type])
+
+    return question_type if keyword_counts[question_type] > 0 else "default"
+
+
+# Keep the relevant sentences of the documents (in their order) within the token budget. The documents are expected in the
+# order of their relevance. If no sentence is relevant, the documents are kept as they are (within the token budget).
+def compress_documents(documents: Sequence[Document], question_type: str, token_budget: int) -> list[Document]:
+    pattern = QUESTION_KEYWORD_PATTERNS.get(question_type)
+
+    # Records are not split into sentences
+    if question_type in RECORD_QUESTION_TYPES:
+        document_sentences: list[list[str]] = [[document.page_content] if document.page_content.strip() else [] for document in documents]
+    else:
+        document_sentences = [[sentence for sentence in SENTENCE_SEPARATOR.split(document.page_content) if sentence.strip()]
+                              for document in documents]
+
+    if pattern is not None and question_type not in RECORD_QUESTION_TYPES:
+        relevant_sentences = [[sentence for sentence in sentences if pattern.search(sentence)] for sentences in document_sentences]
+
+        if any(relevant_sentences):
+            document_sentences = relevant_sentences
+
+    compressed_documents: list[Document] = []
+    remaining_tokens: int = token_budget
+
+    for document, sentences in zip(documents, document_sentences):
+        kept_sentences: list[str] = []
+
+        for sentence in sentences:
+            sentence_tokens = estimate_tokens(sentence)
+            if sentence_tokens > remaining_tokens:
+                break
+
+            kept_sentences.append(sentence)
+            remaining_tokens -= sentence_tokens
+
+        if kept_sentences:
+            compressed_documents.append(Document(page_content=" ".join(kept_sentences), metadata=document.metadata))
+
+        if len(kept_sentences) < len(sentences):
+            break
+
+    # The most relevant sentence is always kept, shortened to the token budget if needed
+    if not compressed_documents and any(document_sentences):
+        first_index = next(index for index, sentences in enumerate(document_sentences) if sentences)
+        compressed_documents.append(Document(page_content=document_sentences[first_index][0][:token_budget * CHARS_PER_TOKEN],
+                                             metadata=documents[first_index].metadata))
+
+    return compressed_documents
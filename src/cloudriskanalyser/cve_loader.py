@@ -1,42 +1,200 @@
-import jsonpickle
 import logging
 import nvdlib
 import os
 
+from datetime import datetime, timedelta
+from nvdlib.classes import CVE
+from typing import Any, Iterable, Iterator
+
+# Own modules
+from cassette import get_active_cassette
+from instrumentation import add_span_metrics, span
+from nvd_mirror import NVD_MAX_LAST_MOD_WINDOW, NVD_MAX_PUBLISHED_WINDOW, NVDMirror, decode_cves, encode_cves, get_cpe_vendors_products
+from nvd_mirror import get_cve_description, iter_nvd_cves
+from rate_limiter import get_rate_limiter
+from risk_calculator import CVEEntry
+
 
 #################################
 # Global variables
 #################################
 logger = logging.getLogger(__name__)
 
+# NVD mirror used by all CVELoaders created without a mirror (e.g. a local stand-in for the benchmarks). See set_default_nvd_mirror().
+default_nvd_mirror: NVDMirror | None = None
+
+
+#################################
+# Constants
+#################################
+# Only CVEs published within this period are considered for the "lack of control" risk
+CVE_PUBLISHED_PERIOD: timedelta = timedelta(days=2 * 365)
+
+# Descriptions are shortened to this length in the CVE records, to keep the embedding inputs compact
+CVE_DESCRIPTION_MAX_LENGTH: int = 500
+
 
 #################################
 # This class is responsible for loading and providing the CVE data
 # documentation for NVDLib: https://nvdlib.com/en/stable/
+# If a local NVD mirror is provided (or configured with the env variable NVD_MIRROR_DB), the CVEs are looked up
+# in the mirror instead of the NVD API. The mirror is synchronized separately (see nvd_mirror.py).
 #################################
 class CVELoader():
-    def __init__(self) -> None:
+    def __init__(self, nvd_mirror: NVDMirror | None = None) -> None:
         # load the required API key from the env variables
         self.NVD_API_KEY = os.getenv("NVD_API_KEY")
 
+        if nvd_mirror is None:
+            nvd_mirror = default_nvd_mirror
+
+        if nvd_mirror is None and os.getenv("NVD_MIRROR_DB"):
+            nvd_mirror = NVDMirror(str(os.getenv("NVD_MIRROR_DB")), self.NVD_API_KEY)
+
+        self.nvd_mirror = nvd_mirror
+
     def get_CPEs_for_string(self, search_string: str) -> None:
-        r = nvdlib.searchCPE(keywordSearch=search_string, key=self.NVD_API_KEY)
+        r = get_rate_limiter("nvd").call(nvdlib.searchCPE, keywordSearch=search_string, key=self.NVD_API_KEY)
         for eachCPE in r:
             print(eachCPE.cpeName)
 
     def get_CVEs_for_CPE(self, cpe_string: str) -> None:
-        r = nvdlib.searchCVE(cpeName=cpe_string, key=self.NVD_API_KEY)
+        if self.nvd_mirror is not None:
+            r = self.nvd_mirror.search_cpe(cpe_string)
+        else:
+            r = list(iter_nvd_cves({"cpeName": cpe_string}, self.NVD_API_KEY))
         for eachCVE in r:
             print(eachCVE.id, str(eachCVE.score[0]), eachCVE.url)
 
-    def get_CVEs_for_string(self, search_string: str) -> str:
-        filename: str = "cve_data.json"
+    # Yield the CVEs for the search string one by one, as the result pages arrive from the NVD API (or the mirror).
+    # If a cassette is active, all CVEs of the search are recorded (or replayed) at once.
+    def iter_CVEs_for_string(self, search_string: str) -> Iterator[CVE]:
+        cassette = get_active_cassette()
+
+        if cassette is not None:
+            yield from cassette.call("nvd", {"function": "searchCVE_V2", "keywordSearch": search_string},
+                                     lambda: list(self.iter_source_CVEs_for_string(search_string)), encode_cves, decode_cves)
+        else:
+            yield from self.iter_source_CVEs_for_string(search_string)
+
+    # Yield the CVEs for the search string from the NVD API (or the mirror)
+    def iter_source_CVEs_for_string(self, search_string: str) -> Iterator[CVE]:
+        if self.nvd_mirror is not None:
+            yield from self.nvd_mirror.iter_search_keyword(search_string)
+        else:
+            yield from iter_nvd_cves({"keywordSearch": search_string}, self.NVD_API_KEY)
+
+    # Yield one compact record per CVE (ID, published date, CVSS score, vendors and products of the CPEs, and a short description)
+    def iter_CVE_records_for_string(self, search_string: str) -> Iterator[dict[str, Any]]:
+        for cve in self.iter_CVEs_for_string(search_string):
+            yield get_CVE_record(cve)
+
+    # Return the CVEs for the search string, which were published after published_since (default: in the last 2 years).
+    # The CVSS score is taken directly from the NVD data, no LLM is involved.
+    def get_CVE_entries_for_string(self, search_string: str, published_since: datetime | None = None) -> list[CVEEntry]:
+        return list(self.iter_CVE_entries_for_string(search_string, published_since))
+
+    # Same as get_CVE_entries_for_string(), but yields the CVEs one by one (e.g. for RiskCalculator.set_risk_params_lack_of_control())
+    def iter_CVE_entries_for_string(self, search_string: str, published_since: datetime | None = None) -> Iterator[CVEEntry]:
+        cve_count: int = 0
+
+        for cve in self.search_CVEs(search_string, published_since):
+            if cve.score[1] is None:
+                logger.warning("No CVSS score available for " + cve.id + ". Ignoring this entry.")
+                continue
+
+            cve_count += 1
+            yield CVEEntry(cve.id, float(cve.score[1]))
+
+        logger.info("Found " + str(cve_count) + " CVEs for " + search_string + " published " +
+                    ("since " + str(published_since) if published_since is not None else "in the last " + str(CVE_PUBLISHED_PERIOD.days) + " days"))
+
+    # Yield the CVEs (nvdlib objects) for the search string, which were published after published_since (default: in the last 2 years).
+    # With modified_since, only the CVEs modified since then are requested (see get_nvd_mark()). The NVD API only accepts
+    # lastModified ranges of 120 days. For older marks, all CVEs are returned.
+    # If a cassette is active, all found CVEs are recorded (or replayed) at once. The default publication period is not part of the
+    # recorded request, so that a cassette returns the same CVEs on any day.
+    def search_CVEs(self, search_string: str, published_since: datetime | None = None,
+                    modified_since: datetime | None = None) -> Iterator[CVE]:
+        cassette = get_active_cassette()
+        request: dict[str, Any] = {"function": "searchCVE", "keywordSearch": search_string,
+                                   "published_since": published_since.isoformat() if published_since is not None else None}
+        if modified_since is not None:
+            request["modified_since"] = modified_since.isoformat()
+
+        source_published_since: datetime = published_since if published_since is not None else datetime.now() - CVE_PUBLISHED_PERIOD
+        cve_count: int = 0
+
+        with span("nvd_search", source="cassette" if cassette is not None else "mirror" if self.nvd_mirror is not None else "api",
+                  incremental=modified_since is not None):
+            if cassette is not None:
+                cves: Iterable[CVE] = cassette.call("nvd", request, lambda: list(self.search_source_CVEs(search_string, source_published_since,
+                                                                                                         modified_since)),
+                                                    encode_cves, decode_cves)
+            else:
+                cves = self.search_source_CVEs(search_string, source_published_since, modified_since)
+
+            for cve in cves:
+                cve_count += 1
+                yield cve
+
+            add_span_metrics(cves=cve_count)
+
+    # Yield the CVEs for the search string, which were published after published_since (and modified after modified_since),
+    # from the NVD API (or the mirror)
+    def search_source_CVEs(self, search_string: str, published_since: datetime, modified_since: datetime | None = None) -> Iterator[CVE]:
+        if self.nvd_mirror is not None:
+            yield from self.nvd_mirror.iter_search_keyword(search_string, published_since, modified_since)
+            return
+
+        search_parameters: dict[str, Any] = {"keywordSearch": search_string}
+
+        now = datetime.now()
+        if modified_since is not None and now - modified_since <= NVD_MAX_LAST_MOD_WINDOW:
+            search_parameters.update(lastModStartDate=modified_since, lastModEndDate=now)
+
+        # The NVD API only accepts publication date ranges of 120 days. Therefore the period is split into windows (as for the
+        # synchronization of the mirror).
+        window_start = published_since
+        while window_start < now:
+            window_end = min(window_start + NVD_MAX_PUBLISHED_WINDOW, now)
+
+            yield from iter_nvd_cves({**search_parameters, "pubStartDate": window_start, "pubEndDate": window_end}, self.NVD_API_KEY)
+            window_start = window_end
+
+    # Return the lastModified mark of the CVE data: the time of the last synchronization of the mirror.
+    # Without mirror (NVD API), the CVE data is always current, and the current time is returned.
+    def get_nvd_mark(self) -> datetime:
+        if self.nvd_mirror is not None:
+            last_modified_mark: datetime | None = self.nvd_mirror.get_last_modified_mark()
+            if last_modified_mark is not None:
+                return last_modified_mark
+
+        return datetime.now()
+
+
+# Set the NVD mirror, which is used by all CVELoaders created without a mirror. None restores the default behaviour
+# (the mirror configured with NVD_MIRROR_DB, or the NVD API).
+def set_default_nvd_mirror(nvd_mirror: NVDMirror | None) -> None:
+    global default_nvd_mirror
+    default_nvd_mirror = nvd_mirror
+
 
-        cve_list: list[str] = nvdlib.searchCVE(keywordSearch=search_string, key=self.NVD_API_KEY)
+# Convert an nvdlib CVE object to a compact record
+def get_CVE_record(cve: CVE) -> dict[str, Any]:
+    description: str = get_cve_description({"descriptions": [vars(description) for description in getattr(cve, "descriptions", [])]})
 
-        with open(filename, "w") as outfile:
-            outfile.write(jsonpickle.encode(cve_list))
+    if len(description) > CVE_DESCRIPTION_MAX_LENGTH:
+        description = description[:CVE_DESCRIPTION_MAX_LENGTH - 3] + "..."
 
-        outfile.close()
+    vendors, products = get_cpe_vendors_products([cpe.criteria for cpe in getattr(cve, "cpe", [])])
 
-        return filename
+    return {
+        "cve_id": cve.id,
+        "published": cve.published,
+        "cvss_version": cve.score[0],
+        "cvss_score": cve.score[1],
+        "vendors": vendors,
+        "products": products,
+        "description": description
+    }
@@ -0,0 +1,194 @@
+import hashlib
+import logging
+import os
+import threading
+import uuid
+
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from typing import Any, Sequence
+
+# Own modules
+from instrumentation import add_span_metrics, span
+
+
+#################################
+# Global variables
+#################################
+logger = logging.getLogger(__name__)
+
+# Locks of the collections, see get_collection_lock()
+collection_locks: dict[str, threading.RLock] = {}
+collection_locks_lock = threading.Lock()
+
+
+#################################
+# Constants
+#################################
+EMBEDDING_CACHE_DIRECTORY: str = "./embedding_cache"
+EMBEDDING_MODEL: str = "models/embedding-001"
+
+# Number of texts sent to the embedding model in one request
+EMBEDDING_BATCH_SIZE: int = 100
+
+
+# Return the content hash of a document. It is used as ID in the vector store.
+def get_document_hash(document: Document) -> str:
+    return hashlib.sha256(document.page_content.encode("utf-8")).hexdigest()
+
+
+# Return the lock of a collection. Chroma may return a search hit without its document, while another thread adds documents
+# to the same collection (e.g. the questions of one CSP, which are researched concurrently). Adding and searching is therefore
+# serialized per collection.
+def get_collection_lock(collection_name: str) -> threading.RLock:
+    with collection_locks_lock:
+        if collection_name not in collection_locks:
+            collection_locks[collection_name] = threading.RLock()
+
+        return collection_locks[collection_name]
+
+
+# Remove documents with identical content (the first one is kept)
+def dedupe_documents(documents: list[Document]) -> list[Document]:
+    unique_documents: dict[str, Document] = {}
+
+    for document in documents:
+        unique_documents.setdefault(get_document_hash(document), document)
+
+    return list(unique_documents.values())
+
+
+#################################
+# This class removes duplicate texts before they are passed to the wrapped embedding model.
+# Duplicates get the same vector as their first occurrence.
+#################################
+class DedupingEmbeddings(Embeddings):
+    def __init__(self, embeddings: Embeddings) -> None:
+        self.embeddings = embeddings
+        self.texts_requested: int = 0
+        self.texts_deduplicated: int = 0
+
+    # Embed all unique texts, and map the vectors back to the original list
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        unique_texts: list[str] = list(dict.fromkeys(texts))
+        self.count_texts(texts, unique_texts)
+
+        with span("embedding"):
+            vectors = dict(zip(unique_texts, self.embeddings.embed_documents(unique_texts)))
+
+        return [vectors[text] for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        unique_texts: list[str] = list(dict.fromkeys(texts))
+        self.count_texts(texts, unique_texts)
+
+        with span("embedding"):
+            vectors = dict(zip(unique_texts, await self.embeddings.aembed_documents(unique_texts)))
+
+        return [vectors[text] for text in texts]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.embeddings.aembed_query(text)
+
+    def count_texts(self, texts: list[str], unique_texts: list[str]) -> None:
+        self.texts_requested += len(texts)
+        self.texts_deduplicated += len(texts) - len(unique_texts)
+
+        if len(texts) > len(unique_texts):
+            logger.debug("Removed " + str(len(texts) - len(unique_texts)) + " duplicate texts before embedding")
+
+
+#################################
+# This class counts the texts, which are passed to the wrapped embedding model (span metric "documents_embedded").
+# It wraps the model behind the cache, so that cache hits are not counted.
+#################################
+class CountingEmbeddings(Embeddings):
+    def __init__(self, embeddings: Embeddings) -> None:
+        self.embeddings = embeddings
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        add_span_metrics(documents_embedded=len(texts))
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        add_span_metrics(documents_embedded=len(texts))
+        return await self.embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.embeddings.aembed_query(text)
+
+
+#################################
+# This vector store only adds documents, whose content is not yet stored in the collection.
+# The content hash is used as document ID.
+#################################
+class DedupingChroma(Chroma):
+    def add_documents(self, documents: list[Document], **kwargs: Any) -> list[str]:
+        unique_documents = dedupe_documents(documents)
+        ids: list[str] = [get_document_hash(document) for document in unique_documents]
+
+        if len(ids) == 0:
+            return []
+
+        with get_collection_lock(self._collection.name):
+            existing_ids: set[str] = set(self.get(ids=ids, include=[])["ids"])
+            new_documents: list[Document] = [document for document, id in zip(unique_documents, ids) if id not in existing_ids]
+            new_ids: list[str] = [id for id in ids if id not in existing_ids]
+
+            logger.info("Adding " + str(len(new_documents)) + " of " + str(len(documents)) + " documents to the vectorstore " +
+                        "(the others are duplicates)")
+
+            if len(new_documents) == 0:
+                return []
+
+            return super().add_documents(new_documents, ids=new_ids, **kwargs)
+
+    # Also used by similarity_search() and the retrievers
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: dict[str, str] | None = None, where_document: dict[str, str] | None = None,
+                                     **kwargs: Any) -> list[tuple[Document, float]]:
+        with get_collection_lock(self._collection.name):
+            return super().similarity_search_with_score(query, k, filter, where_document, **kwargs)
+
+
+#################################
+# This file store writes each value to a temporary file, which then replaces the old file. Concurrent readers
+# (e.g. the embedding caches of concurrent questions) therefore never read a partly written value.
+#################################
+class AtomicLocalFileStore(LocalFileStore):
+    def mset(self, key_value_pairs: Sequence[tuple[str, bytes]]) -> None:
+        for key, value in key_value_pairs:
+            full_path = self._get_full_path(key)
+            self._mkdir_for_store(full_path.parent)
+
+            temporary_path = full_path.with_name(full_path.name + "." + uuid.uuid4().hex + ".tmp")
+            temporary_path.write_bytes(value)
+            if self.chmod_file is not None:
+                os.chmod(temporary_path, self.chmod_file)
+
+            os.replace(temporary_path, full_path)
+
+
+# Wrap an embedding model with a persistent cache (keyed by content hash and model name), and remove duplicate texts.
+# Only texts which were never embedded before are sent to the model, in batches of EMBEDDING_BATCH_SIZE.
+def get_cached_embeddings(underlying_embeddings: Embeddings, model_name: str,
+                          cache_directory: str = EMBEDDING_CACHE_DIRECTORY) -> DedupingEmbeddings:
+    cached_embeddings = CacheBackedEmbeddings.from_bytes_store(CountingEmbeddings(underlying_embeddings), AtomicLocalFileStore(cache_directory),
+                                                               namespace=model_name, batch_size=EMBEDDING_BATCH_SIZE)
+
+    return DedupingEmbeddings(cached_embeddings)
+
+
+# Create the Gemini embeddings, cached on disk. Google GenAI is only imported, when the embeddings are needed.
+def create_default_embeddings() -> DedupingEmbeddings:
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+    return get_cached_embeddings(GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL), EMBEDDING_MODEL)
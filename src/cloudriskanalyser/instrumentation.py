@@ -0,0 +1,257 @@
+import contextvars
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import uuid
+
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Sequence, TypeVar
+
+
+#################################
+# Global variables
+#################################
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+#################################
+# Constants
+#################################
+# Maximum number of finished traces kept in memory (e.g. for the percentiles of a batch run)
+TRACE_COLLECTOR_MAX_TRACES: int = 10000
+
+SPAN_PERCENTILES: list[int] = [50, 90, 99]
+
+
+#################################
+# This class stores one timed stage of an assessment (e.g. a google search or an LLM request).
+# Besides the latency, a span collects metrics like tokens in/out, documents embedded or bytes fetched.
+#################################
+class Span():
+    def __init__(self, name: str, parent_id: str | None, attributes: dict[str, Any]) -> None:
+        self.name = name
+        self.span_id: str = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.metrics: dict[str, float] = {}
+        self.thread_name: str = threading.current_thread().name
+
+        self.start_time: float = time.time()
+        self.start_counter: float = time.perf_counter()
+        self.duration: float | None = None
+
+    def end(self) -> None:
+        self.duration = time.perf_counter() - self.start_counter
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "thread": self.thread_name,
+            "start_time": self.start_time,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "metrics": self.metrics
+        }
+
+
+#################################
+# This class stores all spans of one assessment. Spans can be added concurrently from several threads.
+#################################
+class Trace():
+    def __init__(self, name: str, attributes: dict[str, Any]) -> None:
+        self.name = name
+        self.trace_id: str = uuid.uuid4().hex
+        self.attributes = attributes
+        self.spans: list[Span] = []
+        self.lock = threading.Lock()
+
+        self.start_time: float = time.time()
+        self.start_counter: float = time.perf_counter()
+        self.duration: float | None = None
+
+    def add_span(self, span: Span) -> None:
+        with self.lock:
+            self.spans.append(span)
+
+    # Add up the metrics of a span (e.g. the bytes fetched by several threads)
+    def add_metrics(self, span: Span, metrics: dict[str, float]) -> None:
+        with self.lock:
+            for key, value in metrics.items():
+                span.metrics[key] = span.metrics.get(key, 0) + value
+
+    def end(self) -> None:
+        self.duration = time.perf_counter() - self.start_counter
+
+    def to_dict(self) -> dict[str, Any]:
+        with self.lock:
+            spans = [span.to_dict() for span in self.spans]
+
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "attributes": self.attributes,
+            "start_time": self.start_time,
+            "duration": self.duration,
+            "spans": spans
+        }
+
+    # Write the trace as JSON file to the directory, and return the name of the file
+    def export_json(self, directory: str) -> str:
+        os.makedirs(directory, exist_ok=True)
+
+        label: str = re.sub(r"[^a-zA-Z0-9_-]+", "-", str(self.attributes.get("csp_name", self.name)))
+        file_name: str = os.path.join(directory, "trace_" + label + "_" + self.trace_id[:12] + ".json")
+
+        with open(file_name, "w") as outfile:
+            json.dump(self.to_dict(), outfile, indent=2)
+
+        return file_name
+
+
+#################################
+# This class collects the finished traces of this process. If a trace directory is set, each trace is also exported as JSON.
+#################################
+class TraceCollector():
+    def __init__(self, max_traces: int = TRACE_COLLECTOR_MAX_TRACES) -> None:
+        self.max_traces = max_traces
+        self.trace_directory: str | None = None
+        self.traces: list[Trace] = []
+        self.lock = threading.Lock()
+
+    def add(self, trace: Trace) -> None:
+        with self.lock:
+            self.traces.append(trace)
+            del self.traces[:-self.max_traces]
+
+        if self.trace_directory is not None:
+            logger.info("Trace written to: " + trace.export_json(self.trace_directory))
+
+    def get_traces(self) -> list[Trace]:
+        with self.lock:
+            return list(self.traces)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.traces.clear()
+
+
+trace_collector: TraceCollector = TraceCollector()
+
+current_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar("current_trace", default=None)
+current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar("current_span", default=None)
+
+
+# Record all spans within this context in a new trace (e.g. one trace per assessment)
+@contextmanager
+def start_trace(name: str, **attributes: Any) -> Iterator[Trace]:
+    trace = Trace(name, attributes)
+    trace_token = current_trace.set(trace)
+    span_token = current_span.set(None)
+
+    try:
+        yield trace
+    finally:
+        trace.end()
+        current_span.reset(span_token)
+        current_trace.reset(trace_token)
+        trace_collector.add(trace)
+
+
+# Start a span in the current trace without making it the current span (e.g. for callbacks).
+# Returns None if there is no current trace.
+def open_span(name: str, **attributes: Any) -> Span | None:
+    trace = current_trace.get()
+
+    if trace is None:
+        return None
+
+    parent = current_span.get()
+    new_span = Span(name, parent.span_id if parent is not None else None, attributes)
+    trace.add_span(new_span)
+
+    return new_span
+
+
+# Time the code within this context as a span of the current trace. Nothing is recorded if there is no current trace.
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span | None]:
+    new_span = open_span(name, **attributes)
+
+    if new_span is None:
+        yield None
+        return
+
+    span_token = current_span.set(new_span)
+
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.attributes["error"] = repr(e)
+        raise
+    finally:
+        new_span.end()
+        current_span.reset(span_token)
+
+
+# Add metrics to the current span (e.g. add_span_metrics(bytes_fetched=1024))
+def add_span_metrics(**metrics: float) -> None:
+    trace = current_trace.get()
+    active_span = current_span.get()
+
+    if trace is not None and active_span is not None:
+        trace.add_metrics(active_span, metrics)
+
+
+# Wrap a function, so that it runs with the trace and span of the caller when it is called by another thread
+# (e.g. by a ThreadPoolExecutor). Each call gets its own copy of the caller's context.
+def propagate_context(function: Callable[..., T]) -> Callable[..., T]:
+    context = contextvars.copy_context()
+
+    def run_in_context(*args: Any, **kwargs: Any) -> T:
+        return context.copy().run(function, *args, **kwargs)
+
+    return run_in_context
+
+
+# Return the value at the percentile of the sorted values (nearest-rank method)
+def get_percentile(sorted_values: Sequence[float], percentile: int) -> float:
+    rank: int = max(1, math.ceil(percentile / 100 * len(sorted_values)))
+
+    return sorted_values[rank - 1]
+
+
+# Aggregate the spans of several traces by name: number of spans, latency percentiles and the sum of the metrics
+def get_span_percentiles(traces: list[Trace]) -> dict[str, dict[str, float]]:
+    durations: dict[str, list[float]] = {}
+    metrics: dict[str, dict[str, float]] = {}
+
+    for trace in traces:
+        durations.setdefault("assessment", []).append(trace.duration or 0.0)
+
+        for trace_span in trace.spans:
+            durations.setdefault(trace_span.name, []).append(trace_span.duration or 0.0)
+            for key, value in trace_span.metrics.items():
+                metrics.setdefault(trace_span.name, {})
+                metrics[trace_span.name][key] = metrics[trace_span.name].get(key, 0) + value
+
+    span_percentiles: dict[str, dict[str, float]] = {}
+
+    for name, span_durations in durations.items():
+        sorted_durations = sorted(span_durations)
+        span_percentiles[name] = {"count": len(sorted_durations)}
+
+        for percentile in SPAN_PERCENTILES:
+            span_percentiles[name]["p" + str(percentile)] = get_percentile(sorted_durations, percentile)
+
+        span_percentiles[name]["max"] = sorted_durations[-1]
+        span_percentiles[name].update(metrics.get(name, {}))
+
+    return span_percentiles
@@ -0,0 +1,81 @@
+import threading
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.documents import Document
+from langchain_core.outputs import LLMResult
+from langchain_core.runnables import RunnableConfig
+from typing import Any, Sequence
+from uuid import UUID
+
+# Own modules
+# The langchain callbacks are kept apart from instrumentation.py, so that the CLI starts without importing langchain
+from instrumentation import Span, open_span
+
+
+#################################
+# This callback handler records a span for each LLM request (with the tokens in/out) and each retrieval
+# from the vector store (with the number of documents) of a langchain run.
+#################################
+class InstrumentationCallbackHandler(BaseCallbackHandler):
+    def __init__(self) -> None:
+        self.open_spans: dict[UUID, Span] = {}
+        self.lock = threading.Lock()
+
+    def start_span(self, run_id: UUID, name: str, **attributes: Any) -> None:
+        new_span = open_span(name, **attributes)
+
+        if new_span is not None:
+            with self.lock:
+                self.open_spans[run_id] = new_span
+
+    def end_span(self, run_id: UUID, metrics: dict[str, float], error: BaseException | None = None) -> None:
+        with self.lock:
+            ended_span = self.open_spans.pop(run_id, None)
+
+        if ended_span is None:
+            return
+
+        ended_span.end()
+        ended_span.metrics.update(metrics)
+        if error is not None:
+            ended_span.attributes["error"] = repr(error)
+
+    def on_chat_model_start(self, serialized: dict[str, Any], messages: list[list[Any]], *, run_id: UUID, **kwargs: Any) -> None:
+        self.start_span(run_id, "llm_generation", model=str((kwargs.get("invocation_params") or {}).get("model", "")))
+
+    def on_llm_start(self, serialized: dict[str, Any], prompts: list[str], *, run_id: UUID, **kwargs: Any) -> None:
+        self.start_span(run_id, "llm_generation", model=str((kwargs.get("invocation_params") or {}).get("model", "")))
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        self.end_span(run_id, get_token_usage(response))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self.end_span(run_id, {}, error)
+
+    def on_retriever_start(self, serialized: dict[str, Any], query: str, *, run_id: UUID, **kwargs: Any) -> None:
+        self.start_span(run_id, "retrieval", retriever=str(kwargs.get("name", "")))
+
+    def on_retriever_end(self, documents: Sequence[Document], *, run_id: UUID, **kwargs: Any) -> None:
+        self.end_span(run_id, {"documents_retrieved": len(documents)})
+
+    def on_retriever_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self.end_span(run_id, {}, error)
+
+
+# Return the tokens in/out of an LLM response
+def get_token_usage(response: LLMResult) -> dict[str, float]:
+    tokens_in: int = 0
+    tokens_out: int = 0
+
+    for generations in response.generations:
+        for generation in generations:
+            usage_metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            tokens_in += usage_metadata.get("input_tokens", 0)
+            tokens_out += usage_metadata.get("output_tokens", 0)
+
+    return {"tokens_in": tokens_in, "tokens_out": tokens_out}
+
+
+# Config for invoking a langchain runnable, which records its LLM requests and retrievals in the current trace
+def get_instrumentation_config() -> RunnableConfig:
+    return RunnableConfig(callbacks=[InstrumentationCallbackHandler()])
@@ -0,0 +1,241 @@
+import re
+import unicodedata
+
+from functools import lru_cache
+
+
+#################################
+# Constants
+#################################
+# Key of the country "unknown" (e.g. if the LLM does not know where the data is stored)
+UNKNOWN_COUNTRY: str = "unknown"
+UNKNOWN_COUNTRY_ALIASES: list[str] = ["unknown", "n/a", "not known", "not specified", "unspecified", "not available", "none"]
+
+# Jurisdiction groups
+JURISDICTION_EU: str = "EU"
+JURISDICTION_EEA: str = "EEA"
+# The GDPR applies in the EEA (the EU, Iceland, Liechtenstein and Norway)
+JURISDICTION_GDPR: str = "GDPR"
+# Countries with an adequacy decision of the European Commission (transfers need no further safeguards).
+# The decision for the United States only covers organisations certified under the EU-U.S. Data Privacy Framework.
+JURISDICTION_EU_ADEQUACY: str = "EU_ADEQUACY"
+
+EU_COUNTRY_CODES: list[str] = ["AT", "BE", "BG", "HR", "CY", "CZ", "DK", "EE", "FI", "FR", "DE", "GR", "HU", "IE", "IT", "LV", "LT", "LU",
+                               "MT", "NL", "PL", "PT", "RO", "SK", "SI", "ES", "SE"]
+EEA_COUNTRY_CODES: list[str] = EU_COUNTRY_CODES + ["IS", "LI", "NO"]
+EU_ADEQUACY_COUNTRY_CODES: list[str] = ["AD", "AR", "CA", "FO", "GG", "IL", "IM", "JP", "JE", "NZ", "KR", "CH", "GB", "UY", "US"]
+
+JURISDICTION_GROUPS: dict[str, list[str]] = {
+    JURISDICTION_EU: EU_COUNTRY_CODES,
+    JURISDICTION_EEA: EEA_COUNTRY_CODES,
+    JURISDICTION_GDPR: EEA_COUNTRY_CODES,
+    JURISDICTION_EU_ADEQUACY: EU_ADEQUACY_COUNTRY_CODES
+}
+
+# Names of jurisdiction groups, which are used as a location (e.g. "data is stored in the EU"). They are looked up like a country,
+# with the group as key. CSPs usually mean their EU regions with "Europe".
+JURISDICTION_GROUP_ALIASES: dict[str, list[str]] = {
+    JURISDICTION_EU: ["European Union", "Europe", "Europaeische Union", "Union europeenne"],
+    JURISDICTION_EEA: ["European Economic Area", "Europaeischer Wirtschaftsraum"]
+}
+
+# ISO 3166-1 countries: alpha-2 code, alpha-3 code, short name
+ISO_COUNTRIES: list[tuple[str, str, str]] = [
+    ("AD", "AND", "Andorra"), ("AE", "ARE", "United Arab Emirates"), ("AF", "AFG", "Afghanistan"), ("AG", "ATG", "Antigua and Barbuda"),
+    ("AI", "AIA", "Anguilla"), ("AL", "ALB", "Albania"), ("AM", "ARM", "Armenia"), ("AO", "AGO", "Angola"), ("AQ", "ATA", "Antarctica"),
+    ("AR", "ARG", "Argentina"), ("AS", "ASM", "American Samoa"), ("AT", "AUT", "Austria"), ("AU", "AUS", "Australia"), ("AW", "ABW", "Aruba"),
+    ("AX", "ALA", "Aland Islands"), ("AZ", "AZE", "Azerbaijan"), ("BA", "BIH", "Bosnia and Herzegovina"), ("BB", "BRB", "Barbados"),
+    ("BD", "BGD", "Bangladesh"), ("BE", "BEL", "Belgium"), ("BF", "BFA", "Burkina Faso"), ("BG", "BGR", "Bulgaria"), ("BH", "BHR", "Bahrain"),
+    ("BI", "BDI", "Burundi"), ("BJ", "BEN", "Benin"), ("BL", "BLM", "Saint Barthelemy"), ("BM", "BMU", "Bermuda"), ("BN", "BRN", "Brunei Darussalam"),
+    ("BO", "BOL", "Bolivia"), ("BQ", "BES", "Bonaire, Sint Eustatius and Saba"), ("BR", "BRA", "Brazil"), ("BS", "BHS", "Bahamas"),
+    ("BT", "BTN", "Bhutan"), ("BV", "BVT", "Bouvet Island"), ("BW", "BWA", "Botswana"), ("BY", "BLR", "Belarus"), ("BZ", "BLZ", "Belize"),
+    ("CA", "CAN", "Canada"), ("CC", "CCK", "Cocos (Keeling) Islands"), ("CD", "COD", "Democratic Republic of the Congo"),
+    ("CF", "CAF", "Central African Republic"), ("CG", "COG", "Congo"), ("CH", "CHE", "Switzerland"), ("CI", "CIV", "Cote d'Ivoire"),
+    ("CK", "COK", "Cook Islands"), ("CL", "CHL", "Chile"), ("CM", "CMR", "Cameroon"), ("CN", "CHN", "China"), ("CO", "COL", "Colombia"),
+    ("CR", "CRI", "Costa Rica"), ("CU", "CUB", "Cuba"), ("CV", "CPV", "Cabo Verde"), ("CW", "CUW", "Curacao"), ("CX", "CXR", "Christmas Island"),
+    ("CY", "CYP", "Cyprus"), ("CZ", "CZE", "Czechia"), ("DE", "DEU", "Germany"), ("DJ", "DJI", "Djibouti"), ("DK", "DNK", "Denmark"),
+    ("DM", "DMA", "Dominica"), ("DO", "DOM", "Dominican Republic"), ("DZ", "DZA", "Algeria"), ("EC", "ECU", "Ecuador"), ("EE", "EST", "Estonia"),
+    ("EG", "EGY", "Egypt"), ("EH", "ESH", "Western Sahara"), ("ER", "ERI", "Eritrea"), ("ES", "ESP", "Spain"), ("ET", "ETH", "Ethiopia"),
+    ("FI", "FIN", "Finland"), ("FJ", "FJI", "Fiji"), ("FK", "FLK", "Falkland Islands"), ("FM", "FSM", "Micronesia"), ("FO", "FRO", "Faroe Islands"),
+    ("FR", "FRA", "France"), ("GA", "GAB", "Gabon"), ("GB", "GBR", "United Kingdom"), ("GD", "GRD", "Grenada"), ("GE", "GEO", "Georgia"),
+    ("GF", "GUF", "French Guiana"), ("GG", "GGY", "Guernsey"), ("GH", "GHA", "Ghana"), ("GI", "GIB", "Gibraltar"), ("GL", "GRL", "Greenland"),
+    ("GM", "GMB", "Gambia"), ("GN", "GIN", "Guinea"), ("GP", "GLP", "Guadeloupe"), ("GQ", "GNQ", "Equatorial Guinea"), ("GR", "GRC", "Greece"),
+    ("GS", "SGS", "South Georgia and the South Sandwich Islands"), ("GT", "GTM", "Guatemala"), ("GU", "GUM", "Guam"), ("GW", "GNB", "Guinea-Bissau"),
+    ("GY", "GUY", "Guyana"), ("HK", "HKG", "Hong Kong"), ("HM", "HMD", "Heard Island and McDonald Islands"), ("HN", "HND", "Honduras"),
+    ("HR", "HRV", "Croatia"), ("HT", "HTI", "Haiti"), ("HU", "HUN", "Hungary"), ("ID", "IDN", "Indonesia"), ("IE", "IRL", "Ireland"),
+    ("IL", "ISR", "Israel"), ("IM", "IMN", "Isle of Man"), ("IN", "IND", "India"), ("IO", "IOT", "British Indian Ocean Territory"), ("IQ", "IRQ", "Iraq"),
+    ("IR", "IRN", "Iran"), ("IS", "ISL", "Iceland"), ("IT", "ITA", "Italy"), ("JE", "JEY", "Jersey"), ("JM", "JAM", "Jamaica"), ("JO", "JOR", "Jordan"),
+    ("JP", "JPN", "Japan"), ("KE", "KEN", "Kenya"), ("KG", "KGZ", "Kyrgyzstan"), ("KH", "KHM", "Cambodia"), ("KI", "KIR", "Kiribati"),
+    ("KM", "COM", "Comoros"), ("KN", "KNA", "Saint Kitts and Nevis"), ("KP", "PRK", "North Korea"), ("KR", "KOR", "South Korea"),
+    ("KW", "KWT", "Kuwait"), ("KY", "CYM", "Cayman Islands"), ("KZ", "KAZ", "Kazakhstan"), ("LA", "LAO", "Laos"), ("LB", "LBN", "Lebanon"),
+    ("LC", "LCA", "Saint Lucia"), ("LI", "LIE", "Liechtenstein"), ("LK", "LKA", "Sri Lanka"), ("LR", "LBR", "Liberia"), ("LS", "LSO", "Lesotho"),
+    ("LT", "LTU", "Lithuania"), ("LU", "LUX", "Luxembourg"), ("LV", "LVA", "Latvia"), ("LY", "LBY", "Libya"), ("MA", "MAR", "Morocco"),
+    ("MC", "MCO", "Monaco"), ("MD", "MDA", "Moldova"), ("ME", "MNE", "Montenegro"), ("MF", "MAF", "Saint Martin (French part)"),
+    ("MG", "MDG", "Madagascar"), ("MH", "MHL", "Marshall Islands"), ("MK", "MKD", "North Macedonia"), ("ML", "MLI", "Mali"), ("MM", "MMR", "Myanmar"),
+    ("MN", "MNG", "Mongolia"), ("MO", "MAC", "Macao"), ("MP", "MNP", "Northern Mariana Islands"), ("MQ", "MTQ", "Martinique"),
+    ("MR", "MRT", "Mauritania"), ("MS", "MSR", "Montserrat"), ("MT", "MLT", "Malta"), ("MU", "MUS", "Mauritius"), ("MV", "MDV", "Maldives"),
+    ("MW", "MWI", "Malawi"), ("MX", "MEX", "Mexico"), ("MY", "MYS", "Malaysia"), ("MZ", "MOZ", "Mozambique"), ("NA", "NAM", "Namibia"),
+    ("NC", "NCL", "New Caledonia"), ("NE", "NER", "Niger"), ("NF", "NFK", "Norfolk Island"), ("NG", "NGA", "Nigeria"), ("NI", "NIC", "Nicaragua"),
+    ("NL", "NLD", "Netherlands"), ("NO", "NOR", "Norway"), ("NP", "NPL", "Nepal"), ("NR", "NRU", "Nauru"), ("NU", "NIU", "Niue"),
+    ("NZ", "NZL", "New Zealand"), ("OM", "OMN", "Oman"), ("PA", "PAN", "Panama"), ("PE", "PER", "Peru"), ("PF", "PYF", "French Polynesia"),
+    ("PG", "PNG", "Papua New Guinea"), ("PH", "PHL", "Philippines"), ("PK", "PAK", "Pakistan"), ("PL", "POL", "Poland"),
+    ("PM", "SPM", "Saint Pierre and Miquelon"), ("PN", "PCN", "Pitcairn"), ("PR", "PRI", "Puerto Rico"), ("PS", "PSE", "Palestine"),
+    ("PT", "PRT", "Portugal"), ("PW", "PLW", "Palau"), ("PY", "PRY", "Paraguay"), ("QA", "QAT", "Qatar"), ("RE", "REU", "Reunion"),
+    ("RO", "ROU", "Romania"), ("RS", "SRB", "Serbia"), ("RU", "RUS", "Russia"), ("RW", "RWA", "Rwanda"), ("SA", "SAU", "Saudi Arabia"),
+    ("SB", "SLB", "Solomon Islands"), ("SC", "SYC", "Seychelles"), ("SD", "SDN", "Sudan"), ("SE", "SWE", "Sweden"), ("SG", "SGP", "Singapore"),
+    ("SH", "SHN", "Saint Helena, Ascension and Tristan da Cunha"), ("SI", "SVN", "Slovenia"), ("SJ", "SJM", "Svalbard and Jan Mayen"),
+    ("SK", "SVK", "Slovakia"), ("SL", "SLE", "Sierra Leone"), ("SM", "SMR", "San Marino"), ("SN", "SEN", "Senegal"), ("SO", "SOM", "Somalia"),
+    ("SR", "SUR", "Suriname"), ("SS", "SSD", "South Sudan"), ("ST", "STP", "Sao Tome and Principe"), ("SV", "SLV", "El Salvador"),
+    ("SX", "SXM", "Sint Maarten (Dutch part)"), ("SY", "SYR", "Syria"), ("SZ", "SWZ", "Eswatini"), ("TC", "TCA", "Turks and Caicos Islands"),
+    ("TD", "TCD", "Chad"), ("TF", "ATF", "French Southern Territories"), ("TG", "TGO", "Togo"), ("TH", "THA", "Thailand"), ("TJ", "TJK", "Tajikistan"),
+    ("TK", "TKL", "Tokelau"), ("TL", "TLS", "Timor-Leste"), ("TM", "TKM", "Turkmenistan"), ("TN", "TUN", "Tunisia"), ("TO", "TON", "Tonga"),
+    ("TR", "TUR", "Turkey"), ("TT", "TTO", "Trinidad and Tobago"), ("TV", "TUV", "Tuvalu"), ("TW", "TWN", "Taiwan"), ("TZ", "TZA", "Tanzania"),
+    ("UA", "UKR", "Ukraine"), ("UG", "UGA", "Uganda"), ("UM", "UMI", "United States Minor Outlying Islands"), ("US", "USA", "United States"),
+    ("UY", "URY", "Uruguay"), ("UZ", "UZB", "Uzbekistan"), ("VA", "VAT", "Holy See"), ("VC", "VCT", "Saint Vincent and the Grenadines"),
+    ("VE", "VEN", "Venezuela"), ("VG", "VGB", "British Virgin Islands"), ("VI", "VIR", "United States Virgin Islands"), ("VN", "VNM", "Viet Nam"),
+    ("VU", "VUT", "Vanuatu"), ("WF", "WLF", "Wallis and Futuna"), ("WS", "WSM", "Samoa"), ("YE", "YEM", "Yemen"), ("YT", "MYT", "Mayotte"),
+    ("ZA", "ZAF", "South Africa"), ("ZM", "ZMB", "Zambia"), ("ZW", "ZWE", "Zimbabwe")
+]
+
+# Further names of the countries (official and former names, names in the national languages, common abbreviations)
+COUNTRY_ALIASES: dict[str, list[str]] = {
+    "AE": ["UAE", "Emirates"],
+    "AT": ["Oesterreich", "Osterreich", "Republic of Austria"],
+    "BE": ["Belgique", "Belgie", "Belgien", "Kingdom of Belgium"],
+    "BG": ["Republic of Bulgaria"],
+    "BO": ["Plurinational State of Bolivia"],
+    "BN": ["Brunei"],
+    "CD": ["DR Congo", "DRC", "Congo-Kinshasa"],
+    "CG": ["Republic of the Congo", "Congo-Brazzaville"],
+    "CH": ["Schweiz", "Suisse", "Svizzera", "Swiss Confederation", "Confoederatio Helvetica"],
+    "CI": ["Ivory Coast"],
+    "CN": ["People's Republic of China", "PRC", "Mainland China"],
+    "CV": ["Cape Verde"],
+    "CY": ["Republic of Cyprus"],
+    "CZ": ["Czech Republic", "Ceska republika", "Cesko"],
+    "DE": ["Deutschland", "Federal Republic of Germany", "Allemagne", "Germania", "Alemania"],
+    "DK": ["Danmark", "Kingdom of Denmark"],
+    "EE": ["Eesti", "Republic of Estonia"],
+    "ES": ["Espana", "Kingdom of Spain", "Spanien"],
+    "FI": ["Suomi", "Republic of Finland"],
+    "FM": ["Federated States of Micronesia"],
+    "FR": ["French Republic", "Frankreich", "Francia"],
+    "GB": ["UK", "Great Britain", "Britain", "England", "Scotland", "Wales", "Northern Ireland",
+           "United Kingdom of Great Britain and Northern Ireland", "Grossbritannien"],
+    "GR": ["Hellas", "Hellenic Republic", "Ellada", "Griechenland"],
+    "HK": ["Hong Kong SAR"],
+    "HR": ["Hrvatska", "Republic of Croatia"],
+    "HU": ["Magyarorszag", "Ungarn"],
+    "IE": ["Eire", "Republic of Ireland", "Irland"],
+    "IR": ["Islamic Republic of Iran"],
+    "IT": ["Italia", "Italian Republic", "Italien"],
+    "KP": ["Democratic People's Republic of Korea", "DPRK"],
+    "KR": ["Korea", "Republic of Korea"],
+    "LA": ["Lao People's Democratic Republic"],
+    "LT": ["Lietuva", "Republic of Lithuania"],
+    "LU": ["Letzebuerg", "Grand Duchy of Luxembourg", "Luxemburg"],
+    "LV": ["Latvija", "Republic of Latvia"],
+    "MD": ["Republic of Moldova"],
+    "MK": ["Macedonia", "Republic of North Macedonia"],
+    "MM": ["Burma"],
+    "MO": ["Macau"],
+    "MT": ["Republic of Malta"],
+    "NL": ["Holland", "The Netherlands", "Nederland", "Kingdom of the Netherlands", "Niederlande"],
+    "NO": ["Norge", "Kingdom of Norway", "Norwegen"],
+    "PL": ["Polska", "Republic of Poland", "Polen"],
+    "PS": ["State of Palestine"],
+    "PT": ["Portuguese Republic"],
+    "RO": ["Rumania", "Rumaenien"],
+    "RU": ["Russian Federation"],
+    "SE": ["Sverige", "Kingdom of Sweden", "Schweden"],
+    "SI": ["Slovenija", "Republic of Slovenia"],
+    "SK": ["Slovensko", "Slovak Republic"],
+    "SY": ["Syrian Arab Republic"],
+    "SZ": ["Swaziland"],
+    "TL": ["East Timor"],
+    "TR": ["Turkiye", "Republic of Turkiye"],
+    "TW": ["Republic of China"],
+    "TZ": ["United Republic of Tanzania"],
+    "US": ["USA", "US", "U.S.", "U.S.A.", "United States of America", "America", "Vereinigte Staaten"],
+    "VA": ["Vatican", "Vatican City"],
+    "VE": ["Bolivarian Republic of Venezuela"],
+    "VN": ["Vietnam"]
+}
+
+
+#################################
+# This class maps country names (short names, aliases, ISO alpha-2 and alpha-3 codes) to their ISO alpha-2 code,
+# and the codes to their jurisdiction groups. Names of jurisdiction groups (e.g. "EU") are mapped to the group.
+# The names are normalized (case, accents, punctuation), so that each lookup is a single dict access.
+#################################
+class JurisdictionIndex():
+    def __init__(self, countries: list[tuple[str, str, str]] = ISO_COUNTRIES, aliases: dict[str, list[str]] = COUNTRY_ALIASES,
+                 groups: dict[str, list[str]] = JURISDICTION_GROUPS,
+                 group_aliases: dict[str, list[str]] = JURISDICTION_GROUP_ALIASES) -> None:
+        self.country_names: dict[str, str] = {alpha_2: name for alpha_2, alpha_3, name in countries}
+        self.country_codes: dict[str, str] = {}
+
+        for alpha_2, alpha_3, name in countries:
+            for country_name in [alpha_2, alpha_3, name] + aliases.get(alpha_2, []):
+                self.country_codes[normalize_country_name(country_name)] = alpha_2
+
+        for unknown_alias in UNKNOWN_COUNTRY_ALIASES:
+            self.country_codes[normalize_country_name(unknown_alias)] = UNKNOWN_COUNTRY
+
+        # A group used as a location belongs to all groups, which contain all of its countries (e.g. the EU to the GDPR group)
+        group_members: dict[str, set[str]] = {group: set(country_codes) for group, country_codes in groups.items()}
+
+        for location_group, group_names in group_aliases.items():
+            self.country_names[location_group] = group_names[0]
+            for group_name in [location_group] + group_names:
+                self.country_codes[normalize_country_name(group_name)] = location_group
+
+            for members in group_members.values():
+                if set(groups[location_group]).issubset(members):
+                    members.add(location_group)
+
+        self.groups: dict[str, frozenset[str]] = {group: frozenset(members) for group, members in group_members.items()}
+
+    # Return the ISO alpha-2 code of the country, UNKNOWN_COUNTRY for "unknown", or None if the name is not known
+    def lookup(self, country_name: str) -> str | None:
+        return self.country_codes.get(normalize_country_name(country_name))
+
+    # Return a key, which is equal for all names of a country: the ISO alpha-2 code, the jurisdiction group (e.g. "EU"),
+    # UNKNOWN_COUNTRY, or the normalized name (if the country is not known)
+    def get_country_key(self, country_name: str) -> str:
+        normalized_name = normalize_country_name(country_name)
+        return self.country_codes.get(normalized_name, normalized_name)
+
+    def is_unknown(self, country_name: str) -> bool:
+        return self.get_country_key(country_name) == UNKNOWN_COUNTRY
+
+    # Check if a country (name or key) belongs to a jurisdiction group
+    def is_in_group(self, country_name: str, group: str) -> bool:
+        return self.get_country_key(country_name) in self.groups[group]
+
+    def get_groups(self, country_name: str) -> list[str]:
+        country_key = self.get_country_key(country_name)
+        return [group for group, country_codes in self.groups.items() if country_key in country_codes]
+
+    def get_country_name(self, country_key: str) -> str:
+        return self.country_names.get(country_key, country_key)
+
+
+#################################
+# Functions
+#################################
+# Normalize a country name for the lookup: lower case, without accents, dots, apostrophes, brackets and a leading "the"
+@lru_cache(maxsize=4096)
+def normalize_country_name(country_name: str) -> str:
+    normalized_name = unicodedata.normalize("NFKD", country_name).encode("ascii", "ignore").decode("ascii").casefold()
+    normalized_name = re.sub(r"[.'()]", "", normalized_name)
+    normalized_name = re.sub(r"[\s,_-]+", " ", normalized_name).strip()
+
+    if normalized_name.startswith("the "):
+        normalized_name = normalized_name[4:]
+
+    return normalized_name
+
+
+# Index used by the risk calculation
+jurisdiction_index: JurisdictionIndex = JurisdictionIndex()
@@ -0,0 +1,183 @@
+import hashlib
+import logging
+import re
+import sqlite3
+import string
+import threading
+import time
+
+from typing import Any
+
+# Own modules
+from llm_data import LLMPrompts
+
+
+#################################
+# Global variables
+#################################
+logger = logging.getLogger(__name__)
+
+
+#################################
+# Constants
+#################################
+LLM_CACHE_DB_FILE: str = "llm_cache.db"
+LLM_CACHE_MAX_ENTRIES: int = 10000
+LLM_CACHE_DEFAULT_TTL: int = 7 * 24 * 3600
+
+# Time-to-live (in seconds) per prompt family. The family is the name of the prompt in LLMPrompts.
+# CVEs change often, while the supported features and the data location of a CSP rarely change.
+LLM_CACHE_TTLS: dict[str, int] = {
+    "PROMT_CHECK_CSP_DATA_EXTRACT": 30 * 24 * 3600,
+    "PROMT_CHECK_RISK_LACK_OF_CONTROL_DATA_EXTRACT": 24 * 3600,
+    "PROMT_CHECK_RISK_INSEC_AUTH_1_DATA_EXTRACT": 30 * 24 * 3600,
+    "PROMT_CHECK_RISK_INSEC_AUTH_2_DATA_EXTRACT": 30 * 24 * 3600,
+    "PROMT_CHECK_RISK_COMP_ISSUES_1_DATA_EXTRACT": 14 * 24 * 3600,
+    "PROMT_CHECK_LIKELIHOODS_DATA_EXTRACT": 30 * 24 * 3600
+}
+
+
+# Build a regex for a prompt template, which matches all prompts formatted from this template
+def get_prompt_template_regex(template: str) -> re.Pattern[str]:
+    regex: str = ""
+
+    for literal_text, field_name, format_spec, conversion in string.Formatter().parse(template):
+        regex += re.escape(literal_text)
+        if field_name is not None:
+            regex += ".*?"
+
+    return re.compile(regex, re.DOTALL)
+
+
+PROMPT_FAMILY_REGEXES: dict[str, re.Pattern[str]] = {name: get_prompt_template_regex(getattr(LLMPrompts, name))
+                                                     for name in vars(LLMPrompts) if name.startswith("PROMT_")}
+
+
+#################################
+# This class stores answers from the LLM on disk (sqlite).
+# Entries are keyed by data-gathering method, model name and the formatted prompts. They expire after the TTL of
+# their prompt family, and the least recently used entries are evicted if the cache grows above max_entries.
+#################################
+class LLMAnswerCache():
+    def __init__(self, db_file_name: str = LLM_CACHE_DB_FILE, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 ttls: dict[str, int] | None = None, default_ttl: int = LLM_CACHE_DEFAULT_TTL) -> None:
+        self.db_file_name = db_file_name
+        self.max_entries = max_entries
+        self.ttls: dict[str, int] = LLM_CACHE_TTLS if ttls is None else ttls
+        self.default_ttl = default_ttl
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.expired: int = 0
+        self.evictions: int = 0
+
+        # The connection is opened on first use, and shared by all threads
+        self.connection: sqlite3.Connection | None = None
+        self.lock = threading.Lock()
+
+    # Open the database, and create the table if it does not exist yet
+    def get_connection(self) -> sqlite3.Connection:
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.db_file_name, check_same_thread=False)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS llm_answers ("
+                                    "cache_key TEXT PRIMARY KEY, "
+                                    "prompt_family TEXT NOT NULL, "
+                                    "answer TEXT NOT NULL, "
+                                    "created_at REAL NOT NULL, "
+                                    "expires_at REAL NOT NULL, "
+                                    "last_access REAL NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS llm_answers_last_access ON llm_answers (last_access)")
+            self.connection.commit()
+
+        return self.connection
+
+    # Return the name of the prompt in LLMPrompts, from which the formatted prompt was created
+    def get_prompt_family(self, prompt: str) -> str:
+        for name, regex in PROMPT_FAMILY_REGEXES.items():
+            if regex.fullmatch(prompt):
+                return name
+
+        return "UNKNOWN"
+
+    # Time-to-live (in seconds) for the answer to a formatted prompt
+    def get_ttl(self, prompt: str) -> int:
+        return self.ttls.get(self.get_prompt_family(prompt), self.default_ttl)
+
+    # Create the key of a cache entry
+    def get_key(self, method: str, model_name: str, question_google: str, question_data_extract: str) -> str:
+        key_input: str = "\x1f".join([method, model_name, question_google, question_data_extract])
+
+        return hashlib.sha256(key_input.encode("utf-8")).hexdigest()
+
+    # Return the cached answer, or None if there is no valid entry
+    def get(self, method: str, model_name: str, question_google: str, question_data_extract: str) -> str | None:
+        cache_key = self.get_key(method, model_name, question_google, question_data_extract)
+        now = time.time()
+
+        with self.lock:
+            connection = self.get_connection()
+            row = connection.execute("SELECT answer, expires_at FROM llm_answers WHERE cache_key = ?", (cache_key,)).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            if row[1] <= now:
+                connection.execute("DELETE FROM llm_answers WHERE cache_key = ?", (cache_key,))
+                connection.commit()
+                self.expired += 1
+                self.misses += 1
+                return None
+
+            connection.execute("UPDATE llm_answers SET last_access = ? WHERE cache_key = ?", (now, cache_key))
+            connection.commit()
+            self.hits += 1
+
+        answer: str = row[0]
+        return answer
+
+    # Store an answer, and evict the least recently used entries if the cache is full
+    def put(self, method: str, model_name: str, question_google: str, question_data_extract: str, answer: str) -> None:
+        cache_key = self.get_key(method, model_name, question_google, question_data_extract)
+        now = time.time()
+
+        with self.lock:
+            connection = self.get_connection()
+            connection.execute("INSERT OR REPLACE INTO llm_answers VALUES (?, ?, ?, ?, ?, ?)",
+                               (cache_key, self.get_prompt_family(question_data_extract), answer, now,
+                                now + self.get_ttl(question_data_extract), now))
+
+            entry_count: int = connection.execute("SELECT COUNT(*) FROM llm_answers").fetchone()[0]
+            if entry_count > self.max_entries:
+                evict_count = entry_count - self.max_entries
+                connection.execute("DELETE FROM llm_answers WHERE cache_key IN "
+                                   "(SELECT cache_key FROM llm_answers ORDER BY last_access ASC LIMIT ?)", (evict_count,))
+                self.evictions += evict_count
+
+            connection.commit()
+
+    # Remove all entries
+    def clear(self) -> None:
+        with self.lock:
+            connection = self.get_connection()
+            connection.execute("DELETE FROM llm_answers")
+            connection.commit()
+
+    # Hit/miss counters of this process
+    def get_stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0
+        }
+
+    # Close the database connection. It is reopened on the next access.
+    def close(self) -> None:
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
@@ -30,3 +30,7 @@ class LLMPrompts:
     PROMT_CHECK_RISK_COMP_ISSUES_1_DATA_EXTRACT: str = "In which countries does {csp} store their user's data by default? \
                 Only provide the default locations as output in a list. Ignore the ones additional to the default. \
                 If not possible, provide only the text 'unknown'. If there are multiple results, separate them with semicolons."
+
+    # --- Asking several likelihood questions in one request (batched question mode)
+    PROMT_CHECK_LIKELIHOODS_DATA_EXTRACT: str = "Answer each of the following questions with a likelihood from 0 to 100. \
+                Return the answers in the requested structure, using the name before the colon as key for each question.\n{questions}"
@@ -1,18 +1,19 @@
+import asyncio
+import json
 import logging
-import uuid
+import threading
+import time
 
 from abc import ABC, abstractmethod
 from enum import Enum
-from langchain.chains import RetrievalQAWithSourcesChain
-from langchain_chroma import Chroma
-from langchain_community.document_loaders import JSONLoader
-from langchain_community.retrievers.web_research import WebResearchRetriever
-from langchain_community.utilities.google_search import GoogleSearchAPIWrapper
-from langchain_core.messages.base import BaseMessage
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+from pydantic import BaseModel, Field, create_model
+from typing import Any
 
 # Own modules
-from cve_loader import CVELoader
+from cassette import Cassette, get_active_cassette
+from instrumentation import add_span_metrics
+from llm_cache import LLMAnswerCache
+from llm_data import LLMPrompts as prm
 
 
 #################################
@@ -21,6 +22,12 @@ from cve_loader import CVELoader
 logger = logging.getLogger(__name__)
 
 
+#################################
+# Constants
+#################################
+CHROMA_PERSIST_DIRECTORY: str = "./chroma_db_oai"
+
+
 #################################
 # This class provides an Enum for storing the different-data-gathering methods
 #################################
@@ -28,157 +35,277 @@ class DataGatheringMethod(Enum):
     GEMINI_SEARCH_SEPARATE = 1
     GEMINI_DIRECT = 2
     GEMINI_CVE_DB = 3
+    # CVE data taken directly from the CVE db, without LLM. Only available for the "lack of control" risk.
+    CVE_DB_DIRECT = 4
 
 
 #################################
 # This is a the abstract base-class for the LLM research runner
 #################################
 class LLMResearcher(ABC):
+    # Name of the LLM answering the questions (used e.g. as part of the cache key)
+    model_name: str = ""
+
     def __init__(self) -> None:
         pass
 
+    # If the csp_name is provided, the gathered data is stored in a persistent collection of this CSP, and reused
+    # by later questions and assessments. Otherwise a temporary collection is used.
     @abstractmethod
-    def get_research_results(self, question_google: str, question_data_extract: str, llm_test_mode: bool) -> str:
+    def get_research_results(self, question_google: str, question_data_extract: str, llm_test_mode: bool, csp_name: str | None = None) -> str:
         pass
 
+    # Async counterpart of get_research_results(), for running many questions on one event loop.
+    # There is no LLM-TEST-MODE, since it is interactive. By default, the synchronous method is run in a worker thread.
+    async def aget_research_results(self, question_google: str, question_data_extract: str, csp_name: str | None = None) -> str:
+        return await asyncio.to_thread(self.get_research_results, question_google, question_data_extract, False, csp_name)
 
-#################################
-# This class allows to search on google, and let an LLM process the result
-#################################
-class LLMResearcherGeminiSearch(LLMResearcher):
-    # Setup everything needed for executing a research command
-    def __init__(self) -> None:
-        self.vectorstore = Chroma(
-                                embedding_function=GoogleGenerativeAIEmbeddings(model="models/embedding-001"),
-                                persist_directory="./chroma_db_oai",
-                                collection_name=str(uuid.uuid4())
-                            )
-        self.llm = ChatGoogleGenerativeAI(
-                                model="gemini-1.5-flash",
-                                temperature=0
-                            )
-        self.search = GoogleSearchAPIWrapper()
-        self.web_research_retriever = WebResearchRetriever.from_llm(
-                                llm=self.llm,  # type: ignore[arg-type]
-                                vectorstore=self.vectorstore,
-                                search=self.search,
-                                allow_dangerous_requests=True,
-                                num_search_results=10
-                            )
-
-        self.qa_chain = RetrievalQAWithSourcesChain.from_chain_type(self.llm, retriever=self.vectorstore.as_retriever())
-
-    # Search something
-    def get_research_results(self, question_google: str, question_data_extract: str, llm_test_mode: bool) -> str:
-        # Search the web and store the result in the vectorstore
-        self.web_research_retriever.invoke(question_google)
-
-        logger.info("Asking the LLM: " + question_data_extract)
-
-        # Ask the LLM to extract information from the vectorstore
-        result = self.qa_chain.invoke(question_data_extract)
-
-        logger.info("Answer from LLM: " + result["answer"])
-
-        # LLM-TEST-MODE: allows the user to ask test different questions
-        if llm_test_mode:
-            print("LLM-TEST-MODE - Entering LLM Test Mode. Insert 'exit' to continue.")
-            user_input = input("LLM-TEST-MODE - Input: ")
-
-            while user_input != "exit":
-                result_tst = self.qa_chain.invoke(user_input)
-                print("LLM-TEST-MODE - Output: " + result_tst["answer"])
-                user_input = input("LLM-TEST-MODE - Input: ")
+    # Ask several likelihood questions (name -> (question_google, question_data_extract)) about a CSP.
+    # Returns the answer per question name, in the same format as get_research_results() (a number from 0 to 100).
+    # By default, the questions are asked one by one. Runners which support a batched question mode override this.
+    def get_likelihood_results(self, questions: dict[str, tuple[str, str]], csp_name: str | None = None) -> dict[str, str]:
+        return {name: self.get_research_results(question_google, question_data_extract, False, csp_name)
+                for name, (question_google, question_data_extract) in questions.items()}
 
-        result_cleansed = str(result["answer"]).replace("\n", "")
+    # Async counterpart of get_likelihood_results()
+    async def aget_likelihood_results(self, questions: dict[str, tuple[str, str]], csp_name: str | None = None) -> dict[str, str]:
+        return await asyncio.to_thread(self.get_likelihood_results, questions, csp_name)
 
-        return result_cleansed
+    # Statistics of the caches used by this research runner (e.g. avoided searches)
+    def get_stats(self) -> dict[str, Any]:
+        return {}
 
+    # Release the clients held by this research runner. The runner must not be used afterwards.
+    def close(self) -> None:
+        pass
 
-#################################
-# This class allows to provide a query directly to gemini AI
-#################################
-class LLMResearcherGeminiDirect(LLMResearcher):
-    # Setup everything needed for executing a research command
-    def __init__(self) -> None:
 
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-1.5-pro",
-            temperature=0,
-            max_tokens=None,
-            timeout=None,
-            max_retries=2
-        )
+# Build the prompt of the batched question mode, which contains all likelihood questions
+def get_likelihood_prompt(questions: dict[str, tuple[str, str]]) -> str:
+    question_lines: str = "\n".join(name + ": " + question_data_extract for name, (question_google, question_data_extract) in questions.items())
 
-    # Search something
-    def get_research_results(self, question_google: str, question_data_extract: str, llm_test_mode: bool) -> str:
+    prompt: str = prm.PROMT_CHECK_LIKELIHOODS_DATA_EXTRACT.format(questions=question_lines)
+    return prompt
 
-        logger.info("Asking the LLM: " + question_data_extract)
 
-        # Ask the LLM
-        result: BaseMessage = self.llm.invoke(question_data_extract)
+# Build the schema of the structured answer for the batched question mode: one likelihood (0 - 100) per question name
+def get_likelihood_schema(questions: dict[str, tuple[str, str]]) -> type[BaseModel]:
+    fields: dict[str, Any] = {name: (int, Field(ge=0, le=100, description=question_data_extract))
+                              for name, (question_google, question_data_extract) in questions.items()}
 
-        logger.info("Answer from LLM: " + str(result.content))
+    schema: type[BaseModel] = create_model("LikelihoodAnswers", **fields)
+    return schema
 
-        # LLM-TEST-MODE: allows the user to ask test different questions
-        if llm_test_mode:
-            print("LLM-TEST-MODE - Entering LLM Test Mode. Insert 'exit' to continue.")
-            user_input = input("LLM-TEST-MODE - Input: ")
 
-            while user_input != "exit":
-                result_tst = self.llm.invoke(user_input)
-                print("LLM-TEST-MODE - Output: " + str(result_tst.content))
-                user_input = input("LLM-TEST-MODE - Input: ")
+# Validate the structured answer of the LLM, and convert it to the answer format of get_research_results()
+def get_likelihood_answers(questions: dict[str, tuple[str, str]], schema: type[BaseModel], result: Any) -> dict[str, str]:
+    if not isinstance(result, schema):
+        raise ValueError("LLM did not return a structured answer: " + str(result))
 
-        return str(result.content)
+    return {name: str(getattr(result, name)) for name in questions}
 
 
 #################################
-# This class allows to search on the CVE database and extract the content with gemini
+# This class puts an LLMAnswerCache in front of another research runner.
+# Answers are only requested from the wrapped runner, if the cache does not contain a valid entry.
 #################################
-class LLMResearcherGeminiCVE(LLMResearcher):
-    # Setup everything needed for executing a research command
-    def __init__(self) -> None:
-        self.vectorstore = Chroma(
-                                embedding_function=GoogleGenerativeAIEmbeddings(model="models/embedding-001"),
-                                persist_directory="./chroma_db_oai",
-                                collection_name=str(uuid.uuid4())
-                            )
-        self.llm = ChatGoogleGenerativeAI(
-                                model="gemini-1.5-pro",
-                                temperature=0
-                            )
-        self.qa_chain = RetrievalQAWithSourcesChain.from_chain_type(self.llm, retriever=self.vectorstore.as_retriever())
+class CachedLLMResearcher(LLMResearcher):
+    def __init__(self, research_runner: LLMResearcher, data_gathering_method: DataGatheringMethod, answer_cache: LLMAnswerCache) -> None:
+        self.research_runner = research_runner
+        self.data_gathering_method = data_gathering_method
+        self.answer_cache = answer_cache
+        self.model_name = research_runner.model_name
 
     # Search something
-    def get_research_results(self, csp_name: str, question_data_extract: str, llm_test_mode: bool) -> str:
-        # Invoke the CVE API and search for all CVEs for this CSP
-        cve_loader: CVELoader = CVELoader()
-        cve_list_file_name = cve_loader.get_CVEs_for_string(csp_name)
-
-        loader: JSONLoader = JSONLoader(cve_list_file_name, jq_schema=".", text_content=False)
-        cve_documents = loader.load()
-
-        # Add json file to the vectorstore
-        self.vectorstore.add_documents(documents=cve_documents)
-
-        logger.info("Asking the LLM: " + question_data_extract)
-
-        # Ask the LLM to extract information from the vectorstore
-        result = self.qa_chain.invoke(question_data_extract)
-
-        logger.info("Answer from LLM: " + result["answer"])
-
-        # LLM-TEST-MODE: allows the user to ask test different questions
+    def get_research_results(self, question_google: str, question_data_extract: str, llm_test_mode: bool, csp_name: str | None = None) -> str:
+        # LLM-TEST-MODE is interactive. It always needs the wrapped runner.
         if llm_test_mode:
-            print("LLM-TEST-MODE - Entering LLM Test Mode. Insert 'exit' to continue.")
-            user_input = input("LLM-TEST-MODE - Input: ")
-
-            while user_input != "exit":
-                result_tst = self.qa_chain.invoke(user_input)
-                print("LLM-TEST-MODE - Output: " + result_tst["answer"])
-                user_input = input("LLM-TEST-MODE - Input: ")
+            return self.research_runner.get_research_results(question_google, question_data_extract, llm_test_mode, csp_name)
+
+        result: str | None = self.answer_cache.get(self.data_gathering_method.name, self.model_name, question_google, question_data_extract)
+
+        if result is not None:
+            logger.info("Answer from LLM cache: " + result)
+            add_span_metrics(llm_cache_hits=1)
+            return result
+
+        result = self.research_runner.get_research_results(question_google, question_data_extract, llm_test_mode, csp_name)
+        self.answer_cache.put(self.data_gathering_method.name, self.model_name, question_google, question_data_extract, result)
+
+        return result
+
+    # Search something (async)
+    async def aget_research_results(self, question_google: str, question_data_extract: str, csp_name: str | None = None) -> str:
+        result: str | None = self.answer_cache.get(self.data_gathering_method.name, self.model_name, question_google, question_data_extract)
+
+        if result is not None:
+            logger.info("Answer from LLM cache: " + result)
+            add_span_metrics(llm_cache_hits=1)
+            return result
+
+        result = await self.research_runner.aget_research_results(question_google, question_data_extract, csp_name)
+        self.answer_cache.put(self.data_gathering_method.name, self.model_name, question_google, question_data_extract, result)
+
+        return result
+
+    # The answers of the batched question mode are cached as one entry (JSON) for all questions
+    def get_likelihood_results(self, questions: dict[str, tuple[str, str]], csp_name: str | None = None) -> dict[str, str]:
+        prompt = get_likelihood_prompt(questions)
+        cached_results: str | None = self.answer_cache.get(self.data_gathering_method.name, self.model_name, "", prompt)
+
+        if cached_results is not None:
+            logger.info("Answer from LLM cache: " + cached_results)
+            add_span_metrics(llm_cache_hits=1)
+            return dict(json.loads(cached_results))
+
+        results = self.research_runner.get_likelihood_results(questions, csp_name)
+        self.answer_cache.put(self.data_gathering_method.name, self.model_name, "", prompt, json.dumps(results))
+
+        return results
+
+    # The answers of the batched question mode are cached as one entry (JSON) for all questions (async)
+    async def aget_likelihood_results(self, questions: dict[str, tuple[str, str]], csp_name: str | None = None) -> dict[str, str]:
+        prompt = get_likelihood_prompt(questions)
+        cached_results: str | None = self.answer_cache.get(self.data_gathering_method.name, self.model_name, "", prompt)
+
+        if cached_results is not None:
+            logger.info("Answer from LLM cache: " + cached_results)
+            add_span_metrics(llm_cache_hits=1)
+            return dict(json.loads(cached_results))
+
+        results = await self.research_runner.aget_likelihood_results(questions, csp_name)
+        self.answer_cache.put(self.data_gathering_method.name, self.model_name, "", prompt, json.dumps(results))
+
+        return results
+
+    def get_stats(self) -> dict[str, Any]:
+        return self.research_runner.get_stats()
+
+    def close(self) -> None:
+        self.research_runner.close()
+
+
+# Create a runner, whose requests to Gemini, the embeddings, the google search and the web pages are recorded to (or replayed from)
+# the cassette. In replay mode, no Google client is created (no API keys needed). The vector store and the search cache are kept
+# in memory, so that each run starts empty and sends the same requests. The prompts depend on context_compression, so a cassette
+# can only be replayed with the setting it was recorded with.
+def create_cassette_runner(data_gathering_method: DataGatheringMethod, cassette: Cassette, context_compression: bool = False) -> LLMResearcher:
+    from cassette_langchain import CassetteChatModel, CassetteEmbeddings
+
+    recording: bool = cassette.is_recording()
+
+    match data_gathering_method:
+        case DataGatheringMethod.GEMINI_SEARCH_SEPARATE:
+            import chromadb
+            from embedding_cache import EMBEDDING_MODEL, create_default_embeddings
+            from llm_researcher_search import LLMResearcherGeminiSearch, ThreadSafeGoogleSearchAPIWrapper
+            from page_fetcher import CassettePageFetcher
+            from search_cache import CassetteGoogleSearchAPIWrapper, SearchResultCache
+
+            runner: LLMResearcher = LLMResearcherGeminiSearch(
+                        llm=CassetteChatModel(cassette=cassette, model_name=LLMResearcherGeminiSearch.model_name,
+                                              chat_model=LLMResearcherGeminiSearch.create_default_llm() if recording else None),
+                        embeddings=CassetteEmbeddings(cassette, EMBEDDING_MODEL, create_default_embeddings() if recording else None),
+                        chroma_client=chromadb.EphemeralClient(),
+                        search_wrapper=CassetteGoogleSearchAPIWrapper(cassette=cassette,
+                                                                      search_wrapper=ThreadSafeGoogleSearchAPIWrapper() if recording else None),
+                        search_cache=SearchResultCache(":memory:"),
+                        page_fetcher=CassettePageFetcher(cassette, ":memory:"),
+                        context_compression=context_compression
+                    )
+        case DataGatheringMethod.GEMINI_DIRECT:
+            from llm_researcher_direct import LLMResearcherGeminiDirect
+
+            runner = LLMResearcherGeminiDirect(
+                        llm=CassetteChatModel(cassette=cassette, model_name=LLMResearcherGeminiDirect.model_name,
+                                              chat_model=LLMResearcherGeminiDirect.create_default_llm() if recording else None)
+                    )
+        case DataGatheringMethod.GEMINI_CVE_DB:
+            import chromadb
+            from embedding_cache import EMBEDDING_MODEL, create_default_embeddings
+            from llm_researcher_cve import LLMResearcherGeminiCVE
+
+            runner = LLMResearcherGeminiCVE(
+                        llm=CassetteChatModel(cassette=cassette, model_name=LLMResearcherGeminiCVE.model_name,
+                                              chat_model=LLMResearcherGeminiCVE.create_default_llm() if recording else None),
+                        embeddings=CassetteEmbeddings(cassette, EMBEDDING_MODEL, create_default_embeddings() if recording else None),
+                        chroma_client=chromadb.EphemeralClient(),
+                        context_compression=context_compression
+                    )
+        case _:
+            raise ValueError("No research runner available for " + data_gathering_method.name)
+
+    return runner
 
-        result_cleansed: str = result["answer"]
 
-        return result_cleansed
+#################################
+# This class keeps one warm research runner per data-gathering method.
+# The runners (and their LLM, embedding, search and vector store clients) are created on first use, and then
+# shared by all questions and assessments until close() is called.
+#################################
+class LLMResearcherRegistry():
+    # If an answer_cache is provided, all runners are wrapped with a CachedLLMResearcher.
+    # With context_compression, the runners compress the retrieved documents before they are passed to the LLM (see context_compression.py).
+    def __init__(self, answer_cache: LLMAnswerCache | None = None, context_compression: bool = False) -> None:
+        self.answer_cache = answer_cache
+        self.context_compression = context_compression
+        self.runners: dict[DataGatheringMethod, LLMResearcher] = {}
+        self.setup_durations: dict[DataGatheringMethod, float] = {}
+        self.lock = threading.Lock()
+
+    # Return the runner for the data-gathering method. It is created, if it does not exist yet.
+    def get_runner(self, data_gathering_method: DataGatheringMethod) -> LLMResearcher:
+        with self.lock:
+            if data_gathering_method not in self.runners:
+                setup_start_time = time.perf_counter()
+                runner: LLMResearcher = self.create_runner(data_gathering_method)
+
+                if self.answer_cache is not None:
+                    runner = CachedLLMResearcher(runner, data_gathering_method, self.answer_cache)
+
+                self.runners[data_gathering_method] = runner
+                self.setup_durations[data_gathering_method] = time.perf_counter() - setup_start_time
+
+                logger.info("Created research runner for " + data_gathering_method.name + " in " +
+                            str(round(self.setup_durations[data_gathering_method], 4)) + " seconds")
+
+            return self.runners[data_gathering_method]
+
+    # Create a new runner for the data-gathering method. If a cassette is active, the runner records (or replays) its requests.
+    # The module of a runner is imported here (not at the top of this module), since the dependencies of the backends
+    # (langchain, chroma, Google GenAI, nvdlib) take seconds to import. Only the backend of the chosen method is loaded.
+    def create_runner(self, data_gathering_method: DataGatheringMethod) -> LLMResearcher:
+        cassette = get_active_cassette()
+        if cassette is not None:
+            return create_cassette_runner(data_gathering_method, cassette, self.context_compression)
+
+        match data_gathering_method:
+            case DataGatheringMethod.GEMINI_SEARCH_SEPARATE:
+                from llm_researcher_search import LLMResearcherGeminiSearch
+                runner: LLMResearcher = LLMResearcherGeminiSearch(context_compression=self.context_compression)
+            case DataGatheringMethod.GEMINI_DIRECT:
+                from llm_researcher_direct import LLMResearcherGeminiDirect
+                runner = LLMResearcherGeminiDirect()
+            case DataGatheringMethod.GEMINI_CVE_DB:
+                from llm_researcher_cve import LLMResearcherGeminiCVE
+                runner = LLMResearcherGeminiCVE(context_compression=self.context_compression)
+            case _:
+                raise ValueError("No research runner available for " + data_gathering_method.name)
+
+        return runner
+
+    # Total time spent for creating research runners
+    def get_setup_duration(self) -> float:
+        return sum(self.setup_durations.values())
+
+    # Close all runners. New runners are created on the next call of get_runner().
+    def close(self) -> None:
+        with self.lock:
+            for runner in self.runners.values():
+                runner.close()
+
+            self.runners.clear()
+            self.setup_durations.clear()
+
+        if self.answer_cache is not None:
+            self.answer_cache.close()
@@ -0,0 +1,236 @@
+import asyncio
+import chromadb
+import logging
+import os
+import re
+
+from chromadb.api import ClientAPI
+from datetime import datetime, timedelta
+from langchain.chains import RetrievalQAWithSourcesChain
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.retrievers import BaseRetriever
+from langchain_google_genai import ChatGoogleGenerativeAI
+from typing import Any
+
+# Own modules
+from context_compression import get_compressing_retriever
+from cve_loader import CVE_PUBLISHED_PERIOD, CVELoader
+from embedding_cache import create_default_embeddings
+from instrumentation import add_span_metrics, span
+from instrumentation_langchain import get_instrumentation_config
+from llm_researcher import CHROMA_PERSIST_DIRECTORY, LLMResearcher
+from rate_limiter_langchain import get_langchain_rate_limiting
+from vector_store import VectorStoreManager, create_question_vectorstore
+
+
+#################################
+# Global variables
+#################################
+logger = logging.getLogger(__name__)
+
+
+#################################
+# Constants
+#################################
+# Number of CVE documents added to the vector store at once
+CVE_DOCUMENT_BATCH_SIZE: int = 100
+
+# Number of CVE documents passed to the LLM per question. Can be changed with the env variable CVE_RETRIEVAL_K.
+# One CVE document has at most about 150 tokens.
+# The CVSS total of the "lack of control" risk (see risk_calculator.py) only covers the retrieved CVEs. A CSP with more than k matching CVEs
+# is undercounted, e.g. 25 CVEs with an average score of 2.2 total 55 (HIGH), but the 20 retrieved ones only 44 (MEDIUM).
+CVE_RETRIEVAL_DEFAULT_K: int = 20
+
+# Relation of the CPEs of a CVE to the searched CSP ("vendor_match" metadata of the CVE documents).
+# CVEs of other vendors only mention the CSP (e.g. a plugin for it), and are not retrieved. CVEs which are not analysed yet have no CPEs.
+VENDOR_MATCH: str = "match"
+VENDOR_OTHER: str = "other"
+VENDOR_UNKNOWN: str = "unknown"
+
+
+# Convert a compact CVE record (see CVELoader) to a document for the vectorstore.
+# The metadata allows to filter the CVEs by publication date and vendor when they are retrieved.
+def get_cve_document(cve_record: dict[str, Any], search_string: str | None = None) -> Document:
+    page_content: str = (cve_record["cve_id"] + "; published: " + str(cve_record["published"]) +
+                         "; CVSS score: " + str(cve_record["cvss_score"]) + " (" + str(cve_record["cvss_version"]) + ")" +
+                         "; " + cve_record["description"])
+
+    metadata: dict[str, Any] = {
+        "source": "https://nvd.nist.gov/vuln/detail/" + cve_record["cve_id"],
+        "cve_id": cve_record["cve_id"],
+        "published": str(cve_record["published"]),
+        "published_ts": datetime.fromisoformat(cve_record["published"]).timestamp() if cve_record["published"] else 0.0,
+        "cvss_score": cve_record["cvss_score"] if cve_record["cvss_score"] is not None else -1.0,
+        "vendors": " ".join(cve_record.get("vendors", [])),
+        "products": " ".join(cve_record.get("products", [])),
+        "vendor_match": get_vendor_match(cve_record.get("vendors", []), cve_record.get("products", []), search_string)
+    }
+
+    return Document(page_content=page_content, metadata=metadata)
+
+
+# Check if the vendors and products of a CVE contain all words of the search string (like the keyword search of the NVD mirror)
+def get_vendor_match(vendors: list[str], products: list[str], search_string: str | None) -> str:
+    if len(vendors) == 0 and len(products) == 0:
+        return VENDOR_UNKNOWN
+
+    search_words = set(re.findall(r"[a-z0-9]+", (search_string or "").lower()))
+    cpe_words = set(re.findall(r"[a-z0-9]+", " ".join(vendors + products).lower()))
+
+    return VENDOR_MATCH if search_words <= cpe_words else VENDOR_OTHER
+
+
+#################################
+# This class allows to search on the CVE database and extract the content with gemini
+#################################
+class LLMResearcherGeminiCVE(LLMResearcher):
+    model_name: str = "gemini-1.5-pro"
+
+    # Setup everything needed for executing a research command
+    # The clients are created once and then shared by all questions (see LLMResearcherGeminiSearch)
+    # Only the retrieval_k most relevant CVEs, which were published within the published_period (default: see CVELoader),
+    # are passed to the LLM. With vendor_filter, CVEs of other vendors are not passed.
+    def __init__(self, llm: BaseChatModel | None = None, embeddings: Embeddings | None = None, chroma_client: ClientAPI | None = None,
+                 retrieval_k: int | None = None, published_period: timedelta | None = None, vendor_filter: bool = True,
+                 context_compression: bool = False) -> None:
+        self.embeddings = embeddings or create_default_embeddings()
+        self.chroma_client = chroma_client or chromadb.PersistentClient(path=CHROMA_PERSIST_DIRECTORY)
+        self.llm = llm or self.create_default_llm()
+        self.vector_store_manager = VectorStoreManager(self.chroma_client, self.embeddings)
+
+        self.retrieval_k: int = retrieval_k or int(os.getenv("CVE_RETRIEVAL_K", CVE_RETRIEVAL_DEFAULT_K))
+        self.published_period = published_period
+        self.vendor_filter = vendor_filter
+        # Limit the retrieved CVEs to the token budget of the question (see context_compression.py). Enabled with --compress-context.
+        self.context_compression = context_compression
+
+    # Create the Gemini client of this research runner
+    @classmethod
+    def create_default_llm(cls) -> BaseChatModel:
+        return ChatGoogleGenerativeAI(
+                    model=cls.model_name,
+                    temperature=0,
+                    **get_langchain_rate_limiting("gemini")
+                )
+
+    # Search something. For the CVE db, question_google is the search string (the name of the CSP).
+    def get_research_results(self, question_google: str, question_data_extract: str, llm_test_mode: bool, csp_name: str | None = None) -> str:
+        vectorstore = self.get_question_vectorstore(csp_name)
+
+        try:
+            qa_chain = RetrievalQAWithSourcesChain.from_chain_type(self.llm, retriever=self.get_retriever(vectorstore))
+
+            with span("cve_loading"):
+                self.load_cve_research(vectorstore, question_google, csp_name)
+
+            logger.info("Asking the LLM: " + question_data_extract)
+
+            # Ask the LLM to extract information from the vectorstore
+            with span("llm_extraction"):
+                result = qa_chain.invoke(question_data_extract, config=get_instrumentation_config())
+
+            logger.info("Answer from LLM: " + result["answer"])
+
+            # LLM-TEST-MODE: allows the user to ask test different questions
+            if llm_test_mode:
+                print("LLM-TEST-MODE - Entering LLM Test Mode. Insert 'exit' to continue.")
+                user_input = input("LLM-TEST-MODE - Input: ")
+
+                while user_input != "exit":
+                    result_tst = qa_chain.invoke(user_input)
+                    print("LLM-TEST-MODE - Output: " + result_tst["answer"])
+                    user_input = input("LLM-TEST-MODE - Input: ")
+        finally:
+            self.release_question_vectorstore(vectorstore, csp_name)
+
+        result_cleansed: str = result["answer"]
+
+        return result_cleansed
+
+    # Search something (async). For the CVE db, question_google is the search string (the name of the CSP).
+    async def aget_research_results(self, question_google: str, question_data_extract: str, csp_name: str | None = None) -> str:
+        vectorstore = self.get_question_vectorstore(csp_name)
+
+        try:
+            qa_chain = RetrievalQAWithSourcesChain.from_chain_type(self.llm, retriever=self.get_retriever(vectorstore))
+
+            # The CVE db is accessed synchronously (NVD API or local mirror), therefore the CVEs are loaded in a worker thread
+            with span("cve_loading"):
+                await asyncio.to_thread(self.load_cve_research, vectorstore, question_google, csp_name)
+
+            logger.info("Asking the LLM: " + question_data_extract)
+
+            # Ask the LLM to extract information from the vectorstore
+            with span("llm_extraction"):
+                result = await qa_chain.ainvoke(question_data_extract, config=get_instrumentation_config())
+
+            logger.info("Answer from LLM: " + result["answer"])
+        finally:
+            self.release_question_vectorstore(vectorstore, csp_name)
+
+        result_cleansed: str = result["answer"]
+
+        return result_cleansed
+
+    # Return a retriever for the retrieval_k most relevant CVEs, filtered by publication date (and vendor)
+    def get_retriever(self, vectorstore: Chroma) -> BaseRetriever:
+        published_period: timedelta = self.published_period if self.published_period is not None else CVE_PUBLISHED_PERIOD
+        conditions: list[dict[str, Any]] = [{"published_ts": {"$gte": (datetime.now() - published_period).timestamp()}}]
+
+        if self.vendor_filter:
+            conditions.append({"vendor_match": {"$ne": VENDOR_OTHER}})
+
+        retriever: BaseRetriever = vectorstore.as_retriever(search_kwargs={"k": self.retrieval_k,
+                                                                           "filter": conditions[0] if len(conditions) == 1 else {"$and": conditions}})
+
+        return get_compressing_retriever(retriever) if self.context_compression else retriever
+
+    # Return the persistent collection of the CSP, or a temporary collection if no CSP is provided
+    def get_question_vectorstore(self, csp_name: str | None) -> Chroma:
+        if csp_name is None:
+            vectorstore: Chroma = create_question_vectorstore(self.chroma_client, self.embeddings)
+        else:
+            vectorstore = self.vector_store_manager.get_vectorstore(csp_name, "cve")
+
+        return vectorstore
+
+    # A temporary collection is only needed for one question
+    def release_question_vectorstore(self, vectorstore: Chroma, csp_name: str | None) -> None:
+        if csp_name is None:
+            vectorstore.delete_collection()
+
+    # Load the CVEs into the vectorstore (if not done before for this CSP)
+    def load_cve_research(self, vectorstore: Chroma, search_string: str, csp_name: str | None) -> None:
+        if csp_name is not None and self.vector_store_manager.is_researched(vectorstore, search_string):
+            logger.info("Reusing stored CVEs for: " + search_string)
+            return
+
+        self.load_cve_documents(vectorstore, search_string)
+
+        if csp_name is not None:
+            self.vector_store_manager.mark_researched(vectorstore, search_string)
+
+    # Invoke the CVE API and search for all CVEs for this CSP.
+    # The CVEs are streamed page by page, and added to the vectorstore as one document per CVE (in batches).
+    def load_cve_documents(self, vectorstore: Chroma, search_string: str) -> None:
+        loader: CVELoader = CVELoader()
+        cve_documents: list[Document] = []
+        cve_document_count: int = 0
+
+        for cve_record in loader.iter_CVE_records_for_string(search_string):
+            cve_documents.append(get_cve_document(cve_record, search_string))
+
+            if len(cve_documents) >= CVE_DOCUMENT_BATCH_SIZE:
+                vectorstore.add_documents(documents=cve_documents)
+                cve_document_count += len(cve_documents)
+                cve_documents = []
+
+        if len(cve_documents) > 0:
+            vectorstore.add_documents(documents=cve_documents)
+            cve_document_count += len(cve_documents)
+
+        logger.info("Added " + str(cve_document_count) + " CVE documents to the vectorstore")
+        add_span_metrics(cve_documents=cve_document_count)
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages.base import BaseMessage
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+# Own modules
+from instrumentation import span
+from instrumentation_langchain import get_instrumentation_config
+from llm_researcher import LLMResearcher, get_likelihood_answers, get_likelihood_prompt, get_likelihood_schema
+from rate_limiter_langchain import get_langchain_rate_limiting
+
+
+#################################
+# Global variables
+#################################
+logger = logging.getLogger(__name__)
+
+
+#################################
+# This class allows to provide a query directly to gemini AI
+#################################
+class LLMResearcherGeminiDirect(LLMResearcher):
+    model_name: str = "gemini-1.5-pro"
+
+    # Setup everything needed for executing a research command
+    def __init__(self, llm: BaseChatModel | None = None) -> None:
+        self.llm = llm or self.create_default_llm()
+
+    # Create the Gemini client of this research runner
+    @classmethod
+    def create_default_llm(cls) -> BaseChatModel:
+        return ChatGoogleGenerativeAI(
+            model=cls.model_name,
+            temperature=0,
+            max_tokens=None,
+            timeout=None,
+            max_retries=2,
+            **get_langchain_rate_limiting("gemini")
+        )
+
+    # Search something
+    def get_research_results(self, question_google: str, question_data_extract: str, llm_test_mode: bool, csp_name: str | None = None) -> str:
+
+        logger.info("Asking the LLM: " + question_data_extract)
+
+        # Ask the LLM
+        with span("llm_question"):
+            result: BaseMessage = self.llm.invoke(question_data_extract, config=get_instrumentation_config())
+
+        logger.info("Answer from LLM: " + str(result.content))
+
+        # LLM-TEST-MODE: allows the user to ask test different questions
+        if llm_test_mode:
+            print("LLM-TEST-MODE - Entering LLM Test Mode. Insert 'exit' to continue.")
+            user_input = input("LLM-TEST-MODE - Input: ")
+
+            while user_input != "exit":
+                result_tst = self.llm.invoke(user_input)
+                print("LLM-TEST-MODE - Output: " + str(result_tst.content))
+                user_input = input("LLM-TEST-MODE - Input: ")
+
+        return str(result.content)
+
+    # Search something (async)
+    async def aget_research_results(self, question_google: str, question_data_extract: str, csp_name: str | None = None) -> str:
+
+        logger.info("Asking the LLM: " + question_data_extract)
+
+        # Ask the LLM
+        with span("llm_question"):
+            result: BaseMessage = await self.llm.ainvoke(question_data_extract, config=get_instrumentation_config())
+
+        logger.info("Answer from LLM: " + str(result.content))
+
+        return str(result.content)
+
+    # Batched question mode: all likelihood questions are answered in one request with structured output.
+    # If the answer is not valid, the questions are asked one by one.
+    def get_likelihood_results(self, questions: dict[str, tuple[str, str]], csp_name: str | None = None) -> dict[str, str]:
+        prompt = get_likelihood_prompt(questions)
+        schema = get_likelihood_schema(questions)
+
+        logger.info("Asking the LLM: " + prompt)
+
+        try:
+            with span("llm_likelihood_questions", questions=len(questions)):
+                results: dict[str, str] = get_likelihood_answers(questions, schema,
+                                                                 self.llm.with_structured_output(schema).invoke(prompt, config=get_instrumentation_config()))
+        except ValueError:
+            logger.warning("Invalid structured answer from LLM. Asking the questions one by one.", exc_info=True)
+            results = super().get_likelihood_results(questions, csp_name)
+            return results
+
+        logger.info("Answer from LLM: " + str(results))
+
+        return results
+
+    # Batched question mode (async)
+    async def aget_likelihood_results(self, questions: dict[str, tuple[str, str]], csp_name: str | None = None) -> dict[str, str]:
+        prompt = get_likelihood_prompt(questions)
+        schema = get_likelihood_schema(questions)
+
+        logger.info("Asking the LLM: " + prompt)
+
+        try:
+            with span("llm_likelihood_questions", questions=len(questions)):
+                structured_answer = await self.llm.with_structured_output(schema).ainvoke(prompt, config=get_instrumentation_config())
+                results: dict[str, str] = get_likelihood_answers(questions, schema, structured_answer)
+        except ValueError:
+            logger.warning("Invalid structured answer from LLM. Asking the questions one by one.", exc_info=True)
+            answers = await asyncio.gather(*[self.aget_research_results(question_google, question_data_extract, csp_name)
+                                             for question_google, question_data_extract in questions.values()])
+            return dict(zip(questions, answers))
+
+        logger.info("Answer from LLM: " + str(results))
+
+        return results
@@ -0,0 +1,190 @@
+import asyncio
+import chromadb
+import logging
+import threading
+
+from chromadb.api import ClientAPI
+from langchain.chains import RetrievalQAWithSourcesChain
+from langchain_chroma import Chroma
+from langchain_community.utilities.google_search import GoogleSearchAPIWrapper
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.retrievers import BaseRetriever
+from langchain_google_genai import ChatGoogleGenerativeAI
+from typing import Any, ClassVar
+
+# Own modules
+from context_compression import get_compressing_retriever
+from embedding_cache import create_default_embeddings
+from instrumentation import span
+from instrumentation_langchain import get_instrumentation_config
+from llm_researcher import CHROMA_PERSIST_DIRECTORY, LLMResearcher
+from page_fetcher import PageFetcher, PooledWebResearchRetriever
+from rate_limiter import get_rate_limiter
+from rate_limiter_langchain import get_langchain_rate_limiting
+from search_cache import CachedGoogleSearchAPIWrapper, SearchResultCache
+from vector_store import VectorStoreManager, create_question_vectorstore
+
+
+#################################
+# Global variables
+#################################
+logger = logging.getLogger(__name__)
+
+
+#################################
+# The google-api-client (httplib2) is not thread-safe. Since one warm research runner is shared
+# between concurrently running assessments, the API calls are serialized with a lock.
+# The requests are also limited by the shared rate limiter of the Google Custom Search API.
+#################################
+class ThreadSafeGoogleSearchAPIWrapper(GoogleSearchAPIWrapper):
+    search_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    def _google_search_results(self, search_term: str, **kwargs: Any) -> list[dict[str, Any]]:
+        results: list[dict[str, Any]] = get_rate_limiter("google_search").call(self.get_locked_search_results, search_term, **kwargs)
+        return results
+
+    def get_locked_search_results(self, search_term: str, **kwargs: Any) -> list[dict[str, Any]]:
+        with self.search_lock:
+            return super()._google_search_results(search_term, **kwargs)
+
+
+#################################
+# This class allows to search on google, and let an LLM process the result
+#################################
+class LLMResearcherGeminiSearch(LLMResearcher):
+    model_name: str = "gemini-1.5-flash"
+
+    # Setup everything needed for executing a research command
+    # The clients are created once and then shared by all questions. Clients which are not provided (e.g. local stand-ins
+    # for the benchmarks) are created for the Google services.
+    def __init__(self, llm: BaseChatModel | None = None, embeddings: Embeddings | None = None, chroma_client: ClientAPI | None = None,
+                 search_wrapper: GoogleSearchAPIWrapper | None = None, search_cache: SearchResultCache | None = None,
+                 page_fetcher: PageFetcher | None = None, context_compression: bool = False) -> None:
+        self.embeddings = embeddings or create_default_embeddings()
+        self.chroma_client = chroma_client or chromadb.PersistentClient(path=CHROMA_PERSIST_DIRECTORY)
+        self.llm = llm or self.create_default_llm()
+        self.search_cache = search_cache or SearchResultCache()
+        self.search = CachedGoogleSearchAPIWrapper(search_wrapper=search_wrapper or ThreadSafeGoogleSearchAPIWrapper(), search_cache=self.search_cache)
+        self.vector_store_manager = VectorStoreManager(self.chroma_client, self.embeddings)
+        self.page_fetcher = page_fetcher or PageFetcher()
+
+        # Compress the retrieved documents to the relevant sentences within the token budget of the question (see context_compression.py).
+        # Enabled with --compress-context.
+        self.context_compression = context_compression
+
+    # Create the Gemini client of this research runner
+    @classmethod
+    def create_default_llm(cls) -> BaseChatModel:
+        return ChatGoogleGenerativeAI(
+                    model=cls.model_name,
+                    temperature=0,
+                    **get_langchain_rate_limiting("gemini")
+                )
+
+    # Search something
+    def get_research_results(self, question_google: str, question_data_extract: str, llm_test_mode: bool, csp_name: str | None = None) -> str:
+        vectorstore = self.get_question_vectorstore(csp_name)
+
+        try:
+            qa_chain = RetrievalQAWithSourcesChain.from_chain_type(self.llm, retriever=self.get_retriever(vectorstore))
+
+            with span("web_research"):
+                self.load_web_documents(vectorstore, question_google, csp_name)
+
+            logger.info("Asking the LLM: " + question_data_extract)
+
+            # Ask the LLM to extract information from the vectorstore
+            with span("llm_extraction"):
+                result = qa_chain.invoke(question_data_extract, config=get_instrumentation_config())
+
+            logger.info("Answer from LLM: " + result["answer"])
+
+            # LLM-TEST-MODE: allows the user to ask test different questions
+            if llm_test_mode:
+                print("LLM-TEST-MODE - Entering LLM Test Mode. Insert 'exit' to continue.")
+                user_input = input("LLM-TEST-MODE - Input: ")
+
+                while user_input != "exit":
+                    result_tst = qa_chain.invoke(user_input)
+                    print("LLM-TEST-MODE - Output: " + result_tst["answer"])
+                    user_input = input("LLM-TEST-MODE - Input: ")
+        finally:
+            self.release_question_vectorstore(vectorstore, csp_name)
+
+        result_cleansed = str(result["answer"]).replace("\n", "")
+
+        return result_cleansed
+
+    # Search something (async)
+    async def aget_research_results(self, question_google: str, question_data_extract: str, csp_name: str | None = None) -> str:
+        vectorstore = self.get_question_vectorstore(csp_name)
+
+        try:
+            qa_chain = RetrievalQAWithSourcesChain.from_chain_type(self.llm, retriever=self.get_retriever(vectorstore))
+
+            # The WebResearchRetriever has no async implementation. The web research is therefore run in a worker thread.
+            with span("web_research"):
+                await asyncio.to_thread(self.load_web_documents, vectorstore, question_google, csp_name)
+
+            logger.info("Asking the LLM: " + question_data_extract)
+
+            # Ask the LLM to extract information from the vectorstore
+            with span("llm_extraction"):
+                result = await qa_chain.ainvoke(question_data_extract, config=get_instrumentation_config())
+
+            logger.info("Answer from LLM: " + result["answer"])
+        finally:
+            self.release_question_vectorstore(vectorstore, csp_name)
+
+        result_cleansed = str(result["answer"]).replace("\n", "")
+
+        return result_cleansed
+
+    # Return a retriever for the vectorstore, which compresses the retrieved documents (if context_compression is set)
+    def get_retriever(self, vectorstore: Chroma) -> BaseRetriever:
+        retriever: BaseRetriever = vectorstore.as_retriever()
+
+        return get_compressing_retriever(retriever) if self.context_compression else retriever
+
+    # Return the persistent collection of the CSP, or a temporary collection if no CSP is provided
+    def get_question_vectorstore(self, csp_name: str | None) -> Chroma:
+        if csp_name is None:
+            vectorstore: Chroma = create_question_vectorstore(self.chroma_client, self.embeddings)
+        else:
+            vectorstore = self.vector_store_manager.get_vectorstore(csp_name, "web")
+
+        return vectorstore
+
+    # A temporary collection is only needed for one question
+    def release_question_vectorstore(self, vectorstore: Chroma, csp_name: str | None) -> None:
+        if csp_name is None:
+            vectorstore.delete_collection()
+
+    # Search the web and store the result in the vectorstore (if not done before for this CSP)
+    def load_web_documents(self, vectorstore: Chroma, question_google: str, csp_name: str | None) -> None:
+        if csp_name is not None and self.vector_store_manager.is_researched(vectorstore, question_google):
+            logger.info("Reusing stored web research for: " + question_google)
+            return
+
+        # The pages are loaded with the shared page fetcher (pooled connections, cached pages and texts)
+        web_research_retriever = PooledWebResearchRetriever.from_page_fetcher(
+                                self.page_fetcher,
+                                llm=self.llm,
+                                vectorstore=vectorstore,
+                                search=self.search,
+                                allow_dangerous_requests=True,
+                                num_search_results=10
+                            )
+        web_research_retriever.invoke(question_google, config=get_instrumentation_config())
+
+        if csp_name is not None:
+            self.vector_store_manager.mark_researched(vectorstore, question_google)
+
+    def get_stats(self) -> dict[str, Any]:
+        return {"search_cache": self.search_cache.get_stats(), "page_fetcher": self.page_fetcher.get_stats()}
+
+    def close(self) -> None:
+        logger.info("Search cache statistics: " + str(self.search_cache.get_stats()))
+        self.search_cache.close()
+        self.page_fetcher.close()
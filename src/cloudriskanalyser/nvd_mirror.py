@@ -0,0 +1,389 @@
+#!/usr/bin/python
+import argparse
+import json
+import logging
+import os
+import re
+import requests
+import sqlite3
+import threading
+
+from datetime import datetime, timedelta
+from nvdlib.classes import CVE
+from typing import Any, Iterable, Iterator
+
+# Own modules
+from rate_limiter import get_rate_limiter
+
+
+#################################
+# Global variables
+#################################
+logger = logging.getLogger(__name__)
+
+
+#################################
+# Constants
+#################################
+NVD_MIRROR_DB_FILE: str = "nvd_mirror.db"
+
+# The NVD API accepts lastModified (and published) ranges of at most 120 days
+NVD_MAX_LAST_MOD_WINDOW: timedelta = timedelta(days=120)
+NVD_MAX_PUBLISHED_WINDOW: timedelta = timedelta(days=120)
+
+# Number of rows fetched from the mirror at once by the streaming lookups
+NVD_MIRROR_FETCH_SIZE: int = 100
+
+# Fields of a CVE record in the NVD API 2.0 format. nvdlib adds derived attributes (score, url, cpe...), which are not stored.
+NVD_CVE_FIELDS: set[str] = {"id", "sourceIdentifier", "published", "lastModified", "vulnStatus", "cveTags", "descriptions",
+                            "metrics", "weaknesses", "configurations", "references", "evaluatorComment", "evaluatorSolution",
+                            "evaluatorImpact", "cisaExploitAdd", "cisaActionDue", "cisaRequiredAction", "cisaVulnerabilityName",
+                            "vendorComments"}
+
+NVD_CVE_API_URL: str = "https://services.nvd.nist.gov/rest/json/cves/2.0"
+NVD_RESULTS_PER_PAGE: int = 2000
+NVD_REQUEST_TIMEOUT: int = 30
+
+
+# Request one result page of the NVD CVE API. Dates are passed as datetime objects.
+def get_nvd_cve_page(parameters: dict[str, Any], start_index: int, api_key: str | None = None) -> dict[str, Any]:
+    request_parameters: dict[str, Any] = {key: value.isoformat() if isinstance(value, datetime) else value for key, value in parameters.items()}
+    request_parameters.update(startIndex=start_index, resultsPerPage=NVD_RESULTS_PER_PAGE)
+
+    response = requests.get(NVD_CVE_API_URL, params=request_parameters, headers={"apiKey": api_key} if api_key else {}, timeout=NVD_REQUEST_TIMEOUT)
+    response.raise_for_status()
+
+    page: dict[str, Any] = response.json()
+    return page
+
+
+# Yield the CVEs of a search of the NVD CVE API (e.g. {"keywordSearch": ...}), as the result pages arrive.
+# Each page takes its own token and slot of the NVD rate limiter, so that concurrent searches share the quota page by page.
+def iter_nvd_cves(parameters: dict[str, Any], api_key: str | None = None) -> Iterator[CVE]:
+    start_index: int = 0
+
+    while True:
+        page = get_rate_limiter("nvd").call(get_nvd_cve_page, parameters, start_index, api_key)
+
+        for vulnerability in page["vulnerabilities"]:
+            yield cve_dict_to_nvd_object(vulnerability["cve"])
+
+        start_index += len(page["vulnerabilities"])
+        if not page["vulnerabilities"] or start_index >= page["totalResults"]:
+            return
+
+
+# Convert an nvdlib object (and all nested objects) back to the dictionary of the NVD API
+def nvd_object_to_dict(nvd_object: Any) -> Any:
+    if isinstance(nvd_object, list):
+        return [nvd_object_to_dict(entry) for entry in nvd_object]
+    elif hasattr(nvd_object, "__dict__"):
+        return {key: nvd_object_to_dict(value) for key, value in vars(nvd_object).items()}
+    else:
+        return nvd_object
+
+
+# Convert a CVE record in the NVD API format to an nvdlib CVE object (the same conversion as nvdlib does)
+def cve_dict_to_nvd_object(cve_dict: dict[str, Any]) -> CVE:
+    cve: CVE = json.loads(json.dumps(cve_dict), object_hook=CVE)
+    cve.getvars()
+
+    return cve
+
+
+# Convert CVEs to the JSON records of the NVD API (without the attributes derived by nvdlib), and back
+def encode_cves(cves: list[CVE]) -> list[dict[str, Any]]:
+    return [{key: value for key, value in nvd_object_to_dict(cve).items() if key in NVD_CVE_FIELDS} for cve in cves]
+
+
+def decode_cves(cve_dicts: list[dict[str, Any]]) -> list[CVE]:
+    return [cve_dict_to_nvd_object(cve_dict) for cve_dict in cve_dicts]
+
+
+# Return a unique integer for a CVE ID ("CVE-2024-12345" -> 202400012345)
+def get_cve_rowid(cve_id: str) -> int:
+    id_parts = cve_id.split("-")
+
+    return int(id_parts[1]) * 10**8 + int(id_parts[2])
+
+
+# Return the english description of a CVE record
+def get_cve_description(cve_dict: dict[str, Any]) -> str:
+    for description in cve_dict.get("descriptions", []):
+        if description.get("lang") == "en":
+            description_text: str = description.get("value", "")
+            return description_text
+
+    return ""
+
+
+# Return all CPE match criteria of a CVE record
+def get_cve_cpes(cve_dict: dict[str, Any]) -> list[str]:
+    cpes: list[str] = []
+
+    for configuration in cve_dict.get("configurations", []):
+        for node in configuration.get("nodes", []):
+            for cpe_match in node.get("cpeMatch", []):
+                if "criteria" in cpe_match:
+                    cpes.append(cpe_match["criteria"])
+
+    return cpes
+
+
+# Return the (distinct, sorted) vendors and products of CPE match criteria ("cpe:2.3:a:<vendor>:<product>:...")
+def get_cpe_vendors_products(cpes: list[str]) -> tuple[list[str], list[str]]:
+    cpe_parts = [cpe.split(":") for cpe in cpes]
+
+    return (sorted({parts[3] for parts in cpe_parts if len(parts) > 4}), sorted({parts[4] for parts in cpe_parts if len(parts) > 4}))
+
+
+# Return the latest CVSS base score (and its version) of a CVE record. Same order of preference as nvdlib.
+def get_cve_cvss_score(cve_dict: dict[str, Any]) -> tuple[str | None, float | None]:
+    metrics: dict[str, Any] = cve_dict.get("metrics", {})
+
+    for metric_name, version in [("cvssMetricV40", "V40"), ("cvssMetricV31", "V31"), ("cvssMetricV30", "V30"), ("cvssMetricV2", "V2")]:
+        if metrics.get(metric_name):
+            return version, float(metrics[metric_name][0]["cvssData"]["baseScore"])
+
+    return None, None
+
+
+# Check if a CPE match criteria matches a CPE name. "*" and "-" in one of both match any value.
+def cpe_matches(cpe_criteria: str, cpe_name: str) -> bool:
+    criteria_parts = cpe_criteria.split(":")
+    name_parts = cpe_name.split(":")
+
+    for criteria_part, name_part in zip(criteria_parts, name_parts):
+        if criteria_part in ("*", "-") or name_part in ("*", "-"):
+            continue
+        if criteria_part.lower() != name_part.lower():
+            return False
+
+    return True
+
+
+#################################
+# This class provides a local mirror of the NVD CVE database (sqlite with a full-text index).
+# It is synchronized incrementally, using the lastModified dates of the CVEs. Lookups are served locally, and return
+# the same nvdlib CVE objects as nvdlib.searchCVE().
+#################################
+class NVDMirror():
+    def __init__(self, db_file_name: str = NVD_MIRROR_DB_FILE, api_key: str | None = None) -> None:
+        self.db_file_name = db_file_name
+        self.api_key = api_key
+
+        # The connection is opened on first use, and shared by all threads
+        self.connection: sqlite3.Connection | None = None
+        self.lock = threading.Lock()
+
+    # Open the database, and create the tables if they do not exist yet
+    def get_connection(self) -> sqlite3.Connection:
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.db_file_name, check_same_thread=False)
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS cves (
+                    cve_id TEXT PRIMARY KEY,
+                    published TEXT NOT NULL,
+                    last_modified TEXT NOT NULL,
+                    cvss_version TEXT,
+                    cvss_score REAL,
+                    description TEXT NOT NULL,
+                    vendors TEXT NOT NULL,
+                    products TEXT NOT NULL,
+                    cpes TEXT NOT NULL,
+                    raw TEXT NOT NULL);
+                CREATE INDEX IF NOT EXISTS cves_published ON cves (published);
+                CREATE VIRTUAL TABLE IF NOT EXISTS cves_fts USING fts5 (cve_id UNINDEXED, description, vendors, products);
+                CREATE TABLE IF NOT EXISTS sync_state (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+            """)
+            self.connection.commit()
+
+        return self.connection
+
+    # Insert or update CVE records (NVD API format). Returns the number of stored records.
+    def upsert_cves(self, cve_dicts: Iterable[dict[str, Any]]) -> int:
+        count: int = 0
+
+        with self.lock:
+            connection = self.get_connection()
+
+            for cve_dict in cve_dicts:
+                cve_dict = {key: value for key, value in cve_dict.items() if key in NVD_CVE_FIELDS}
+                cpes = get_cve_cpes(cve_dict)
+                vendors, products = get_cpe_vendors_products(cpes)
+                cvss_version, cvss_score = get_cve_cvss_score(cve_dict)
+                description = get_cve_description(cve_dict)
+
+                connection.execute("INSERT OR REPLACE INTO cves VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                   (cve_dict["id"], cve_dict.get("published", ""), cve_dict.get("lastModified", ""), cvss_version,
+                                    cvss_score, description, " ".join(vendors), " ".join(products), "\n".join(cpes),
+                                    json.dumps(cve_dict)))
+                # The full-text index is addressed by rowid, so that an update does not need to scan the index
+                fts_rowid = get_cve_rowid(cve_dict["id"])
+                connection.execute("DELETE FROM cves_fts WHERE rowid = ?", (fts_rowid,))
+                connection.execute("INSERT INTO cves_fts (rowid, cve_id, description, vendors, products) VALUES (?, ?, ?, ?, ?)",
+                                   (fts_rowid, cve_dict["id"], description, " ".join(vendors).replace("_", " "),
+                                    " ".join(products).replace("_", " ")))
+                count += 1
+
+            connection.commit()
+
+        return count
+
+    # Return the lastModified mark of the last synchronization (None, if the mirror was never synchronized)
+    def get_last_modified_mark(self) -> datetime | None:
+        with self.lock:
+            row = self.get_connection().execute("SELECT value FROM sync_state WHERE name = 'last_modified'").fetchone()
+
+        return datetime.fromisoformat(row[0]) if row is not None else None
+
+    # Store the lastModified mark. The mark is never moved backwards.
+    def set_last_modified_mark(self, last_modified: datetime) -> None:
+        current_mark = self.get_last_modified_mark()
+        if current_mark is not None and current_mark >= last_modified:
+            return
+
+        with self.lock:
+            connection = self.get_connection()
+            connection.execute("INSERT OR REPLACE INTO sync_state VALUES ('last_modified', ?)", (last_modified.isoformat(),))
+            connection.commit()
+
+    # Synchronize from local files in the NVD API 2.0 format (e.g. for testing offline)
+    def sync_from_files(self, file_names: Iterable[str]) -> int:
+        count: int = 0
+
+        for file_name in file_names:
+            with open(file_name) as infile:
+                cve_dicts: list[dict[str, Any]] = [vulnerability["cve"] for vulnerability in json.load(infile).get("vulnerabilities", [])]
+
+            count += self.upsert_cves(cve_dicts)
+
+            if len(cve_dicts) > 0:
+                self.set_last_modified_mark(max(datetime.fromisoformat(cve_dict["lastModified"]) for cve_dict in cve_dicts))
+
+            logger.info("Synchronized " + str(len(cve_dicts)) + " CVEs from " + file_name)
+
+        return count
+
+    # Synchronize all CVEs modified since the last synchronization (or since "start") from the NVD API.
+    # The period is split into windows of at most 120 days, as required by the API.
+    def sync_from_api(self, start: datetime | None = None, end: datetime | None = None) -> int:
+        window_start = start if start is not None else self.get_last_modified_mark()
+        if window_start is None:
+            raise ValueError("The mirror was never synchronized. Please provide a start date for the initial synchronization.")
+
+        end = end if end is not None else datetime.now()
+        count: int = 0
+
+        while window_start < end:
+            window_end = min(window_start + NVD_MAX_LAST_MOD_WINDOW, end)
+
+            logger.info("Synchronizing CVEs modified between " + str(window_start) + " and " + str(window_end))
+            count += self.upsert_cves(nvd_object_to_dict(cve) for cve in
+                                      iter_nvd_cves({"lastModStartDate": window_start, "lastModEndDate": window_end}, self.api_key))
+
+            # All changes up to the end of the window are now stored
+            self.set_last_modified_mark(window_end)
+            window_start = window_end
+
+        return count
+
+    # Convert a search string to a full-text query: every word must be present (like NVD's keywordSearch)
+    def get_fts_query(self, search_string: str) -> str:
+        words: list[str] = re.findall(r"\w+", search_string)
+
+        return " AND ".join('"' + word + '"' for word in words)
+
+    # Return all CVEs, whose description, vendor or product contain all words of the search string.
+    # With modified_since, only the CVEs modified since then are returned (e.g. since the lastModified mark of a previous search).
+    def search_keyword(self, search_string: str, published_since: datetime | None = None, modified_since: datetime | None = None) -> list[CVE]:
+        return list(self.iter_search_keyword(search_string, published_since, modified_since))
+
+    # Same as search_keyword(), but yields the CVEs one by one
+    def iter_search_keyword(self, search_string: str, published_since: datetime | None = None,
+                            modified_since: datetime | None = None) -> Iterator[CVE]:
+        fts_query = self.get_fts_query(search_string)
+        if fts_query == "":
+            return
+
+        with self.lock:
+            cursor = self.get_connection().execute(
+                "SELECT cves.raw FROM cves_fts JOIN cves ON cves.cve_id = cves_fts.cve_id "
+                "WHERE cves_fts MATCH ? AND cves.published >= ? AND cves.last_modified >= ? ORDER BY cves.published",
+                (fts_query, published_since.isoformat() if published_since is not None else "",
+                 modified_since.isoformat() if modified_since is not None else ""))
+
+        # The rows are fetched in batches under the lock, and yielded without it (the caller may use the mirror in between)
+        try:
+            while True:
+                with self.lock:
+                    rows = cursor.fetchmany(NVD_MIRROR_FETCH_SIZE)
+                if not rows:
+                    return
+
+                for row in rows:
+                    yield cve_dict_to_nvd_object(json.loads(row[0]))
+        finally:
+            cursor.close()
+
+    # Return all CVEs with a CPE match criteria matching the CPE name (e.g. "cpe:2.3:a:dropbox:dropbox:*:*:*:*:*:*:*:*")
+    def search_cpe(self, cpe_name: str) -> list[CVE]:
+        cpe_parts = cpe_name.split(":")
+        if len(cpe_parts) < 5:
+            raise ValueError("Invalid CPE name: " + cpe_name)
+
+        # Pre-select the candidates with the full-text index on vendor and product
+        words: list[str] = re.findall(r"\w+", (cpe_parts[3] + " " + cpe_parts[4]).replace("_", " "))
+        fts_query = " AND ".join('"' + word + '"' for word in words if word not in ("", "-"))
+
+        with self.lock:
+            if fts_query != "":
+                rows = self.get_connection().execute(
+                    "SELECT cves.raw, cves.cpes FROM cves_fts JOIN cves ON cves.cve_id = cves_fts.cve_id "
+                    "WHERE cves_fts MATCH ? ORDER BY cves.published", (fts_query,)).fetchall()
+            else:
+                rows = self.get_connection().execute("SELECT raw, cpes FROM cves ORDER BY published").fetchall()
+
+        return [cve_dict_to_nvd_object(json.loads(row[0])) for row in rows
+                if any(cpe_matches(cpe, cpe_name) for cpe in row[1].splitlines())]
+
+    # Number of CVEs stored in the mirror
+    def get_cve_count(self) -> int:
+        with self.lock:
+            count: int = self.get_connection().execute("SELECT COUNT(*) FROM cves").fetchone()[0]
+
+        return count
+
+    # Close the database connection. It is reopened on the next access.
+    def close(self) -> None:
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+#################################
+# Main
+#################################
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Synchronizes the local NVD mirror.")
+    parser.add_argument("--db", default=os.getenv("NVD_MIRROR_DB", NVD_MIRROR_DB_FILE), help="mirror database (default: %(default)s)")
+    parser.add_argument("--since", type=datetime.fromisoformat,
+                        help="synchronize all CVEs modified since this date (required for the initial synchronization)")
+    parser.add_argument("--files", nargs="+", metavar="FILE", help="synchronize from local files in the NVD API 2.0 format")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    nvd_mirror = NVDMirror(args.db, os.getenv("NVD_API_KEY"))
+
+    if args.files:
+        count = nvd_mirror.sync_from_files(args.files)
+    else:
+        count = nvd_mirror.sync_from_api(args.since)
+
+    print("Synchronized " + str(count) + " CVEs. The mirror contains " + str(nvd_mirror.get_cve_count()) + " CVEs.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+import hashlib
+import html2text
+import logging
+import requests
+import sqlite3
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from langchain_community.retrievers.web_research import WebResearchRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableConfig
+from requests.adapters import HTTPAdapter
+from typing import Any
+from urllib.parse import urlsplit
+
+# Own modules
+from cassette import Cassette
+from instrumentation import add_span_metrics, propagate_context, span
+
+
+#################################
+# Global variables
+#################################
+logger = logging.getLogger(__name__)
+
+
+#################################
+# Constants
+#################################
+PAGE_CACHE_DB_FILE: str = "page_cache.db"
+
+# Pages fetched less than PAGE_CACHE_MAX_AGE seconds ago are used without asking the server again.
+# Older pages are revalidated with a conditional request (ETag / Last-Modified).
+PAGE_CACHE_MAX_AGE: int = 24 * 3600
+
+PAGE_FETCH_MAX_WORKERS: int = 10
+PAGE_FETCH_MAX_PER_HOST: int = 2
+PAGE_FETCH_TIMEOUT: int = 10
+PAGE_FETCH_HEADERS: dict[str, str] = {
+    "User-Agent": "Mozilla/5.0 (compatible; CloudRiskAnalyser)",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"
+}
+
+
+# Convert HTML to text (like the Html2TextTransformer of langchain). HTML2Text is not thread-safe, so each call has its own instance.
+def html_to_text(html: str) -> str:
+    converter = html2text.HTML2Text()
+    converter.ignore_links = True
+    converter.ignore_images = True
+
+    text: str = converter.handle(html)
+    return text
+
+
+#################################
+# This class fetches web pages for the web research, and returns their text.
+# The connections are pooled, the pages are fetched concurrently (with a limit per host), and both the HTTP validators
+# (ETag / Last-Modified) and the extracted text are cached on disk (sqlite). The text is stored by content hash,
+# so a page is only converted again if its content changed.
+#################################
+class PageFetcher():
+    def __init__(self, db_file_name: str = PAGE_CACHE_DB_FILE, max_workers: int = PAGE_FETCH_MAX_WORKERS,
+                 max_per_host: int = PAGE_FETCH_MAX_PER_HOST, timeout: int = PAGE_FETCH_TIMEOUT, max_age: int = PAGE_CACHE_MAX_AGE) -> None:
+        self.db_file_name = db_file_name
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.max_age = max_age
+
+        self.session = requests.Session()
+        self.session.headers.update(PAGE_FETCH_HEADERS)
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.host_semaphores: dict[str, threading.BoundedSemaphore] = {}
+
+        self.fetches: int = 0
+        self.cache_hits: int = 0
+        self.not_modified: int = 0
+        self.text_cache_hits: int = 0
+        self.errors: int = 0
+
+        # The connection is opened on first use, and shared by all threads
+        self.connection: sqlite3.Connection | None = None
+        self.lock = threading.Lock()
+
+    # Open the database, and create the tables if they do not exist yet
+    def get_connection(self) -> sqlite3.Connection:
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.db_file_name, check_same_thread=False)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS pages ("
+                                    "url TEXT PRIMARY KEY, "
+                                    "etag TEXT, "
+                                    "last_modified TEXT, "
+                                    "content_hash TEXT NOT NULL, "
+                                    "fetched_at REAL NOT NULL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS page_texts ("
+                                    "content_hash TEXT PRIMARY KEY, "
+                                    "text TEXT NOT NULL)")
+            self.connection.commit()
+
+        return self.connection
+
+    # Return the semaphore, which limits the concurrent requests to the host of the URL
+    def get_host_semaphore(self, url: str) -> threading.BoundedSemaphore:
+        host: str = urlsplit(url).netloc
+
+        with self.lock:
+            if host not in self.host_semaphores:
+                self.host_semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+
+            return self.host_semaphores[host]
+
+    # Return the text of a page. Returns None if the page could not be fetched.
+    def get_page_text(self, url: str) -> str | None:
+        with self.lock:
+            cached_page = self.get_connection().execute(
+                "SELECT pages.etag, pages.last_modified, pages.content_hash, pages.fetched_at, page_texts.text FROM pages "
+                "JOIN page_texts ON pages.content_hash = page_texts.content_hash WHERE pages.url = ?", (url,)).fetchone()
+
+        if cached_page is not None and time.time() - cached_page[3] < self.max_age:
+            with self.lock:
+                self.cache_hits += 1
+            add_span_metrics(page_cache_hits=1)
+            return str(cached_page[4])
+
+        # Revalidate the cached page with a conditional request
+        headers: dict[str, str] = {}
+        if cached_page is not None:
+            if cached_page[0] is not None:
+                headers["If-None-Match"] = cached_page[0]
+            if cached_page[1] is not None:
+                headers["If-Modified-Since"] = cached_page[1]
+
+        try:
+            with self.get_host_semaphore(url):
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+
+            with self.lock:
+                self.fetches += 1
+            add_span_metrics(pages_fetched=1, bytes_fetched=len(response.content))
+
+            if response.status_code == 304 and cached_page is not None:
+                with self.lock:
+                    self.not_modified += 1
+                    self.get_connection().execute("UPDATE pages SET fetched_at = ? WHERE url = ?", (time.time(), url))
+                    self.get_connection().commit()
+                return str(cached_page[4])
+
+            # Without a cached page, "not modified" has no content (e.g. a misbehaving server or proxy)
+            if response.status_code == 304:
+                raise requests.HTTPError("304 Not Modified without a cached page", response=response)
+
+            response.raise_for_status()
+        except requests.RequestException:
+            logger.warning("Could not fetch page: " + url, exc_info=True)
+            with self.lock:
+                self.errors += 1
+            return None
+
+        return self.store_page(url, response.text, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+
+    # Store the validators of a fetched page, and its text (only converted if the content is not known yet)
+    def store_page(self, url: str, html: str, etag: str | None, last_modified: str | None) -> str:
+        content_hash: str = hashlib.sha256(html.encode("utf-8")).hexdigest()
+
+        with self.lock:
+            row = self.get_connection().execute("SELECT text FROM page_texts WHERE content_hash = ?", (content_hash,)).fetchone()
+
+        if row is not None:
+            text: str = row[0]
+            with self.lock:
+                self.text_cache_hits += 1
+        else:
+            text = html_to_text(html)
+
+        with self.lock:
+            connection = self.get_connection()
+            connection.execute("INSERT OR IGNORE INTO page_texts VALUES (?, ?)", (content_hash, text))
+            connection.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)", (url, etag, last_modified, content_hash, time.time()))
+            connection.commit()
+
+        return text
+
+    # Fetch all pages concurrently, and return one document per page (in the order of the URLs).
+    # Pages which could not be fetched are skipped.
+    def get_documents(self, urls: list[str]) -> list[Document]:
+        with span("page_fetch", pages=len(urls)), ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            texts = list(executor.map(propagate_context(self.get_page_text), urls))
+
+        return [Document(page_content=text, metadata={"source": url}) for url, text in zip(urls, texts) if text is not None]
+
+    # Counters of this process
+    def get_stats(self) -> dict[str, Any]:
+        return {
+            "fetches": self.fetches,
+            "cache_hits": self.cache_hits,
+            "not_modified": self.not_modified,
+            "text_cache_hits": self.text_cache_hits,
+            "errors": self.errors
+        }
+
+    # Close the HTTP session and the database connection
+    def close(self) -> None:
+        logger.info("Page fetcher statistics: " + str(self.get_stats()))
+        self.session.close()
+
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+#################################
+# This retriever works like the WebResearchRetriever of langchain, but loads the pages with a (shared) PageFetcher
+# instead of creating a new AsyncHtmlLoader and Html2TextTransformer for every question.
+#################################
+class PooledWebResearchRetriever(WebResearchRetriever):
+    page_fetcher: PageFetcher | None = None
+
+    # Create the retriever (see WebResearchRetriever.from_llm), and attach the page fetcher
+    @classmethod
+    def from_page_fetcher(cls, page_fetcher: PageFetcher, **kwargs: Any) -> "PooledWebResearchRetriever":
+        retriever = cls.from_llm(**kwargs)
+        assert isinstance(retriever, PooledWebResearchRetriever)
+
+        retriever.page_fetcher = page_fetcher
+
+        return retriever
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        if self.page_fetcher is None:
+            return super()._get_relevant_documents(query, run_manager=run_manager)
+
+        # Get search questions
+        result = self.llm_chain.invoke({"question": query}, config=RunnableConfig(callbacks=run_manager.get_child()))
+        questions: list[str] = result["text"]
+        logger.info("Questions for Google Search: " + str(questions))
+
+        # Get urls
+        urls_to_look: list[str] = []
+        for question in questions:
+            for search_result in self.search_tool(question, self.num_search_results):
+                if search_result.get("link", None):
+                    urls_to_look.append(search_result["link"])
+
+        # Load, split, and add new urls to vectorstore
+        new_urls: list[str] = [url for url in dict.fromkeys(urls_to_look) if url not in self.url_database]
+
+        logger.info("New URLs to load: " + str(new_urls))
+        if new_urls:
+            documents = self.text_splitter.split_documents(self.page_fetcher.get_documents(new_urls))
+            self.vectorstore.add_documents(documents)
+            self.url_database.extend(new_urls)
+
+        # Search for relevant splits
+        relevant_documents: list[Document] = []
+        for question in questions:
+            relevant_documents.extend(self.vectorstore.similarity_search(question))
+
+        # Get unique docs
+        unique_documents = {(document.page_content, tuple(sorted(document.metadata.items()))): document for document in relevant_documents}
+
+        return list(unique_documents.values())
+
+
+#################################
+# This page fetcher records the texts of the fetched pages (or replays them). In replay mode, no page is requested.
+#################################
+class CassettePageFetcher(PageFetcher):
+    def __init__(self, cassette: Cassette, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.cassette = cassette
+
+    def get_page_text(self, url: str) -> str | None:
+        text: str | None = self.cassette.call("page", {"url": url}, lambda: super(CassettePageFetcher, self).get_page_text(url))
+        return text
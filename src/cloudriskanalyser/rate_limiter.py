@@ -0,0 +1,251 @@
+import logging
+import os
+import random
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, TypeVar
+
+
+#################################
+# Global variables
+#################################
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+#################################
+# Constants
+#################################
+# Default limits per backend. They can be overwritten with the env variables RATE_LIMIT_<BACKEND>_RPS,
+# RATE_LIMIT_<BACKEND>_BURST and RATE_LIMIT_<BACKEND>_CONCURRENCY (e.g. RATE_LIMIT_NVD_RPS=1.5).
+RATE_LIMIT_DEFAULTS: dict[str, dict[str, float]] = {
+    "gemini": {"requests_per_second": 2.0, "max_bucket_size": 5, "max_concurrency": 8},
+    "google_search": {"requests_per_second": 1.0, "max_bucket_size": 5, "max_concurrency": 4},
+    # NVD allows 50 requests per 30 seconds with an API key (5 requests without key, see get_rate_limit_config())
+    "nvd": {"requests_per_second": 50 / 30, "max_bucket_size": 5, "max_concurrency": 4}
+}
+NVD_REQUESTS_PER_SECOND_WITHOUT_KEY: float = 5 / 30
+
+# A request is a latency spike, if it takes longer than LATENCY_SPIKE_FACTOR times the average latency
+LATENCY_SPIKE_FACTOR: float = 3.0
+LATENCY_MIN_SAMPLES: int = 5
+LATENCY_SMOOTHING: float = 0.2
+
+# The concurrency is decreased at most once per cooldown, so that a burst of errors only counts once
+DECREASE_COOLDOWN: float = 1.0
+
+RATE_LIMIT_MAX_RETRIES: int = 3
+RATE_LIMIT_BACKOFF: float = 1.0
+POLL_INTERVAL: float = 0.05
+
+
+# Check if an exception was caused by a rate limit (HTTP 429 / "resource exhausted") of one of the backends
+def is_rate_limit_error(exception: BaseException | None) -> bool:
+    while exception is not None:
+        status_codes = [getattr(exception, "code", None),
+                        getattr(getattr(exception, "response", None), "status_code", None),
+                        getattr(getattr(exception, "resp", None), "status", None)]
+
+        if 429 in status_codes or "429" in status_codes or type(exception).__name__ == "ResourceExhausted":
+            return True
+
+        exception = exception.__cause__
+
+    return False
+
+
+#################################
+# This class limits the requests to one backend (e.g. the NVD API).
+# A token bucket keeps the request rate below the quota of the backend. In addition, the number of concurrent requests
+# is adapted in an AIMD style: it is increased by one per round of successful requests, and halved when the backend
+# answers with "429 Too Many Requests" or the latency spikes.
+#################################
+class AdaptiveRateLimiter():
+    def __init__(self, name: str, requests_per_second: float, max_bucket_size: float = 1, max_concurrency: int = 8,
+                 min_concurrency: int = 1, max_retries: int = RATE_LIMIT_MAX_RETRIES, backoff: float = RATE_LIMIT_BACKOFF) -> None:
+        self.name = name
+        self.requests_per_second = requests_per_second
+        self.max_bucket_size = max_bucket_size
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        # Token bucket
+        self.available_tokens: float = max_bucket_size
+        self.last_refill: float = time.monotonic()
+
+        # AIMD concurrency limit
+        self.concurrency_limit: float = max_concurrency
+        self.in_flight: int = 0
+        self.last_decrease: float = 0.0
+        self.average_latency: float | None = None
+        self.latency_samples: int = 0
+
+        self.requests: int = 0
+        self.rate_limited: int = 0
+        self.latency_spikes: int = 0
+        self.retries: int = 0
+
+        self.condition = threading.Condition()
+
+    # Take a token from the bucket. Returns False if no token is available and blocking is False.
+    def acquire_token(self, blocking: bool = True) -> bool:
+        while True:
+            with self.condition:
+                now = time.monotonic()
+                self.available_tokens = min(self.max_bucket_size, self.available_tokens + (now - self.last_refill) * self.requests_per_second)
+                self.last_refill = now
+
+                if self.available_tokens >= 1:
+                    self.available_tokens -= 1
+                    return True
+
+                wait_time = (1 - self.available_tokens) / self.requests_per_second
+
+            if not blocking:
+                return False
+
+            time.sleep(min(wait_time, POLL_INTERVAL))
+
+    # Take one of the concurrent request slots. Returns False if no slot is free and blocking is False.
+    def acquire_slot(self, blocking: bool = True) -> bool:
+        with self.condition:
+            while self.in_flight >= int(self.concurrency_limit):
+                if not blocking:
+                    return False
+                self.condition.wait()
+
+            self.in_flight += 1
+            self.requests += 1
+            return True
+
+    # Return the slot, and adapt the concurrency limit to the outcome of the request
+    def release_slot(self, latency: float, rate_limited: bool = False) -> None:
+        with self.condition:
+            self.in_flight -= 1
+
+            if rate_limited:
+                self.rate_limited += 1
+                self.decrease_concurrency("rate limited")
+            elif self.is_latency_spike(latency):
+                self.latency_spikes += 1
+                self.decrease_concurrency("latency spike of " + str(round(latency, 2)) + " seconds")
+            else:
+                # Additive increase: one more concurrent request per round of successful requests
+                self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit)
+
+            if not rate_limited:
+                self.update_average_latency(latency)
+
+            self.condition.notify_all()
+
+    # Multiplicative decrease (the condition must be held by the caller)
+    def decrease_concurrency(self, reason: str) -> None:
+        now = time.monotonic()
+
+        if now - self.last_decrease < DECREASE_COOLDOWN:
+            return
+
+        self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit / 2)
+        self.last_decrease = now
+
+        logger.warning("Backend " + self.name + ": " + reason + ". Reducing concurrency to " + str(int(self.concurrency_limit)))
+
+    def is_latency_spike(self, latency: float) -> bool:
+        return (self.average_latency is not None and self.latency_samples >= LATENCY_MIN_SAMPLES and
+                latency > LATENCY_SPIKE_FACTOR * self.average_latency)
+
+    def update_average_latency(self, latency: float) -> None:
+        if self.average_latency is None:
+            self.average_latency = latency
+        else:
+            self.average_latency = (1 - LATENCY_SMOOTHING) * self.average_latency + LATENCY_SMOOTHING * latency
+
+        self.latency_samples += 1
+
+    # Run a request within the limits of the backend. Rate-limit errors are reported to the AIMD concurrency limit.
+    @contextmanager
+    def request(self) -> Iterator[None]:
+        self.acquire_token()
+        self.acquire_slot()
+        start_time = time.monotonic()
+
+        try:
+            yield
+        except BaseException as e:
+            self.release_slot(time.monotonic() - start_time, rate_limited=is_rate_limit_error(e))
+            raise
+        else:
+            self.release_slot(time.monotonic() - start_time)
+
+    # Call a function within the limits of the backend. Rate-limited calls are retried with exponential backoff.
+    def call(self, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        attempt: int = 0
+
+        while True:
+            try:
+                with self.request():
+                    return function(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                    raise
+
+            with self.condition:
+                self.retries += 1
+
+            backoff_time = self.backoff * (2 ** attempt) * (1 + random.random())
+            logger.info("Backend " + self.name + " is rate limited. Retrying in " + str(round(backoff_time, 2)) + " seconds.")
+            time.sleep(backoff_time)
+            attempt += 1
+
+    # Counters of this process
+    def get_stats(self) -> dict[str, Any]:
+        with self.condition:
+            return {
+                "requests": self.requests,
+                "rate_limited": self.rate_limited,
+                "latency_spikes": self.latency_spikes,
+                "retries": self.retries,
+                "concurrency_limit": int(self.concurrency_limit)
+            }
+
+
+# Read the limits of a backend from the env variables (or the defaults)
+def get_rate_limit_config(backend: str) -> dict[str, float]:
+    config: dict[str, float] = dict(RATE_LIMIT_DEFAULTS.get(backend, {"requests_per_second": 1.0, "max_bucket_size": 1, "max_concurrency": 4}))
+
+    if backend == "nvd" and not os.getenv("NVD_API_KEY"):
+        config["requests_per_second"] = NVD_REQUESTS_PER_SECOND_WITHOUT_KEY
+
+    env_prefix: str = "RATE_LIMIT_" + backend.upper() + "_"
+    for env_suffix, key in [("RPS", "requests_per_second"), ("BURST", "max_bucket_size"), ("CONCURRENCY", "max_concurrency")]:
+        env_value = os.getenv(env_prefix + env_suffix)
+        if env_value:
+            config[key] = float(env_value)
+
+    return config
+
+
+rate_limiters: dict[str, AdaptiveRateLimiter] = {}
+rate_limiters_lock = threading.Lock()
+
+
+# Return the rate limiter of a backend. All callers in this process share one limiter per backend.
+def get_rate_limiter(backend: str) -> AdaptiveRateLimiter:
+    with rate_limiters_lock:
+        if backend not in rate_limiters:
+            config = get_rate_limit_config(backend)
+            rate_limiters[backend] = AdaptiveRateLimiter(backend, config["requests_per_second"], config["max_bucket_size"],
+                                                         int(config["max_concurrency"]))
+
+        return rate_limiters[backend]
+
+
+# Counters of all rate limiters of this process
+def get_rate_limiter_stats() -> dict[str, dict[str, Any]]:
+    with rate_limiters_lock:
+        return {backend: rate_limiter.get_stats() for backend, rate_limiter in rate_limiters.items()}
@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.rate_limiters import BaseRateLimiter
+from typing import Any
+from uuid import UUID
+
+# Own modules
+# The langchain adapters are kept apart from rate_limiter.py, so that the CLI starts without importing langchain
+from rate_limiter import POLL_INTERVAL, AdaptiveRateLimiter, get_rate_limiter, is_rate_limit_error
+
+
+#################################
+# Adapter for the rate_limiter parameter of langchain chat models. It takes a token from the bucket and a concurrent request slot
+# before each request, and reports the latency and the rate-limit errors to the AIMD concurrency limit.
+# Async requests run in their own task, which returns the slot when it is done, also if it is cancelled. Sync requests return
+# the slot with the RateLimitCallbackHandler, whose callbacks run in the thread of the request.
+#################################
+class LangchainRateLimiter(BaseRateLimiter):
+    def __init__(self, rate_limiter: AdaptiveRateLimiter) -> None:
+        self.rate_limiter = rate_limiter
+        self.sync_requests = threading.local()
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        if not self.rate_limiter.acquire_token(blocking) or not self.rate_limiter.acquire_slot(blocking):
+            return False
+
+        self.sync_requests.start_time = time.monotonic()
+        return True
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        while not self.rate_limiter.acquire_token(blocking=False):
+            if not blocking:
+                return False
+            await asyncio.sleep(POLL_INTERVAL)
+
+        while not self.rate_limiter.acquire_slot(blocking=False):
+            if not blocking:
+                return False
+            await asyncio.sleep(POLL_INTERVAL)
+
+        start_time = time.monotonic()
+        request_task = asyncio.current_task()
+
+        if request_task is None:
+            self.rate_limiter.release_slot(0.0)
+            raise RuntimeError("Async requests must run in a task")
+
+        request_task.add_done_callback(lambda task: self.release_task_slot(task, start_time))
+        return True
+
+    # Return the slot of an async request, when its task is done (or cancelled)
+    def release_task_slot(self, task: "asyncio.Task[Any]", start_time: float) -> None:
+        rate_limited: bool = not task.cancelled() and is_rate_limit_error(task.exception())
+        self.rate_limiter.release_slot(time.monotonic() - start_time, rate_limited)
+
+    # Return the slot of the sync request of this thread (if any)
+    def release_sync_slot(self, rate_limited: bool) -> None:
+        start_time: float | None = getattr(self.sync_requests, "start_time", None)
+        if start_time is None:
+            return
+
+        self.sync_requests.start_time = None
+        self.rate_limiter.release_slot(time.monotonic() - start_time, rate_limited)
+
+
+#################################
+# Callback handler for langchain chat models, which returns the slot of a sync request, when the request has ended.
+#################################
+class RateLimitCallbackHandler(BaseCallbackHandler):
+    def __init__(self, langchain_rate_limiter: LangchainRateLimiter) -> None:
+        self.langchain_rate_limiter = langchain_rate_limiter
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        self.langchain_rate_limiter.release_sync_slot(rate_limited=False)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self.langchain_rate_limiter.release_sync_slot(rate_limited=is_rate_limit_error(error))
+
+
+# Arguments for a langchain chat model, which limit its requests with the shared rate limiter of the backend
+def get_langchain_rate_limiting(backend: str) -> dict[str, Any]:
+    langchain_rate_limiter = LangchainRateLimiter(get_rate_limiter(backend))
+
+    return {"rate_limiter": langchain_rate_limiter, "callbacks": [RateLimitCallbackHandler(langchain_rate_limiter)]}
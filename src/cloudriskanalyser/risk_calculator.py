@@ -1,7 +1,13 @@
 import logging
+import threading
 
+from array import array
 from datetime import datetime
 from enum import Enum
+from typing import Any, Iterable
+
+# Own modules
+from jurisdictions import JURISDICTION_GDPR, UNKNOWN_COUNTRY, jurisdiction_index
 
 #################################
 # Global variables
@@ -12,10 +18,12 @@ logger = logging.getLogger(__name__)
 #################################
 # Constants
 #################################
-GDPR_COUNTRY_LIST: list[str] = ["Austria", "Belgium", "Bulgaria", "Croatia", "Republic of Cyprus", "Czech Republic", "Denmark",
-                                "Estonia", "Finland", "France", "Germany", "Greece", "Hungary", "Ireland", "Italy",
-                                "Latvia", "Lithuania", "Luxembourg", "Malta", "Netherlands", "Poland", "Portugal",
-                                "Romania", "Slovakia", "Slovenia", "Spain", "Sweden"]
+# Total CVSS score of the last 2 years, up to which a CSP is considered HONEST_BUT_CURIOUS (low risk) or CHEAP_AND_LAZY (medium risk)
+CVSS_THRESHOLD_HONEST_BUT_CURIOUS: float = 20.0
+CVSS_THRESHOLD_CHEAP_AND_LAZY: float = 50.0
+
+# Number of bins of the CVSS histogram (one per CVSS point, a score of 10.0 is counted in the last bin)
+CVSS_HISTOGRAM_BINS: int = 10
 
 
 #################################
@@ -43,11 +51,58 @@ class CSPThreatModel(Enum):
 # This class stores CVE entries
 #################################
 class CVEEntry():
+    __slots__ = ("cve_id", "cvss_score")
+
     def __init__(self, cve_id: str, cvss_score: float) -> None:
         self.cve_id = cve_id
         self.cvss_score = cvss_score
 
 
+#################################
+# This class aggregates CVEs one by one (e.g. from an iterator): count, total and maximum CVSS score, and a CVSS histogram.
+# The CVE IDs and scores are only kept if keep_details is set. They are stored in compact arrays, and converted
+# to CVEEntry objects when they are requested.
+#################################
+class CVEAccumulator():
+    def __init__(self, keep_details: bool = False) -> None:
+        self.keep_details = keep_details
+
+        self.count: int = 0
+        self.cvss_total: float = 0.0
+        self.cvss_max: float | None = None
+        self.cvss_histogram: list[int] = [0] * CVSS_HISTOGRAM_BINS
+
+        self.cve_ids: list[str] = []
+        self.cvss_scores: array[float] = array("d")
+
+    def add(self, cve_id: str, cvss_score: float) -> None:
+        self.count += 1
+        self.cvss_total += cvss_score
+        self.cvss_max = cvss_score if self.cvss_max is None else max(self.cvss_max, cvss_score)
+        self.cvss_histogram[min(max(int(cvss_score), 0), CVSS_HISTOGRAM_BINS - 1)] += 1
+
+        if self.keep_details:
+            self.cve_ids.append(cve_id)
+            self.cvss_scores.append(cvss_score)
+
+    def add_all(self, cves: Iterable[CVEEntry]) -> "CVEAccumulator":
+        for cve in cves:
+            self.add(cve.cve_id, cve.cvss_score)
+
+        return self
+
+    # Return the aggregated CVEs. Only possible, if the details are kept.
+    def get_entries(self) -> list[CVEEntry]:
+        if not self.keep_details:
+            raise ValueError("The CVE details were not kept")
+
+        return [CVEEntry(cve_id, cvss_score) for cve_id, cvss_score in zip(self.cve_ids, self.cvss_scores)]
+
+    def get_summary(self) -> str:
+        return (str(self.count) + " CVEs; total CVSS score: " + str(self.cvss_total) + "; maximum CVSS score: " + str(self.cvss_max) +
+                "; CVSS histogram: " + str(self.cvss_histogram))
+
+
 #################################
 # This class takes information about cloud services as input, and calculates the risk of using it.
 #################################
@@ -62,42 +117,75 @@ class RiskCalculator:
 
         self.assessment_start_time: datetime = datetime.now()
 
+        # Wall time of the data-gathering stages (in seconds)
+        self.stage_durations: dict[str, float] = {}
+
+        # The risk parameters can be set concurrently by the data-gathering stages
+        self.lock = threading.Lock()
+
     # --------------------------------
     # Shared Functions
     # --------------------------------
-    # Set information for "lack of control" risk
-    def set_risk_params_lack_of_control(self, cve_list: list[CVEEntry]) -> None:
-        self.cve_list = cve_list
+    # Set information for "lack of control" risk.
+    # The CVEs are aggregated one by one, so that they can be streamed from the CVE db. Only with keep_details, the CVE IDs and scores are kept
+    # (e.g. for the per-CVE report of the interactive mode).
+    def set_risk_params_lack_of_control(self, cve_list: Iterable[CVEEntry], keep_details: bool = False) -> None:
+        cve_accumulator = CVEAccumulator(keep_details).add_all(cve_list)
 
-        info_string: str = ("Risk variables set for 'lack of control risk': \n")
-        for cve in cve_list:
-            info_string += (cve.cve_id + "; " + str(cve.cvss_score) + "\n")
+        with self.lock:
+            self.cve_accumulator = cve_accumulator
 
+        info_string: str = "Risk variables set for 'lack of control risk': " + cve_accumulator.get_summary()
         print(info_string)
         logger.info(info_string)
 
+        if keep_details and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("CVEs for 'lack of control risk':\n" +
+                         "\n".join(cve_id + "; " + str(cvss_score) for cve_id, cvss_score in zip(cve_accumulator.cve_ids, cve_accumulator.cvss_scores)))
+
+    # The CVEs of the "lack of control" risk (only available if their details are kept)
+    @property
+    def cve_list(self) -> list[CVEEntry]:
+        if not hasattr(self, "cve_accumulator"):
+            raise AttributeError("Risk variables for 'lack of control risk' not set")
+
+        return self.cve_accumulator.get_entries()
+
+    @cve_list.setter
+    def cve_list(self, cve_list: list[CVEEntry]) -> None:
+        self.cve_accumulator = CVEAccumulator(keep_details=True).add_all(cve_list)
+
     # Set information for "insec auth" risk
     def set_risk_params_insec_auth(self, csp_supports_mfa: bool, csp_supports_auth_protocols: bool) -> None:
-        self.csp_supports_mfa = csp_supports_mfa
-        self.csp_supports_auth_protocols = csp_supports_auth_protocols
+        with self.lock:
+            self.csp_supports_mfa = csp_supports_mfa
+            self.csp_supports_auth_protocols = csp_supports_auth_protocols
 
-        info_string: str = ("Risk variables set for 'insec auth risk'. csp_supports_mfa: " + str(csp_supports_mfa) +
-                            "; csp_supports_auth_protocols: " + str(csp_supports_auth_protocols))
-        print(info_string)
-        logger.info(info_string)
+            info_string: str = ("Risk variables set for 'insec auth risk'. csp_supports_mfa: " + str(csp_supports_mfa) +
+                                "; csp_supports_auth_protocols: " + str(csp_supports_auth_protocols))
+            print(info_string)
+            logger.info(info_string)
 
     # Set information for "comp_issues" risk
     def set_risk_params_comp_issues(self, csp_default_countries: list[str], csp_possible_countries: list[str]) -> None:
-        # If not known, "unknown" will be passed
-        self.csp_default_countries = csp_default_countries
+        with self.lock:
+            # If not known, "unknown" will be passed
+            self.csp_default_countries = csp_default_countries
 
-        # This method is capable of accepting the "countries where the data can possibly be stored".
-        # However, since this is difficult to gather, it is currently not used.
-        self.csp_possible_countries = csp_possible_countries
+            # This method is capable of accepting the "countries where the data can possibly be stored".
+            # However, since this is difficult to gather, it is currently not used.
+            self.csp_possible_countries = csp_possible_countries
 
-        info_string: str = ("Risk variables set for 'comp issues risk'. csp_default_countries: " + str(csp_default_countries))
-        print(info_string)
-        logger.info(info_string)
+            info_string: str = ("Risk variables set for 'comp issues risk'. csp_default_countries: " + str(csp_default_countries))
+            print(info_string)
+            logger.info(info_string)
+
+    # Record the wall time of a data-gathering stage
+    def set_stage_duration(self, stage_name: str, duration: float) -> None:
+        with self.lock:
+            self.stage_durations[stage_name] = duration
+
+        logger.info("Duration for gathering '" + stage_name + "' data: " + str(duration) + " seconds")
 
     # Calculate overall risk based on information stored in this class
     def get_risk(self) -> None:
@@ -128,7 +216,8 @@ class RiskCalculator:
             risk_avg_rnd: float = round((risk_avg + 0.5), 0)
             risk_avg_rnd_int = int(risk_avg_rnd)
 
-            self.risk_overall = RiskLevel(risk_avg_rnd_int)
+            # If all risks are high, the rounding results in 6, which is limited to HIGH
+            self.risk_overall = RiskLevel(min(risk_avg_rnd_int, RiskLevel.HIGH.value))
 
         print("Overall risk is: " + self.risk_overall.name)
 
@@ -141,26 +230,46 @@ class RiskCalculator:
         # Log instance variables (for debugging)
         logger.info("RiskCalculator variables: " + str(vars(self)))
 
+    # Return the inputs and results of this assessment as a flat record (e.g. for writing batch results to a file)
+    def get_result_record(self) -> dict[str, Any]:
+        record: dict[str, Any] = {
+            "csp_name": self.csp_name,
+            "user_country": self.user_country,
+            "cve_count": self.cve_accumulator.count if hasattr(self, "cve_accumulator") else None,
+            "cvss_total": self.cve_accumulator.cvss_total if hasattr(self, "cve_accumulator") else None,
+            "cvss_max": self.cve_accumulator.cvss_max if hasattr(self, "cve_accumulator") else None,
+            "cvss_histogram": list(self.cve_accumulator.cvss_histogram) if hasattr(self, "cve_accumulator") else None,
+            "csp_supports_mfa": getattr(self, "csp_supports_mfa", None),
+            "csp_supports_auth_protocols": getattr(self, "csp_supports_auth_protocols", None),
+            "csp_default_countries": getattr(self, "csp_default_countries", None),
+            "risk_lack_of_control": self.risk_lack_of_control.name if hasattr(self, "risk_lack_of_control") else None,
+            "risk_insec_auth": self.risk_insec_auth.name if hasattr(self, "risk_insec_auth") else None,
+            "risk_comp_issues": self.risk_comp_issues.name if hasattr(self, "risk_comp_issues") else None,
+            "risk_overall": self.risk_overall.name if hasattr(self, "risk_overall") else None,
+            "duration_seconds": ((self.assessment_end_time - self.assessment_start_time).total_seconds()
+                                 if hasattr(self, "assessment_end_time") else None),
+            "stage_durations": dict(self.stage_durations)
+        }
+
+        return record
+
     # Calculate 'lack of control' risk
     def get_risk_lack_of_control(self) -> RiskLevel:
 
         # Only assess if input variables are filled. Otherwise return "NA"
-        if not hasattr(self, 'cve_list'):
+        if not hasattr(self, 'cve_accumulator'):
             logger.warning("Not possible to assess 'lack of control' risk. Input variables not set.")
             return RiskLevel.NA
 
-        cvss_total: float = 0.0
-
-        for cve in self.cve_list:
-            cvss_total += cve.cvss_score
-            logger.info("Total CVSS score in the last 2 years is: " + str(cvss_total))
+        cvss_total: float = self.cve_accumulator.cvss_total
+        logger.info("Total CVSS score in the last 2 years is: " + str(cvss_total))
 
         match cvss_total:
-            case _ if cvss_total <= 20.0:
+            case _ if cvss_total <= CVSS_THRESHOLD_HONEST_BUT_CURIOUS:
                 self.csp_threat_model = CSPThreatModel.HONEST_BUT_CURIOUS
-            case _ if cvss_total <= 50.0:
+            case _ if cvss_total <= CVSS_THRESHOLD_CHEAP_AND_LAZY:
                 self.csp_threat_model = CSPThreatModel.CHEAP_AND_LAZY
-            case _ if cvss_total > 50.0:
+            case _ if cvss_total > CVSS_THRESHOLD_CHEAP_AND_LAZY:
                 self.csp_threat_model = CSPThreatModel.MALICIOUS
 
         # If HONEST BUT CURIOUS -> Low Risk
@@ -207,24 +316,28 @@ class RiskCalculator:
         # If OTHER COUNTRY, similar jurisdiction -> Medium-Low Risk
         # If SAME COUNTRY -> Low Risk
 
+        # The countries are compared by their keys (ISO codes), so that different names of the same country are equal
+        csp_countries: set[str] = {jurisdiction_index.get_country_key(country) for country in self.csp_default_countries}
+        user_country: str = jurisdiction_index.get_country_key(self.user_country)
+        gdpr_countries = jurisdiction_index.groups[JURISDICTION_GDPR]
+
         # unknown -> Always high risk
-        if "unknown" in (country.lower() for country in self.csp_default_countries):
+        if UNKNOWN_COUNTRY in csp_countries:
             return RiskLevel.HIGH
 
         # Only user country available -> Always low risk
-        elif (self.user_country in self.csp_default_countries and
-              len(self.csp_default_countries) == 1):
+        elif csp_countries == {user_country}:
             return RiskLevel.LOW
 
         # Country from similar jurisdiction -> Medium-Low risk
-        # - If user country is in GDPR-List
-        # - And ALL CSP countries also in GDPR-List
-        elif (self.user_country in GDPR_COUNTRY_LIST and
-              set(self.csp_default_countries).issubset(set(GDPR_COUNTRY_LIST))):
+        # - If user country is subject to the GDPR
+        # - And ALL CSP countries also subject to the GDPR
+        elif (user_country in gdpr_countries and
+              csp_countries.issubset(gdpr_countries)):
             return RiskLevel.MEDIUM_LOW
 
         # If the data is stored in one other country (a single country). -> Medium risk
-        elif len(self.csp_default_countries) == 1:
+        elif len(csp_countries) == 1:
             return RiskLevel.MEDIUM
 
         # In this case the data is stored in any other countries (multiple countries). -> High risk
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+from langchain_community.utilities.google_search import GoogleSearchAPIWrapper
+from pydantic import ConfigDict, model_validator
+from typing import Any
+
+# Own modules
+from cassette import Cassette
+from instrumentation import add_span_metrics, span
+
+
+#################################
+# Global variables
+#################################
+logger = logging.getLogger(__name__)
+
+
+#################################
+# Constants
+#################################
+SEARCH_CACHE_DB_FILE: str = "search_cache.db"
+SEARCH_CACHE_TTL: int = 7 * 24 * 3600
+
+# Answer of GoogleSearchAPIWrapper.results() if nothing was found. It is not cached, since it is often caused by a temporary problem.
+SEARCH_NO_RESULT_KEY: str = "Result"
+
+
+# Normalize a search query, so that the nearly identical queries generated by the LLM share one cache entry.
+# E.g. '1. "Does Dropbox support MFA?"' and 'does dropbox support  MFA' result in the same query.
+def normalize_query(query: str) -> str:
+    normalized_query: str = re.sub(r"^\s*\d+[.)]\s*", "", query.lower())
+    normalized_query = re.sub(r"[\"'?!.]", "", normalized_query)
+
+    return " ".join(normalized_query.split())
+
+
+#################################
+# This class stores the results of google searches on disk (sqlite).
+# Entries are keyed by the normalized query, the number of results and the search parameters, and expire after the TTL.
+#################################
+class SearchResultCache():
+    def __init__(self, db_file_name: str = SEARCH_CACHE_DB_FILE, ttl: int = SEARCH_CACHE_TTL) -> None:
+        self.db_file_name = db_file_name
+        self.ttl = ttl
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.expired: int = 0
+
+        # The connection is opened on first use, and shared by all threads
+        self.connection: sqlite3.Connection | None = None
+        self.lock = threading.Lock()
+
+    # Open the database, and create the table if it does not exist yet
+    def get_connection(self) -> sqlite3.Connection:
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.db_file_name, check_same_thread=False)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS search_results ("
+                                    "cache_key TEXT PRIMARY KEY, "
+                                    "query TEXT NOT NULL, "
+                                    "results TEXT NOT NULL, "
+                                    "expires_at REAL NOT NULL)")
+            self.connection.commit()
+
+        return self.connection
+
+    # Create the key of a cache entry
+    def get_key(self, query: str, num_results: int, search_params: dict[str, str] | None) -> str:
+        key_input: str = "\x1f".join([normalize_query(query), str(num_results), json.dumps(search_params or {}, sort_keys=True)])
+
+        return hashlib.sha256(key_input.encode("utf-8")).hexdigest()
+
+    # Return the cached search results, or None if there is no valid entry
+    def get(self, query: str, num_results: int, search_params: dict[str, str] | None = None) -> list[dict[str, Any]] | None:
+        cache_key = self.get_key(query, num_results, search_params)
+
+        with self.lock:
+            connection = self.get_connection()
+            row = connection.execute("SELECT results, expires_at FROM search_results WHERE cache_key = ?", (cache_key,)).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            if row[1] <= time.time():
+                connection.execute("DELETE FROM search_results WHERE cache_key = ?", (cache_key,))
+                connection.commit()
+                self.expired += 1
+                self.misses += 1
+                return None
+
+            self.hits += 1
+
+        results: list[dict[str, Any]] = json.loads(row[0])
+        return results
+
+    # Store the search results
+    def put(self, query: str, num_results: int, search_params: dict[str, str] | None, results: list[dict[str, Any]]) -> None:
+        cache_key = self.get_key(query, num_results, search_params)
+
+        with self.lock:
+            connection = self.get_connection()
+            connection.execute("INSERT OR REPLACE INTO search_results VALUES (?, ?, ?, ?)",
+                               (cache_key, normalize_query(query), json.dumps(results), time.time() + self.ttl))
+            connection.commit()
+
+    # Remove all entries
+    def clear(self) -> None:
+        with self.lock:
+            connection = self.get_connection()
+            connection.execute("DELETE FROM search_results")
+            connection.commit()
+
+    # Hit/miss counters of this process. Each hit is a search, which did not need to be sent to google.
+    def get_stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+
+        return {
+            "searches_avoided": self.hits,
+            "searches_sent": self.misses,
+            "expired": self.expired,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0
+        }
+
+    # Close the database connection. It is reopened on the next access.
+    def close(self) -> None:
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+#################################
+# This search wrapper puts a SearchResultCache in front of another search wrapper.
+# Searches are only sent to the wrapped search, if the cache does not contain a valid entry.
+#################################
+class CachedGoogleSearchAPIWrapper(GoogleSearchAPIWrapper):
+    search_wrapper: GoogleSearchAPIWrapper
+    search_cache: SearchResultCache
+
+    model_config = ConfigDict(extra="forbid", arbitrary_types_allowed=True)
+
+    # The API key is only needed by the wrapped search
+    @model_validator(mode="before")
+    @classmethod
+    def validate_environment(cls, values: dict[str, Any]) -> Any:
+        return values
+
+    def _google_search_results(self, search_term: str, **kwargs: Any) -> list[dict[str, Any]]:
+        return self.search_wrapper._google_search_results(search_term, **kwargs)
+
+    def results(self, query: str, num_results: int, search_params: dict[str, str] | None = None) -> list[dict[str, Any]]:
+        cached_results = self.search_cache.get(query, num_results, search_params)
+
+        if cached_results is not None:
+            logger.info("Search results from cache for: " + query)
+            add_span_metrics(searches_avoided=1)
+            return cached_results
+
+        with span("search"):
+            results: list[dict[str, Any]] = self.search_wrapper.results(query, num_results, search_params)
+
+        if not any(SEARCH_NO_RESULT_KEY in result for result in results):
+            self.search_cache.put(query, num_results, search_params, results)
+
+        return results
+
+
+#################################
+# This search wrapper records the results of another search wrapper (or replays them). In replay mode, no search wrapper
+# (and no API key) is needed.
+#################################
+class CassetteGoogleSearchAPIWrapper(GoogleSearchAPIWrapper):
+    cassette: Cassette
+    search_wrapper: GoogleSearchAPIWrapper | None = None
+
+    model_config = ConfigDict(extra="forbid", arbitrary_types_allowed=True)
+
+    # The API key is only needed by the wrapped search
+    @model_validator(mode="before")
+    @classmethod
+    def validate_environment(cls, values: dict[str, Any]) -> Any:
+        return values
+
+    def get_search_wrapper(self) -> GoogleSearchAPIWrapper:
+        if self.search_wrapper is None:
+            raise ValueError("Recording needs a search wrapper")
+
+        return self.search_wrapper
+
+    def _google_search_results(self, search_term: str, **kwargs: Any) -> list[dict[str, Any]]:
+        return self.get_search_wrapper()._google_search_results(search_term, **kwargs)
+
+    def results(self, query: str, num_results: int, search_params: dict[str, str] | None = None) -> list[dict[str, Any]]:
+        results: list[dict[str, Any]] = self.cassette.call("search", {"query": query, "num_results": num_results, "search_params": search_params},
+                                                           lambda: self.get_search_wrapper().results(query, num_results, search_params))
+        return results
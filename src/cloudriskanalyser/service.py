@@ -0,0 +1,349 @@
+import importlib
+import json
+import logging
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable
+from urllib.parse import parse_qs, urlparse
+
+# Own modules
+from instrumentation import propagate_context
+from llm_researcher import DataGatheringMethod, LLMResearcherRegistry
+
+
+#################################
+# Global variables
+#################################
+logger = logging.getLogger(__name__)
+
+# Function which assesses one CSP and returns its result record (e.g. analyser.get_batch_result_record).
+# Parameters: csp_name, user_country, data_gathering_method, cve_data_gathering_method, batched_questions
+AssessFunction = Callable[[str, str, DataGatheringMethod, DataGatheringMethod, bool], dict[str, Any]]
+
+
+#################################
+# Constants
+#################################
+SERVICE_DEFAULT_HOST: str = "127.0.0.1"
+SERVICE_DEFAULT_PORT: int = 8765
+SERVICE_DEFAULT_MAX_WORKERS: int = 4
+# Maximum number of queued and running assessments. Further submissions are rejected with "503 Service Unavailable".
+SERVICE_DEFAULT_MAX_QUEUE: int = 100
+# Number of finished assessments, which can still be polled. The oldest ones are removed first.
+SERVICE_MAX_FINISHED_JOBS: int = 1000
+# Maximum time (seconds) a request waits for the result of an assessment (?wait=...)
+SERVICE_MAX_WAIT: float = 60.0
+
+JOB_STATUS_QUEUED: str = "queued"
+JOB_STATUS_RUNNING: str = "running"
+JOB_STATUS_DONE: str = "done"
+JOB_STATUS_FAILED: str = "failed"
+JOB_FINISHED_STATUSES: list[str] = [JOB_STATUS_DONE, JOB_STATUS_FAILED]
+
+
+#################################
+# This class holds one submitted assessment and its result record
+#################################
+class AssessmentJob():
+    def __init__(self, csp_name: str, user_country: str, data_gathering_method: DataGatheringMethod,
+                 cve_data_gathering_method: DataGatheringMethod, batched_questions: bool = False) -> None:
+        self.id = uuid.uuid4().hex
+        self.csp_name = csp_name
+        self.user_country = user_country
+        self.data_gathering_method = data_gathering_method
+        self.cve_data_gathering_method = cve_data_gathering_method
+        self.batched_questions = batched_questions
+
+        self.status = JOB_STATUS_QUEUED
+        self.result: dict[str, Any] | None = None
+        self.submitted_at = time.time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+
+        # Notified on every change of the status
+        self.changed = threading.Condition()
+
+    def is_finished(self) -> bool:
+        return self.status in JOB_FINISHED_STATUSES
+
+    def set_status(self, status: str, result: dict[str, Any] | None = None) -> None:
+        with self.changed:
+            self.status = status
+
+            if status == JOB_STATUS_RUNNING:
+                self.started_at = time.time()
+            elif status in JOB_FINISHED_STATUSES:
+                self.result = result
+                self.finished_at = time.time()
+
+            self.changed.notify_all()
+
+    # Wait until the status is no longer previous_status, or the timeout (seconds) has expired. Returns the current status.
+    def wait_for_change(self, previous_status: str, timeout: float) -> str:
+        with self.changed:
+            self.changed.wait_for(lambda: self.status != previous_status, timeout)
+            return self.status
+
+    # Wait until the assessment is finished, or the timeout (seconds) has expired
+    def wait(self, timeout: float) -> bool:
+        with self.changed:
+            return self.changed.wait_for(self.is_finished, timeout)
+
+    def to_dict(self) -> dict[str, Any]:
+        with self.changed:
+            return {
+                "id": self.id,
+                "status": self.status,
+                "csp_name": self.csp_name,
+                "user_country": self.user_country,
+                "method": self.data_gathering_method.value,
+                "cve_method": self.cve_data_gathering_method.value,
+                "batched_questions": self.batched_questions,
+                "submitted_at": self.submitted_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "result": self.result
+            }
+
+
+#################################
+# This class runs the assessments of the daemon mode on a bounded thread pool.
+# The research runners of the registry (and their caches and vector stores) stay warm between the assessments.
+#################################
+class AssessmentService():
+    def __init__(self, assess_function: AssessFunction, registry: LLMResearcherRegistry, max_workers: int = SERVICE_DEFAULT_MAX_WORKERS,
+                 max_queue: int = SERVICE_DEFAULT_MAX_QUEUE) -> None:
+        self.assess_function = assess_function
+        self.registry = registry
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="assessment")
+
+        self.jobs: OrderedDict[str, AssessmentJob] = OrderedDict()
+        self.pending: int = 0
+        self.submitted: int = 0
+        self.rejected: int = 0
+        self.lock = threading.Lock()
+
+    # Create the research runners of the data-gathering methods, so that the first assessment does not pay for their setup
+    def warm_up(self, data_gathering_methods: list[DataGatheringMethod]) -> None:
+        for data_gathering_method in data_gathering_methods:
+            if data_gathering_method == DataGatheringMethod.CVE_DB_DIRECT:
+                # There is no runner for the direct CVE data-gathering. Its loader (and nvdlib) is imported instead.
+                importlib.import_module("cve_loader")
+            else:
+                self.registry.get_runner(data_gathering_method)
+
+    # Queue an assessment. Returns None, if the queue is full.
+    def submit(self, csp_name: str, user_country: str, data_gathering_method: DataGatheringMethod,
+               cve_data_gathering_method: DataGatheringMethod = DataGatheringMethod.CVE_DB_DIRECT,
+               batched_questions: bool = False) -> AssessmentJob | None:
+        job = AssessmentJob(csp_name, user_country, data_gathering_method, cve_data_gathering_method, batched_questions)
+
+        with self.lock:
+            if self.pending >= self.max_queue:
+                self.rejected += 1
+                return None
+
+            self.pending += 1
+            self.submitted += 1
+            self.jobs[job.id] = job
+            self.remove_finished_jobs()
+
+        self.executor.submit(propagate_context(self.run_job), job)
+
+        return job
+
+    def get_job(self, job_id: str) -> AssessmentJob | None:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def run_job(self, job: AssessmentJob) -> None:
+        job.set_status(JOB_STATUS_RUNNING)
+
+        try:
+            result = self.assess_function(job.csp_name, job.user_country, job.data_gathering_method, job.cve_data_gathering_method,
+                                          job.batched_questions)
+        except Exception as e:
+            logger.exception("Assessment failed for " + job.csp_name)
+            result = {"csp_name": job.csp_name, "user_country": job.user_country, "valid_csp": None, "error": repr(e)}
+
+        with self.lock:
+            self.pending -= 1
+
+        job.set_status(JOB_STATUS_FAILED if "error" in result else JOB_STATUS_DONE, result)
+
+    # Remove the oldest finished jobs beyond SERVICE_MAX_FINISHED_JOBS (the lock must be held)
+    def remove_finished_jobs(self) -> None:
+        finished_jobs = [job_id for job_id, job in self.jobs.items() if job.is_finished()]
+
+        for job_id in finished_jobs[:max(0, len(finished_jobs) - SERVICE_MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def get_stats(self) -> dict[str, Any]:
+        with self.lock:
+            stats: dict[str, Any] = {
+                "pending": self.pending,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "jobs": len(self.jobs)
+            }
+
+        stats["warm_runners"] = [data_gathering_method.name for data_gathering_method in self.registry.runners]
+        stats["runner_setup_duration"] = self.registry.get_setup_duration()
+
+        return stats
+
+    # Wait for the running assessments, then close the research runners
+    def close(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.registry.close()
+
+
+#################################
+# This class handles the requests to the local HTTP API of the daemon mode:
+#   POST /assessments                      submit an assessment ({"csp_name": ..., "user_country": ..., "method": 1, "cve_method": 4,
+#                                          "batched_questions": false}), returns the job with status "queued"
+#   GET  /assessments/<id>[?wait=SECONDS]  return the job; with wait, the response is sent when the assessment is finished (long polling)
+#   GET  /assessments/<id>/events          stream the job as one JSON line per status change, until the assessment is finished
+#   GET  /health                           return the counters of the service
+#################################
+class AssessmentRequestHandler(BaseHTTPRequestHandler):
+    server: "AssessmentHTTPServer"
+
+    def do_POST(self) -> None:
+        if urlparse(self.path).path != "/assessments":
+            self.send_json(404, {"error": "Not found"})
+            return
+
+        try:
+            content_length = int(self.headers.get("Content-Length", 0))
+            request: dict[str, Any] = json.loads(self.rfile.read(content_length) or b"{}")
+
+            csp_name = str(request["csp_name"]).strip()
+            user_country = str(request["user_country"]).strip()
+            data_gathering_method = DataGatheringMethod(int(request.get("method", DataGatheringMethod.GEMINI_SEARCH_SEPARATE.value)))
+            cve_data_gathering_method = DataGatheringMethod(int(request.get("cve_method", DataGatheringMethod.CVE_DB_DIRECT.value)))
+            batched_questions = bool(request.get("batched_questions", False))
+        except (KeyError, TypeError, ValueError) as e:
+            self.send_json(400, {"error": "Invalid request: " + repr(e)})
+            return
+
+        if csp_name == "" or data_gathering_method not in [DataGatheringMethod.GEMINI_SEARCH_SEPARATE, DataGatheringMethod.GEMINI_DIRECT] or \
+           cve_data_gathering_method not in [DataGatheringMethod.GEMINI_CVE_DB, DataGatheringMethod.CVE_DB_DIRECT]:
+            self.send_json(400, {"error": "Invalid CSP name or data-gathering method"})
+            return
+
+        job = self.server.service.submit(csp_name, user_country, data_gathering_method, cve_data_gathering_method, batched_questions)
+
+        if job is None:
+            self.send_json(503, {"error": "Too many pending assessments"}, {"Retry-After": "1"})
+            return
+
+        self.send_json(202, job.to_dict(), {"Location": "/assessments/" + job.id})
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        path_parts = url.path.strip("/").split("/")
+
+        if path_parts == ["health"]:
+            self.send_json(200, {"status": "ok", "service": self.server.service.get_stats()})
+            return
+
+        if len(path_parts) < 2 or len(path_parts) > 3 or path_parts[0] != "assessments" or path_parts[2:] not in [[], ["events"]]:
+            self.send_json(404, {"error": "Not found"})
+            return
+
+        job = self.server.service.get_job(path_parts[1])
+
+        if job is None:
+            self.send_json(404, {"error": "Unknown assessment: " + path_parts[1]})
+            return
+
+        if path_parts[2:] == ["events"]:
+            self.stream_job(job)
+            return
+
+        try:
+            wait = min(float(parse_qs(url.query).get("wait", ["0"])[0]), SERVICE_MAX_WAIT)
+        except ValueError:
+            self.send_json(400, {"error": "Invalid wait time"})
+            return
+
+        if wait > 0:
+            job.wait(wait)
+
+        self.send_json(200, job.to_dict())
+
+    # Send one JSON line per status change. The connection is closed when the assessment is finished.
+    def stream_job(self, job: AssessmentJob) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        status = ""
+        while True:
+            job_data = job.to_dict()
+
+            if job_data["status"] != status:
+                status = job_data["status"]
+                self.wfile.write((json.dumps(job_data) + "\n").encode("utf-8"))
+                self.wfile.flush()
+
+            if status in JOB_FINISHED_STATUSES:
+                break
+
+            job.wait_for_change(status, SERVICE_MAX_WAIT)
+
+        self.close_connection = True
+
+    def send_json(self, status_code: int, data: dict[str, Any], headers: dict[str, str] | None = None) -> None:
+        body = json.dumps(data).encode("utf-8")
+
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.info("%s - " + format, self.address_string(), *args)
+
+
+class AssessmentHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address: tuple[str, int], service: AssessmentService) -> None:
+        super().__init__(server_address, AssessmentRequestHandler)
+        self.service = service
+
+
+#################################
+# Functions
+#################################
+# Run the daemon mode until it is interrupted (Ctrl+C). The runners of warm_up_methods are created before the first request.
+def run_service(service: AssessmentService, host: str = SERVICE_DEFAULT_HOST, port: int = SERVICE_DEFAULT_PORT,
+                warm_up_methods: list[DataGatheringMethod] | None = None) -> None:
+    setup_start_time = time.perf_counter()
+    service.warm_up(warm_up_methods or [])
+
+    server = AssessmentHTTPServer((host, port), service)
+    print("Assessment service listening on http://" + host + ":" + str(server.server_address[1]) + " (warm-up took " +
+          str(round(time.perf_counter() - setup_start_time, 2)) + " seconds)")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping assessment service...")
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,150 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+import uuid
+
+from chromadb.api import ClientAPI
+from chromadb.api.models.Collection import Collection
+from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
+
+# Own modules
+from embedding_cache import DedupingChroma
+
+
+#################################
+# Global variables
+#################################
+logger = logging.getLogger(__name__)
+
+
+#################################
+# Constants
+#################################
+# Increase this version if the content of the collections changes (e.g. other chunking or another embedding model).
+# Collections with another version are not used anymore, and are removed by collect_garbage().
+COLLECTION_SCHEMA_VERSION: int = 2
+
+# Time-to-live (in seconds) of the collections per source type
+COLLECTION_TTLS: dict[str, int] = {
+    "web": 14 * 24 * 3600,
+    "cve": 24 * 3600
+}
+COLLECTION_DEFAULT_TTL: int = 7 * 24 * 3600
+
+# Prefix of the collection metadata, which marks a question as researched
+RESEARCHED_METADATA_PREFIX: str = "researched_"
+
+
+# Return the name of the collection for a CSP and a source type (e.g. "web_dropbox_v2").
+# Chroma only allows names with 3-63 characters [a-zA-Z0-9._-], so long or special names are shortened with a hash.
+def get_collection_name(csp_name: str, source_type: str) -> str:
+    csp_slug: str = re.sub(r"[^a-z0-9]+", "-", csp_name.lower()).strip("-")
+
+    if csp_slug == "" or len(csp_slug) > 40 or csp_slug != csp_name.lower():
+        csp_slug = (csp_slug[:30] + "-" + hashlib.sha256(csp_name.encode("utf-8")).hexdigest()[:8]).strip("-")
+
+    return source_type + "_" + csp_slug + "_v" + str(COLLECTION_SCHEMA_VERSION)
+
+
+# Create a new, empty collection in the shared chroma client. Each question gets its own collection,
+# so that the results of different questions (and CSPs) are not mixed up. Duplicate documents are not added.
+def create_question_vectorstore(chroma_client: ClientAPI, embeddings: Embeddings) -> Chroma:
+    vectorstore: Chroma = DedupingChroma(
+                            client=chroma_client,
+                            embedding_function=embeddings,
+                            collection_name=str(uuid.uuid4())
+                        )
+
+    return vectorstore
+
+
+#################################
+# This class manages the persistent collections in the chroma vector store.
+# There is one collection per CSP and source type ("web" for web research, "cve" for the CVE db). Collections expire after
+# the TTL of their source type, and are then rebuilt. The crawled and embedded data is therefore reused between assessments.
+#################################
+class VectorStoreManager():
+    def __init__(self, chroma_client: ClientAPI, embeddings: Embeddings | None = None, ttls: dict[str, int] | None = None) -> None:
+        self.chroma_client = chroma_client
+        self.embeddings = embeddings
+        self.ttls: dict[str, int] = COLLECTION_TTLS if ttls is None else ttls
+        self.lock = threading.Lock()
+
+    def get_ttl(self, source_type: str) -> int:
+        return self.ttls.get(source_type, COLLECTION_DEFAULT_TTL)
+
+    # Check if the collection was created with the current schema and is not expired
+    def is_fresh(self, collection: Collection) -> bool:
+        metadata = collection.metadata or {}
+
+        if metadata.get("schema_version") != COLLECTION_SCHEMA_VERSION or "created_at" not in metadata:
+            return False
+
+        return time.time() - float(metadata["created_at"]) < self.get_ttl(str(metadata.get("source_type", "")))
+
+    # Return the vector store for the CSP and the source type. Expired collections are replaced by an empty one.
+    def get_vectorstore(self, csp_name: str, source_type: str) -> Chroma:
+        collection_name = get_collection_name(csp_name, source_type)
+
+        with self.lock:
+            collection = self.chroma_client.get_or_create_collection(collection_name, metadata=self.get_new_metadata(csp_name, source_type))
+
+            if not self.is_fresh(collection):
+                logger.info("Collection " + collection_name + " is expired. Rebuilding it.")
+                self.chroma_client.delete_collection(collection_name)
+                self.chroma_client.create_collection(collection_name, metadata=self.get_new_metadata(csp_name, source_type))
+
+        vectorstore: Chroma = DedupingChroma(
+                                client=self.chroma_client,
+                                embedding_function=self.embeddings,
+                                collection_name=collection_name
+                            )
+
+        return vectorstore
+
+    # Metadata of a new collection
+    def get_new_metadata(self, csp_name: str, source_type: str) -> dict[str, str | int | float]:
+        return {
+            "csp_name": csp_name,
+            "source_type": source_type,
+            "schema_version": COLLECTION_SCHEMA_VERSION,
+            "created_at": time.time()
+        }
+
+    # Check if the data for a question (e.g. a google search) was already added to the collection
+    def is_researched(self, vectorstore: Chroma, question: str) -> bool:
+        metadata = vectorstore._collection.metadata or {}
+
+        return self.get_researched_key(question) in metadata
+
+    # Mark the data for a question as added to the collection
+    def mark_researched(self, vectorstore: Chroma, question: str) -> None:
+        with self.lock:
+            collection: Collection = self.chroma_client.get_collection(vectorstore._collection.name)
+            metadata = dict(collection.metadata or {})
+            metadata[self.get_researched_key(question)] = time.time()
+            collection.modify(metadata=metadata)
+
+            # The langchain wrapper holds its own collection object
+            vectorstore._chroma_collection = collection
+
+    def get_researched_key(self, question: str) -> str:
+        return RESEARCHED_METADATA_PREFIX + hashlib.sha256(question.encode("utf-8")).hexdigest()[:16]
+
+    # Delete all expired collections, collections of older schema versions and collections not managed by this class
+    # (e.g. temporary collections of aborted runs). Returns the names of the deleted collections.
+    def collect_garbage(self) -> list[str]:
+        deleted_collections: list[str] = []
+
+        with self.lock:
+            for collection in self.chroma_client.list_collections():
+                if not self.is_fresh(collection):
+                    self.chroma_client.delete_collection(collection.name)
+                    deleted_collections.append(collection.name)
+
+        logger.info("Deleted " + str(len(deleted_collections)) + " collections: " + str(deleted_collections))
+
+        return deleted_collections
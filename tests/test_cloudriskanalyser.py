@@ -1,10 +1,58 @@
 #!/usr/bin/python
+import asyncio
+import chromadb
+import itertools
+import json
+import os
 import pytest
+import requests
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import ANY
 
 # Own modules
 import analyser as cra
-from llm_researcher import DataGatheringMethod
-from risk_calculator import RiskCalculator, RiskLevel, CVEEntry
+import assessment_store
+from assessment_store import AssessmentStore, merge_cve_records
+import benchmark
+from batch_scorer import RiskInputBatch, get_risk_level_names, rescore_records, score_risk_batch
+from cassette import Cassette
+from cassette_langchain import CassetteChatModel, CassetteEmbeddings
+from cassette import save_active_cassette, set_active_cassette
+from context_compression import CONTEXT_TOKEN_BUDGETS, compress_documents, estimate_tokens, get_compressing_retriever, get_question_type
+from llm_cache import LLMAnswerCache
+from llm_data import LLMPrompts as prm
+import cve_loader
+from cve_loader import CVELoader, set_default_nvd_mirror
+from embedding_cache import AtomicLocalFileStore, DedupingChroma, get_cached_embeddings
+from jurisdictions import JURISDICTION_EEA, JURISDICTION_EU, JURISDICTION_EU_ADEQUACY, JURISDICTION_GDPR, UNKNOWN_COUNTRY, JurisdictionIndex, jurisdiction_index
+from instrumentation import Span, Trace, get_span_percentiles, propagate_context, span, start_trace, trace_collector
+from instrumentation_langchain import get_instrumentation_config
+import instrumentation
+from vector_store import VectorStoreManager, get_collection_name
+from langchain_community.llms.fake import FakeListLLM
+from langchain_community.utilities.google_search import GoogleSearchAPIWrapper
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import BaseChatModel, GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableLambda
+from llm_researcher import DataGatheringMethod, LLMResearcher, LLMResearcherRegistry, CachedLLMResearcher, get_likelihood_prompt
+from llm_researcher_cve import LLMResearcherGeminiCVE, get_cve_document, get_vendor_match
+from llm_researcher_direct import LLMResearcherGeminiDirect
+from nvd_mirror import NVDMirror
+from page_fetcher import CassettePageFetcher, PageFetcher, PooledWebResearchRetriever
+from rate_limiter import AdaptiveRateLimiter, get_rate_limit_config, is_rate_limit_error, rate_limiters
+from rate_limiter_langchain import LangchainRateLimiter, RateLimitCallbackHandler
+from search_cache import CachedGoogleSearchAPIWrapper, CassetteGoogleSearchAPIWrapper, SearchResultCache, normalize_query
+from service import AssessmentHTTPServer, AssessmentService
+from risk_calculator import CVEAccumulator, RiskCalculator, RiskLevel, CVEEntry
 
 #################################
 # CONSTANTS
@@ -12,6 +60,10 @@ from risk_calculator import RiskCalculator, RiskLevel, CVEEntry
 DATA_GATHERING_METHOD: list[DataGatheringMethod] = [DataGatheringMethod.GEMINI_SEARCH_SEPARATE, DataGatheringMethod.GEMINI_DIRECT]
 # DATA_GATHERING_METHOD: list[DataGatheringMethod] = [DataGatheringMethod.GEMINI_DIRECT]
 
+NVD_FIXTURE_DIR: str = os.path.join(os.path.dirname(__file__), "fixtures", "nvd")
+NVD_FIXTURE_INITIAL: str = os.path.join(NVD_FIXTURE_DIR, "nvd_cves_initial.json")
+NVD_FIXTURE_UPDATE: str = os.path.join(NVD_FIXTURE_DIR, "nvd_cves_update.json")
+
 
 #################################
 # Tests
@@ -359,6 +411,1641 @@ def test_risk_calc_all_medium():
         assert False
 
 
+def test_risk_calc_all_high():
+    # The overall risk level should be HIGH, the same as in the batch scoring
+    risk_calculator: RiskCalculator = RiskCalculator("TestCSP", "Germany")
+
+    risk_calculator.set_risk_params_lack_of_control([CVEEntry("CVE-9999-2000", 9.8)] * 10)
+    risk_calculator.set_risk_params_insec_auth(False, False)
+    risk_calculator.set_risk_params_comp_issues(["Germany", "Unknown"], ["Unknown"])
+
+    risk_levels = score_risk_batch(RiskInputBatch.from_risk_calculators([risk_calculator]))
+    risk_calculator.get_risk()
+
+    assert risk_calculator.risk_lack_of_control == risk_calculator.risk_insec_auth == risk_calculator.risk_comp_issues == RiskLevel.HIGH
+    assert risk_calculator.risk_overall == RiskLevel.HIGH
+    assert risk_levels["risk_overall"][0] == risk_calculator.risk_overall.value
+
+
+# --- Test the batch assessment mode
+def test_batch_read_input(tmp_path):
+    # Comments, empty rows and rows without a country are ignored
+    input_file = tmp_path / "batch_input.csv"
+    input_file.write_text("# csp_name,user_country\nDropbox,Switzerland\n\nBox, Germany\nOnedrive\n")
+
+    if cra.read_batch_input(str(input_file)) == [("Dropbox", "Switzerland"), ("Box", "Germany")]:
+        assert True
+    else:
+        assert False
+
+
+def test_batch_assessment_offline(tmp_path, monkeypatch):
+    # The data-gathering functions are replaced, so that only the batch orchestration is tested.
+    # "Wikipedia" is no valid CSP, "Failing" raises an error. Both must not abort the batch.
+    def fake_is_valid_csp(csp_name, data_gathering_method, llm_test_mode=False):
+        if csp_name == "Failing":
+            raise RuntimeError("Simulated error")
+        return csp_name != "Wikipedia"
+
+    def fake_lack_of_control(risk_calculator, data_gathering_method, llm_test_mode=False, keep_details=False):
+        risk_calculator.set_risk_params_lack_of_control([CVEEntry("CVE-9999-1000", 1.1)])
+        return risk_calculator
+
+    def fake_insec_auth(risk_calculator, data_gathering_method, llm_test_mode=False):
+        risk_calculator.set_risk_params_insec_auth(True, True)
+        return risk_calculator
+
+    def fake_comp_issues(risk_calculator, data_gathering_method, llm_test_mode=False):
+        risk_calculator.set_risk_params_comp_issues(["Switzerland"], ["unknown"])
+        return risk_calculator
+
+    monkeypatch.setattr(cra, "is_valid_csp", fake_is_valid_csp)
+    monkeypatch.setattr(cra, "get_risk_data_lack_of_control", fake_lack_of_control)
+    monkeypatch.setattr(cra, "get_risk_data_insec_auth", fake_insec_auth)
+    monkeypatch.setattr(cra, "get_risk_data_comp_issues", fake_comp_issues)
+
+    input_file = tmp_path / "batch_input.csv"
+    input_file.write_text("Dropbox,Switzerland\nWikipedia,Switzerland\nFailing,Switzerland\n")
+    output_file = tmp_path / "batch_results.jsonl"
+
+    results = cra.run_batch_assessment(str(input_file), str(output_file), DataGatheringMethod.GEMINI_DIRECT, max_workers=2)
+
+    assert [result["csp_name"] for result in results] == ["Dropbox", "Wikipedia", "Failing"]
+    assert results[0]["valid_csp"] is True and results[0]["risk_insec_auth"] == RiskLevel.LOW.name
+    assert results[1]["valid_csp"] is False
+    assert "error" in results[2]
+    assert len(output_file.read_text().splitlines()) == 3
+
+
+# --- Test the research runner registry
+def test_runner_registry_reuses_runners(monkeypatch):
+    # The registry must create one runner per data-gathering method and reuse it until close() is called
+    registry = LLMResearcherRegistry()
+    monkeypatch.setattr(registry, "create_runner", lambda data_gathering_method: FakeResearcher())
+
+    runner_1 = registry.get_runner(DataGatheringMethod.GEMINI_DIRECT)
+    runner_2 = registry.get_runner(DataGatheringMethod.GEMINI_DIRECT)
+    runner_3 = registry.get_runner(DataGatheringMethod.GEMINI_SEARCH_SEPARATE)
+
+    assert runner_1 is runner_2
+    assert runner_1 is not runner_3
+    assert registry.get_setup_duration() >= 0.0
+
+    registry.close()
+
+    assert runner_1.closed and runner_3.closed
+    assert registry.get_runner(DataGatheringMethod.GEMINI_DIRECT) is not runner_1
+
+
+# --- Test the LLM answer cache
+def test_llm_cache_prompt_family():
+    # Formatted prompts must be mapped back to their prompt family (and its TTL)
+    answer_cache = LLMAnswerCache(":memory:")
+
+    assert answer_cache.get_prompt_family(prm.PROMT_CHECK_RISK_INSEC_AUTH_1_DATA_EXTRACT.format(csp="Dropbox")) == \
+        "PROMT_CHECK_RISK_INSEC_AUTH_1_DATA_EXTRACT"
+    assert answer_cache.get_prompt_family(prm.PROMT_CHECK_RISK_LACK_OF_CONTROL_DATA_EXTRACT.format(csp="Box", current_date="2025-01-01")) == \
+        "PROMT_CHECK_RISK_LACK_OF_CONTROL_DATA_EXTRACT"
+    assert answer_cache.get_prompt_family("Some other question") == "UNKNOWN"
+
+
+def test_llm_cache_hit_miss_expiry(tmp_path):
+    answer_cache = LLMAnswerCache(str(tmp_path / "llm_cache.db"), ttls={"PROMT_CHECK_CSP_DATA_EXTRACT": 0})
+    question_mfa = prm.PROMT_CHECK_RISK_INSEC_AUTH_1_DATA_EXTRACT.format(csp="Dropbox")
+    question_csp = prm.PROMT_CHECK_CSP_DATA_EXTRACT.format(csp="Dropbox")
+
+    assert answer_cache.get("GEMINI_DIRECT", "model", "", question_mfa) is None
+    answer_cache.put("GEMINI_DIRECT", "model", "", question_mfa, "90")
+    assert answer_cache.get("GEMINI_DIRECT", "model", "", question_mfa) == "90"
+
+    # The key contains the method and the model
+    assert answer_cache.get("GEMINI_SEARCH_SEPARATE", "model", "", question_mfa) is None
+    assert answer_cache.get("GEMINI_DIRECT", "other-model", "", question_mfa) is None
+
+    # A TTL of 0 expires the entry immediately
+    answer_cache.put("GEMINI_DIRECT", "model", "", question_csp, "100")
+    assert answer_cache.get("GEMINI_DIRECT", "model", "", question_csp) is None
+
+    # The cache is persistent
+    answer_cache.close()
+    assert LLMAnswerCache(str(tmp_path / "llm_cache.db")).get("GEMINI_DIRECT", "model", "", question_mfa) == "90"
+
+    stats = answer_cache.get_stats()
+    assert stats["hits"] == 1 and stats["misses"] == 4 and stats["expired"] == 1
+
+
+def test_llm_cache_lru_eviction():
+    answer_cache = LLMAnswerCache(":memory:", max_entries=2)
+
+    answer_cache.put("GEMINI_DIRECT", "model", "", "question 1", "1")
+    answer_cache.put("GEMINI_DIRECT", "model", "", "question 2", "2")
+
+    # Access "question 1", so that "question 2" becomes the least recently used entry
+    answer_cache.get("GEMINI_DIRECT", "model", "", "question 1")
+    answer_cache.put("GEMINI_DIRECT", "model", "", "question 3", "3")
+
+    assert answer_cache.get("GEMINI_DIRECT", "model", "", "question 1") == "1"
+    assert answer_cache.get("GEMINI_DIRECT", "model", "", "question 2") is None
+    assert answer_cache.get("GEMINI_DIRECT", "model", "", "question 3") == "3"
+    assert answer_cache.get_stats()["evictions"] == 1
+
+
+def test_llm_cache_researcher():
+    # The wrapped runner must only be asked once for the same question
+    fake_researcher = FakeResearcher("80")
+    cached_researcher = CachedLLMResearcher(fake_researcher, DataGatheringMethod.GEMINI_DIRECT, LLMAnswerCache(":memory:"))
+
+    assert cached_researcher.get_research_results("", "question", False) == "80"
+    fake_researcher.answer = "10"
+    assert cached_researcher.get_research_results("", "question", False) == "80"
+    assert cached_researcher.get_research_results("", "other question", False) == "10"
+
+
+def test_llm_cache_only_enabled_by_command_line(tmp_path, monkeypatch):
+    # Library callers (and the repeated live tests) always ask the LLM
+    assert cra.research_runner_registry.answer_cache is None
+
+    monkeypatch.chdir(tmp_path)
+
+    for argv, cache_enabled in [(["--gc-collections"], True), (["--gc-collections", "--no-cache"], False)]:
+        monkeypatch.setattr(cra, "research_runner_registry", LLMResearcherRegistry())
+        monkeypatch.setattr("sys.argv", ["analyser.py"] + argv)
+        cra.main()
+
+        assert (cra.research_runner_registry.answer_cache is not None) == cache_enabled
+        cra.research_runner_registry.close()
+
+
+# --- Test the local NVD mirror
+def test_nvd_mirror_keyword_search(tmp_path):
+    nvd_mirror = NVDMirror(str(tmp_path / "nvd_mirror.db"))
+    nvd_mirror.sync_from_files([NVD_FIXTURE_INITIAL])
+
+    # Matches in the description, vendor and product. Results are nvdlib CVE objects.
+    cves = nvd_mirror.search_keyword("Dropbox")
+    assert [cve.id for cve in cves] == ["CVE-9999-0004", "CVE-9999-0001", "CVE-9999-0002"]
+    assert cves[1].score == ["V31", 7.5, "HIGH"]
+
+    # Case-insensitive, all words must match
+    assert [cve.id for cve in nvd_mirror.search_keyword("box drive")] == ["CVE-9999-0003"]
+    assert nvd_mirror.search_keyword("Onedrive") == []
+
+    # Filter by publication date
+    assert [cve.id for cve in nvd_mirror.search_keyword("Dropbox", published_since=datetime(2024, 1, 1))] == ["CVE-9999-0002"]
+
+
+def test_nvd_mirror_cpe_search(tmp_path):
+    nvd_mirror = NVDMirror(str(tmp_path / "nvd_mirror.db"))
+    nvd_mirror.sync_from_files([NVD_FIXTURE_INITIAL])
+
+    cves = nvd_mirror.search_cpe("cpe:2.3:a:dropbox:dropbox:*:*:*:*:*:*:*:*")
+    assert [cve.id for cve in cves] == ["CVE-9999-0004", "CVE-9999-0001"]
+
+    cves = nvd_mirror.search_cpe("cpe:2.3:a:box:box_drive:2.0:*:*:*:*:macos:*:*")
+    assert [cve.id for cve in cves] == ["CVE-9999-0003"]
+
+
+def test_nvd_mirror_incremental_sync(tmp_path):
+    nvd_mirror = NVDMirror(str(tmp_path / "nvd_mirror.db"))
+
+    assert nvd_mirror.get_last_modified_mark() is None
+    nvd_mirror.sync_from_files([NVD_FIXTURE_INITIAL])
+    assert nvd_mirror.get_last_modified_mark() == datetime(2024, 6, 20, 12, 0)
+
+    # Updated CVEs replace the stored version, new CVEs are added
+    nvd_mirror.sync_from_files([NVD_FIXTURE_UPDATE])
+    assert nvd_mirror.get_last_modified_mark() == datetime(2025, 1, 5, 11, 0)
+    assert nvd_mirror.get_cve_count() == 5
+
+    cves = nvd_mirror.search_keyword("stored credentials")
+    assert [cve.id for cve in cves] == ["CVE-9999-0002"]
+    assert cves[0].score[1] == 8.1
+
+    # The old description must not be found anymore via the full-text index
+    assert len(nvd_mirror.search_keyword("Passwords")) == 1
+
+
+def test_cve_loader_streams_compact_records(tmp_path, monkeypatch):
+    # One compact record (and document) per CVE, with a shortened description
+    monkeypatch.setattr(cve_loader, "CVE_DESCRIPTION_MAX_LENGTH", 40)
+    nvd_mirror = NVDMirror(str(tmp_path / "nvd_mirror.db"))
+    nvd_mirror.sync_from_files([NVD_FIXTURE_INITIAL])
+
+    cve_records = list(CVELoader(nvd_mirror).iter_CVE_records_for_string("Box Drive"))
+
+    assert cve_records == [{"cve_id": "CVE-9999-0003", "published": "2024-02-02T09:30:00.000", "cvss_version": "V30",
+                            "cvss_score": 6.1, "vendors": ["box"], "products": ["box_drive"],
+                            "description": "Box Drive for macOS does not verify t..."}]
+
+    cve_document = get_cve_document(cve_records[0])
+    assert cve_document.page_content.startswith("CVE-9999-0003; published: 2024-02-02T09:30:00.000; CVSS score: 6.1")
+    assert cve_document.metadata["source"] == "https://nvd.nist.gov/vuln/detail/CVE-9999-0003"
+
+
+def test_cve_loader_streams_search_results(tmp_path, monkeypatch):
+    # The mirror is read in batches, and not locked while the CVEs are consumed
+    monkeypatch.setattr("nvd_mirror.NVD_MIRROR_FETCH_SIZE", 1)
+    nvd_mirror = NVDMirror(str(tmp_path / "nvd_mirror.db"))
+    nvd_mirror.sync_from_files([NVD_FIXTURE_INITIAL])
+
+    cve_stream = CVELoader(nvd_mirror).search_CVEs("Dropbox", published_since=datetime(2000, 1, 1))
+    assert next(cve_stream).id == "CVE-9999-0004"
+    assert nvd_mirror.get_cve_count() == 4
+    assert [cve.id for cve in cve_stream] == ["CVE-9999-0001", "CVE-9999-0002"]
+
+    # The NVD API is searched in publication windows of at most 120 days. The CVEs of a window are yielded before the next one is requested.
+    monkeypatch.delenv("NVD_MIRROR_DB", raising=False)
+    with open(NVD_FIXTURE_INITIAL) as infile:
+        vulnerabilities = json.load(infile)["vulnerabilities"]
+
+    requested_windows: list[tuple[datetime, datetime]] = []
+
+    def get_nvd_cve_page(parameters, start_index, api_key=None):
+        requested_windows.append((parameters["pubStartDate"], parameters["pubEndDate"]))
+        return {"totalResults": 1, "vulnerabilities": vulnerabilities[len(requested_windows) - 1:len(requested_windows)]}
+
+    monkeypatch.setattr("nvd_mirror.get_nvd_cve_page", get_nvd_cve_page)
+
+    published_since = datetime.now() - timedelta(days=300)
+    cve_stream = CVELoader().search_CVEs("Dropbox", published_since)
+    assert next(cve_stream).id == "CVE-9999-0001" and len(requested_windows) == 1
+    assert len(list(cve_stream)) == 2
+
+    assert len(requested_windows) == 3 and requested_windows[0][0] == published_since
+    assert all(window_end - window_start <= timedelta(days=120) for window_start, window_end in requested_windows)
+    assert all(earlier[1] == later[0] for earlier, later in zip(requested_windows, requested_windows[1:]))
+
+
+# --- Test the deterministic CVSS data-gathering for the 'lack of control' risk
+def test_cve_loader_cvss_entries(tmp_path):
+    nvd_mirror = NVDMirror(str(tmp_path / "nvd_mirror.db"))
+    nvd_mirror.sync_from_files([NVD_FIXTURE_INITIAL, NVD_FIXTURE_UPDATE])
+
+    cve_entries = CVELoader(nvd_mirror).get_CVE_entries_for_string("Dropbox", published_since=datetime(2024, 1, 1))
+
+    assert [(cve.cve_id, cve.cvss_score) for cve in cve_entries] == [("CVE-9999-0002", 8.1), ("CVE-9999-0005", 9.8)]
+
+
+def test_lack_of_control_cve_db_direct(tmp_path, monkeypatch):
+    # All fixture CVEs are considered: CVSS Score summary 29.7 -> should be CHEAP_AND_LAZY, risk MEDIUM
+    nvd_mirror = NVDMirror(str(tmp_path / "nvd_mirror.db"))
+    nvd_mirror.sync_from_files([NVD_FIXTURE_INITIAL, NVD_FIXTURE_UPDATE])
+    nvd_mirror.close()
+
+    monkeypatch.setenv("NVD_MIRROR_DB", str(tmp_path / "nvd_mirror.db"))
+    monkeypatch.setattr(cve_loader, "CVE_PUBLISHED_PERIOD", timedelta(days=100 * 365))
+
+    risk_calculator: RiskCalculator = RiskCalculator("Dropbox", "Switzerland")
+    risk_calculator = cra.get_risk_data_lack_of_control(risk_calculator, DataGatheringMethod.CVE_DB_DIRECT)
+
+    assert risk_calculator.cve_accumulator.count == 4
+    assert risk_calculator.get_risk_lack_of_control() == RiskLevel.MEDIUM
+
+
+# --- Test the streaming aggregation of CVEs
+def test_cve_accumulator_statistics():
+    cve_accumulator = CVEAccumulator(keep_details=True).add_all([CVEEntry("CVE-1", 9.8), CVEEntry("CVE-2", 0.0), CVEEntry("CVE-3", 10.0),
+                                                                 CVEEntry("CVE-4", 5.5)])
+
+    assert cve_accumulator.count == 4 and cve_accumulator.cvss_total == 25.3 and cve_accumulator.cvss_max == 10.0
+    assert cve_accumulator.cvss_histogram == [1, 0, 0, 0, 0, 1, 0, 0, 0, 2]
+    assert [(cve.cve_id, cve.cvss_score) for cve in cve_accumulator.get_entries()] == [("CVE-1", 9.8), ("CVE-2", 0.0), ("CVE-3", 10.0), ("CVE-4", 5.5)]
+
+    assert CVEAccumulator().cvss_max is None
+    with pytest.raises(ValueError):
+        CVEAccumulator().get_entries()
+
+
+def test_risk_calc_streams_cves():
+    # The CVEs are consumed from an iterator. Without details, only the aggregates are kept.
+    risk_calculator = RiskCalculator("TestCSP", "Switzerland")
+    risk_calculator.set_risk_params_lack_of_control((CVEEntry("CVE-9999-" + str(index), 0.005) for index in range(5000)), keep_details=False)
+
+    assert risk_calculator.get_risk_lack_of_control() == RiskLevel.MEDIUM
+    assert risk_calculator.cve_accumulator.cve_ids == [] and len(risk_calculator.cve_accumulator.cvss_scores) == 0
+
+    record = risk_calculator.get_result_record()
+    assert record["cve_count"] == 5000 and round(record["cvss_total"], 6) == 25.0 and record["cvss_histogram"][0] == 5000
+
+
+# --- Test the embedding cache and the deduplication of documents
+def test_embedding_cache_only_embeds_new_texts(tmp_path):
+    fake_embeddings = CountingFakeEmbedding(size=8)
+    cached_embeddings = get_cached_embeddings(fake_embeddings, "fake-model", str(tmp_path / "embedding_cache"))
+
+    vectors = cached_embeddings.embed_documents(["text 1", "text 2", "text 1"])
+    assert fake_embeddings.embedded_texts == ["text 1", "text 2"]
+    assert vectors[0] == vectors[2]
+
+    # The cache is persistent, and only new texts are embedded
+    cached_embeddings = get_cached_embeddings(fake_embeddings, "fake-model", str(tmp_path / "embedding_cache"))
+    assert cached_embeddings.embed_documents(["text 2", "text 3"])[0] == vectors[1]
+    assert fake_embeddings.embedded_texts == ["text 1", "text 2", "text 3"]
+
+    # The model name is part of the key
+    get_cached_embeddings(fake_embeddings, "other-model", str(tmp_path / "embedding_cache")).embed_documents(["text 1"])
+    assert fake_embeddings.embedded_texts == ["text 1", "text 2", "text 3", "text 1"]
+
+
+def test_embedding_span_only_counts_embedded_texts(tmp_path):
+    # Cache hits and duplicates are not counted as embedded documents
+    cached_embeddings = get_cached_embeddings(CountingFakeEmbedding(size=8), "fake-model", str(tmp_path / "embedding_cache"))
+
+    with start_trace("assessment") as trace:
+        cached_embeddings.embed_documents(["text 1", "text 2", "text 1"])
+        cached_embeddings.embed_documents(["text 2", "text 3"])
+        asyncio.run(cached_embeddings.aembed_documents(["text 1", "text 4"]))
+
+    embedding_spans = [embedding_span for embedding_span in trace.spans if embedding_span.name == "embedding"]
+    assert [embedding_span.metrics.get("documents_embedded", 0) for embedding_span in embedding_spans] == [2, 1, 1]
+
+
+def test_vectorstore_drops_duplicate_documents():
+    vectorstore = DedupingChroma(client=chromadb.EphemeralClient(), embedding_function=DeterministicFakeEmbedding(size=8),
+                                 collection_name="test_vectorstore_drops_duplicate_documents")
+
+    vectorstore.add_documents([Document(page_content="CVE-9999-0001"), Document(page_content="CVE-9999-0002"),
+                               Document(page_content="CVE-9999-0001")])
+    vectorstore.add_documents([Document(page_content="CVE-9999-0002"), Document(page_content="CVE-9999-0003")])
+
+    assert sorted(vectorstore.get()["documents"]) == ["CVE-9999-0001", "CVE-9999-0002", "CVE-9999-0003"]
+
+    vectorstore.delete_collection()
+
+
+# --- Test the persistent collections of the vector store
+def test_vector_store_collection_names():
+    assert get_collection_name("dropbox", "web") == "web_dropbox_v2"
+
+    # Names which would collide after normalization get a hash
+    assert get_collection_name("Google Drive", "web") != get_collection_name("google-drive", "web")
+    assert get_collection_name("Google Drive", "web").startswith("web_google-drive-")
+    assert len(get_collection_name("A" * 100, "cve")) <= 63
+
+
+def test_vector_store_reuse_and_expiry(tmp_path):
+    chroma_client = chromadb.PersistentClient(path=str(tmp_path / "chroma"))
+    vector_store_manager = VectorStoreManager(chroma_client, DeterministicFakeEmbedding(size=8))
+
+    vectorstore = vector_store_manager.get_vectorstore("Dropbox", "web")
+    vectorstore.add_documents([Document(page_content="Dropbox supports MFA")])
+    vector_store_manager.mark_researched(vectorstore, "Find out if Dropbox supports MFA.")
+
+    # A second assessment reuses the stored data
+    vectorstore = vector_store_manager.get_vectorstore("Dropbox", "web")
+    assert vector_store_manager.is_researched(vectorstore, "Find out if Dropbox supports MFA.")
+    assert not vector_store_manager.is_researched(vectorstore, "Find out if Dropbox supports SSO.")
+    assert vectorstore.get()["documents"] == ["Dropbox supports MFA"]
+
+    # After the TTL, the collection is rebuilt
+    vector_store_manager.ttls = {"web": 0}
+    vectorstore = vector_store_manager.get_vectorstore("Dropbox", "web")
+    assert not vector_store_manager.is_researched(vectorstore, "Find out if Dropbox supports MFA.")
+    assert vectorstore.get()["documents"] == []
+
+
+def test_vector_store_garbage_collection(tmp_path):
+    chroma_client = chromadb.PersistentClient(path=str(tmp_path / "chroma"))
+    vector_store_manager = VectorStoreManager(chroma_client, DeterministicFakeEmbedding(size=8), ttls={"web": 3600, "cve": 0})
+
+    vector_store_manager.get_vectorstore("Dropbox", "web")
+    vector_store_manager.get_vectorstore("Dropbox", "cve")
+    chroma_client.create_collection("orphaned-temporary-collection")
+
+    assert sorted(vector_store_manager.collect_garbage()) == ["cve_dropbox_v2", "orphaned-temporary-collection"]
+    assert [collection.name for collection in chroma_client.list_collections()] == ["web_dropbox_v2"]
+
+
+# --- Test the concurrent data-gathering
+def test_risk_data_stages_run_concurrently(monkeypatch):
+    # Each stage waits 0.3 seconds. Run concurrently, the data-gathering takes much less than the sum of the stages.
+    def fake_lack_of_control(risk_calculator, data_gathering_method, llm_test_mode=False, keep_details=False):
+        time.sleep(0.3)
+        risk_calculator.set_risk_params_lack_of_control([CVEEntry("CVE-9999-1000", 1.1)])
+        return risk_calculator
+
+    def fake_insec_auth(risk_calculator, data_gathering_method, llm_test_mode=False):
+        time.sleep(0.3)
+        risk_calculator.set_risk_params_insec_auth(True, True)
+        return risk_calculator
+
+    def fake_comp_issues(risk_calculator, data_gathering_method, llm_test_mode=False):
+        time.sleep(0.3)
+        risk_calculator.set_risk_params_comp_issues(["Switzerland"], ["unknown"])
+        return risk_calculator
+
+    monkeypatch.setattr(cra, "get_risk_data_lack_of_control", fake_lack_of_control)
+    monkeypatch.setattr(cra, "get_risk_data_insec_auth", fake_insec_auth)
+    monkeypatch.setattr(cra, "get_risk_data_comp_issues", fake_comp_issues)
+
+    risk_calculator = RiskCalculator("Dropbox", "Switzerland")
+
+    start_time = time.perf_counter()
+    cra.get_risk_data(risk_calculator, DataGatheringMethod.GEMINI_DIRECT, DataGatheringMethod.CVE_DB_DIRECT)
+    duration = time.perf_counter() - start_time
+
+    assert duration < 0.8
+    assert sorted(risk_calculator.stage_durations) == ["comp_issues", "insec_auth", "lack_of_control"]
+    assert all(stage_duration >= 0.3 for stage_duration in risk_calculator.stage_durations.values())
+    assert risk_calculator.get_risk_insec_auth() == RiskLevel.LOW
+    assert risk_calculator.get_risk_comp_issues() == RiskLevel.LOW
+
+
+def test_risk_data_stage_errors_are_raised(monkeypatch):
+    def fake_lack_of_control(risk_calculator, data_gathering_method, llm_test_mode=False, keep_details=False):
+        raise RuntimeError("Simulated error")
+
+    monkeypatch.setattr(cra, "get_risk_data_lack_of_control", fake_lack_of_control)
+    monkeypatch.setattr(cra, "get_risk_data_insec_auth", lambda risk_calculator, method, llm_test_mode=False, keep_details=False: risk_calculator)
+    monkeypatch.setattr(cra, "get_risk_data_comp_issues", lambda risk_calculator, method, llm_test_mode=False, keep_details=False: risk_calculator)
+
+    risk_calculator = RiskCalculator("Dropbox", "Switzerland")
+
+    with pytest.raises(RuntimeError):
+        cra.get_risk_data(risk_calculator, DataGatheringMethod.GEMINI_DIRECT)
+
+    assert "lack_of_control" in risk_calculator.stage_durations
+
+
+def test_insec_auth_questions_run_concurrently(monkeypatch):
+    research_runner = SlowFakeResearcher(delay=0.3)
+    monkeypatch.setattr(cra, "get_research_runner", lambda data_gathering_method: research_runner)
+
+    risk_calculator = RiskCalculator("Dropbox", "Switzerland")
+
+    start_time = time.perf_counter()
+    cra.get_risk_data_insec_auth(risk_calculator, DataGatheringMethod.GEMINI_DIRECT)
+    duration = time.perf_counter() - start_time
+
+    assert duration < 0.55
+    assert research_runner.call_count == 2
+    assert risk_calculator.get_risk_insec_auth() == RiskLevel.LOW
+
+
+# --- Test the async API
+def test_async_default_runs_sync_research():
+    research_runner = FakeResearcher("42")
+
+    assert asyncio.run(research_runner.aget_research_results("google", "extract")) == "42"
+
+
+def test_async_cached_researcher():
+    research_runner = SlowFakeResearcher(delay=0.0)
+    cached_research_runner = CachedLLMResearcher(research_runner, DataGatheringMethod.GEMINI_DIRECT, LLMAnswerCache(":memory:"))
+
+    async def ask_twice() -> list[str]:
+        return [await cached_research_runner.aget_research_results("google", "extract", csp_name="Dropbox") for _ in range(2)]
+
+    assert asyncio.run(ask_twice()) == ["100", "100"]
+    assert research_runner.call_count == 1
+
+
+def test_async_batch_assessment(tmp_path, monkeypatch):
+    # Each research call waits 0.2 seconds. All CSPs are assessed concurrently on one event loop.
+    research_runner = SlowFakeResearcher(delay=0.2)
+    monkeypatch.setattr(cra, "get_research_runner", lambda data_gathering_method: research_runner)
+
+    input_file = tmp_path / "batch_input.csv"
+    input_file.write_text("".join("CSP" + str(i) + ",Switzerland\n" for i in range(20)))
+    output_file = tmp_path / "batch_results.jsonl"
+
+    start_time = time.perf_counter()
+    results = asyncio.run(cra.arun_batch_assessment(str(input_file), str(output_file), DataGatheringMethod.GEMINI_DIRECT,
+                                                    max_concurrency=20, cve_data_gathering_method=DataGatheringMethod.GEMINI_CVE_DB))
+    duration = time.perf_counter() - start_time
+
+    # 20 CSPs with 5 research calls each would take 20 seconds sequentially
+    assert duration < 2.0
+    assert research_runner.call_count == 100
+    assert [result["csp_name"] for result in results] == ["CSP" + str(i) for i in range(20)]
+    assert all(result["valid_csp"] is True and result["risk_insec_auth"] == RiskLevel.LOW.name for result in results)
+    assert len(output_file.read_text().splitlines()) == 20
+
+
+# --- Test the batched question mode
+def test_batched_questions_structured_output():
+    research_runner = object.__new__(LLMResearcherGeminiDirect)
+    research_runner.llm = FakeStructuredLLM({"valid_csp": 90, "supports_mfa": 80, "supports_auth_protocols": 10})
+
+    results = research_runner.get_likelihood_results(cra.get_likelihood_questions("Dropbox"), csp_name="Dropbox")
+
+    assert results == {"valid_csp": "90", "supports_mfa": "80", "supports_auth_protocols": "10"}
+    assert research_runner.llm.structured_calls == 1 and research_runner.llm.calls == 0
+    assert "supports_mfa: Does Dropbox support MFA?" in research_runner.llm.prompts[0]
+
+
+def test_batched_questions_invalid_answer_falls_back():
+    # 150 is no valid likelihood. The questions are then asked one by one.
+    research_runner = object.__new__(LLMResearcherGeminiDirect)
+    research_runner.llm = FakeStructuredLLM({"valid_csp": 150, "supports_mfa": 80, "supports_auth_protocols": 10})
+
+    results = research_runner.get_likelihood_results(cra.get_likelihood_questions("Dropbox"), csp_name="Dropbox")
+
+    assert results == {"valid_csp": "80", "supports_mfa": "80", "supports_auth_protocols": "80"}
+    assert research_runner.llm.calls == 3
+
+
+def test_batched_questions_cached():
+    research_runner = SlowFakeResearcher(delay=0.0)
+    answer_cache = LLMAnswerCache(":memory:")
+    cached_research_runner = CachedLLMResearcher(research_runner, DataGatheringMethod.GEMINI_DIRECT, answer_cache)
+    questions = cra.get_likelihood_questions("Dropbox")
+
+    assert cached_research_runner.get_likelihood_results(questions) == {"valid_csp": "100", "supports_mfa": "100", "supports_auth_protocols": "100"}
+    assert cached_research_runner.get_likelihood_results(questions) == {"valid_csp": "100", "supports_mfa": "100", "supports_auth_protocols": "100"}
+    assert research_runner.call_count == 3
+    assert answer_cache.get_prompt_family(get_likelihood_prompt(questions)) == "PROMT_CHECK_LIKELIHOODS_DATA_EXTRACT"
+
+
+def test_batched_questions_assessment(monkeypatch):
+    research_runner = SlowFakeResearcher(delay=0.0)
+    monkeypatch.setattr(research_runner, "get_likelihood_results",
+                        lambda questions, csp_name=None: {"valid_csp": "90", "supports_mfa": "80", "supports_auth_protocols": "10"})
+    monkeypatch.setattr(cra, "get_research_runner", lambda data_gathering_method: research_runner)
+    monkeypatch.setattr(cra, "get_risk_data_lack_of_control", lambda risk_calculator, method, llm_test_mode=False, keep_details=False: risk_calculator)
+
+    risk_calculator = cra.assess_csp("Dropbox", "Switzerland", DataGatheringMethod.GEMINI_DIRECT, batched_questions=True)
+
+    # Only the 'comp issues' question is asked separately
+    assert research_runner.call_count == 1
+    assert risk_calculator.csp_supports_mfa is True and risk_calculator.csp_supports_auth_protocols is False
+
+
+# --- Test the page fetcher of the web research
+def test_page_fetcher_http_cache(tmp_path, local_http_server):
+    urls = [local_http_server.url + "/page1", local_http_server.url + "/page2"]
+
+    page_fetcher = PageFetcher(str(tmp_path / "page_cache.db"))
+    documents = page_fetcher.get_documents(urls)
+    assert [document.metadata["source"] for document in documents] == urls
+    assert "Content of /page1" in documents[0].page_content
+
+    # Fresh pages are taken from the cache without a request
+    page_fetcher.get_documents(urls)
+    assert page_fetcher.get_stats()["fetches"] == 2 and page_fetcher.get_stats()["cache_hits"] == 2
+    page_fetcher.close()
+
+    # Expired pages are revalidated with their ETag. The server answers with "304 Not Modified".
+    page_fetcher = PageFetcher(str(tmp_path / "page_cache.db"), max_age=0)
+    documents = page_fetcher.get_documents(urls)
+    assert "Content of /page2" in documents[1].page_content
+    assert page_fetcher.get_stats()["not_modified"] == 2
+    assert local_http_server.conditional_requests == 2
+    page_fetcher.close()
+
+
+def test_page_fetcher_text_cache_and_errors(tmp_path, local_http_server):
+    # /same1 and /same2 have the same content. /missing returns "404 Not Found" and is skipped.
+    # The pages are fetched one after another, so that /same2 is fetched after the text of /same1 was stored.
+    page_fetcher = PageFetcher(str(tmp_path / "page_cache.db"), max_workers=1)
+    documents = page_fetcher.get_documents([local_http_server.url + "/same1", local_http_server.url + "/missing",
+                                            local_http_server.url + "/same2"])
+
+    assert [document.metadata["source"] for document in documents] == [local_http_server.url + "/same1", local_http_server.url + "/same2"]
+    assert page_fetcher.get_stats()["text_cache_hits"] == 1
+    assert page_fetcher.get_stats()["errors"] == 1
+    page_fetcher.close()
+
+
+def test_page_fetcher_not_modified_without_cached_page(tmp_path, local_http_server):
+    # "304 Not Modified" for a page which is not cached is an error. The empty body must not be stored as the page text.
+    page_fetcher = PageFetcher(str(tmp_path / "page_cache.db"))
+
+    assert page_fetcher.get_page_text(local_http_server.url + "/not-modified") is None
+    assert page_fetcher.get_page_text(local_http_server.url + "/not-modified") is None
+    assert page_fetcher.get_stats()["errors"] == 2 and page_fetcher.get_stats()["not_modified"] == 0
+    page_fetcher.close()
+
+
+def test_page_fetcher_per_host_limit(tmp_path, local_http_server):
+    page_fetcher = PageFetcher(str(tmp_path / "page_cache.db"), max_workers=6, max_per_host=2)
+    documents = page_fetcher.get_documents([local_http_server.url + "/slow" + str(i) for i in range(6)])
+
+    assert len(documents) == 6
+    assert local_http_server.max_concurrent_requests == 2
+    page_fetcher.close()
+
+
+def test_pooled_web_research_retriever(tmp_path, local_http_server):
+    page_fetcher = PageFetcher(str(tmp_path / "page_cache.db"))
+    vectorstore = DedupingChroma(client=chromadb.EphemeralClient(), embedding_function=DeterministicFakeEmbedding(size=8),
+                                 collection_name="web_research_test")
+
+    retriever = PooledWebResearchRetriever.from_page_fetcher(
+                    page_fetcher,
+                    llm=FakeListLLM(responses=["1. Does Dropbox support MFA?\n2. Does Dropbox support SSO?\n"]),
+                    vectorstore=vectorstore,
+                    search=FakeSearch.model_construct(links=[local_http_server.url + "/page1", local_http_server.url + "/page2"]),
+                    allow_dangerous_requests=True,
+                    num_search_results=2
+                )
+    documents = retriever.invoke("Find out if Dropbox supports MFA.")
+
+    assert len(documents) > 0
+    assert sorted(retriever.url_database) == [local_http_server.url + "/page1", local_http_server.url + "/page2"]
+    assert page_fetcher.get_stats()["fetches"] == 2
+    vectorstore.delete_collection()
+    page_fetcher.close()
+
+
+# --- Test the search-result cache
+def test_search_cache_normalize_query():
+    assert normalize_query('1. "Does Dropbox support MFA?"') == "does dropbox support mfa"
+    assert normalize_query("does  Dropbox support MFA") == "does dropbox support mfa"
+
+
+def test_search_cache_avoids_searches(tmp_path):
+    search = FakeSearch.model_construct(links=["https://www.dropbox.com/features/security", "https://help.dropbox.com/account-access"])
+    cached_search = CachedGoogleSearchAPIWrapper(search_wrapper=search, search_cache=SearchResultCache(str(tmp_path / "search_cache.db")))
+
+    results = cached_search.results('1. "Does Dropbox support MFA?"', 2)
+    assert cached_search.results("does dropbox support MFA", 2) == results
+    assert search.calls == 1
+
+    # The number of results is part of the key
+    cached_search.results("does dropbox support MFA", 1)
+    assert search.calls == 2
+
+    assert cached_search.search_cache.get_stats()["searches_avoided"] == 1
+    assert cached_search.search_cache.get_stats()["searches_sent"] == 2
+
+
+def test_search_cache_expiry_and_empty_results(tmp_path):
+    search = FakeSearch.model_construct(links=[])
+    cached_search = CachedGoogleSearchAPIWrapper(search_wrapper=search, search_cache=SearchResultCache(str(tmp_path / "search_cache.db"), ttl=0))
+
+    # "No good result" answers are not cached
+    assert cached_search.results("does dropbox support MFA", 2) == [{"Result": "No good Google Search Result was found"}]
+    cached_search.results("does dropbox support MFA", 2)
+    assert search.calls == 2
+
+    search.links = ["https://www.dropbox.com/features/security"]
+    cached_search.results("does dropbox support SSO", 2)
+    cached_search.results("does dropbox support SSO", 2)
+    assert search.calls == 4
+    assert cached_search.search_cache.get_stats()["expired"] == 1
+
+
+# --- Test the rate limiters of the backends
+def test_rate_limiter_token_bucket():
+    rate_limiter = AdaptiveRateLimiter("test", requests_per_second=20, max_bucket_size=1)
+
+    start_time = time.perf_counter()
+    for _ in range(6):
+        rate_limiter.acquire_token()
+
+    # The first token is available immediately, the other 5 arrive every 0.05 seconds
+    assert time.perf_counter() - start_time >= 0.24
+    assert rate_limiter.acquire_token(blocking=False) is False
+
+
+def test_rate_limiter_aimd_on_rate_limit_errors():
+    rate_limiter = AdaptiveRateLimiter("test", requests_per_second=1000, max_bucket_size=1000, max_concurrency=8, backoff=0.01)
+    responses = [RateLimitError(), RateLimitError(), "ok"]
+
+    def rate_limited_request() -> str:
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    # Both errors arrive within the cooldown, so the concurrency is only halved once
+    assert rate_limiter.call(rate_limited_request) == "ok"
+    assert rate_limiter.get_stats()["rate_limited"] == 2 and rate_limiter.get_stats()["retries"] == 2
+    assert rate_limiter.get_stats()["concurrency_limit"] == 4
+
+    # Additive increase: one more concurrent request per round of successful requests
+    for _ in range(5):
+        rate_limiter.call(lambda: "ok")
+    assert rate_limiter.get_stats()["concurrency_limit"] == 5
+
+    # Other errors are not retried
+    with pytest.raises(ValueError):
+        rate_limiter.call(lambda: int("no number"))
+
+
+def test_rate_limiter_latency_spike():
+    rate_limiter = AdaptiveRateLimiter("test", requests_per_second=1000, max_bucket_size=1000, max_concurrency=8)
+
+    for _ in range(5):
+        rate_limiter.call(time.sleep, 0.01)
+    rate_limiter.call(time.sleep, 0.2)
+
+    assert rate_limiter.get_stats()["latency_spikes"] == 1
+    assert rate_limiter.get_stats()["concurrency_limit"] == 4
+
+
+def test_rate_limiter_concurrency_limit():
+    rate_limiter = AdaptiveRateLimiter("test", requests_per_second=1000, max_bucket_size=1000, max_concurrency=2)
+    in_flight = [0, 0]
+    lock = threading.Lock()
+
+    def request() -> None:
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        time.sleep(0.05)
+        with lock:
+            in_flight[0] -= 1
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        list(executor.map(lambda i: rate_limiter.call(request), range(6)))
+
+    assert in_flight[1] == 2
+
+
+def test_rate_limiter_config(monkeypatch):
+    monkeypatch.delenv("NVD_API_KEY", raising=False)
+    monkeypatch.delenv("RATE_LIMIT_NVD_RPS", raising=False)
+    assert get_rate_limit_config("nvd")["requests_per_second"] == 5 / 30
+
+    monkeypatch.setenv("RATE_LIMIT_NVD_RPS", "1.5")
+    monkeypatch.setenv("RATE_LIMIT_NVD_CONCURRENCY", "2")
+    assert get_rate_limit_config("nvd")["requests_per_second"] == 1.5
+    assert get_rate_limit_config("nvd")["max_concurrency"] == 2
+
+
+def test_rate_limiter_nvd_pages(monkeypatch):
+    # Each result page of an NVD search takes its own token, and the slot is released between the pages
+    rate_limiter = AdaptiveRateLimiter("nvd", requests_per_second=20, max_bucket_size=1, max_concurrency=4)
+    monkeypatch.setitem(rate_limiters, "nvd", rate_limiter)
+    monkeypatch.delenv("NVD_MIRROR_DB", raising=False)
+
+    with open(NVD_FIXTURE_INITIAL) as infile:
+        vulnerabilities = json.load(infile)["vulnerabilities"]
+
+    request_times: list[float] = []
+    request_lock = threading.Lock()
+
+    def get_nvd_cve_page(parameters, start_index, api_key=None):
+        with request_lock:
+            request_times.append(time.monotonic())
+        return {"totalResults": len(vulnerabilities), "vulnerabilities": vulnerabilities[start_index:start_index + 1]}
+
+    monkeypatch.setattr("nvd_mirror.get_nvd_cve_page", get_nvd_cve_page)
+
+    cve_stream = CVELoader().iter_source_CVEs_for_string("Dropbox")
+    assert next(cve_stream).id == "CVE-9999-0001"
+    assert rate_limiter.in_flight == 0
+    assert len(list(cve_stream)) == 3
+
+    # Two concurrent streams together stay below the rate of the limiter
+    request_times.clear()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        streams = list(executor.map(lambda i: [cve.id for cve in CVELoader().iter_source_CVEs_for_string("Dropbox")], range(2)))
+
+    assert streams[0] == streams[1] and len(streams[0]) == 4
+    assert len(request_times) == 8 and rate_limiter.get_stats()["requests"] == 12
+    assert all(later - earlier >= 0.9 / 20 for earlier, later in zip(request_times, request_times[1:]))
+
+
+def test_rate_limiter_langchain_chat_model():
+    rate_limiter = AdaptiveRateLimiter("test", requests_per_second=1000, max_bucket_size=1000)
+    langchain_rate_limiter = LangchainRateLimiter(rate_limiter)
+    llm = GenericFakeChatModel(messages=iter(["80", "90"]), rate_limiter=langchain_rate_limiter,
+                               callbacks=[RateLimitCallbackHandler(langchain_rate_limiter)])
+
+    assert llm.invoke("Does Dropbox support MFA?").content == "80"
+    assert asyncio.run(llm.ainvoke("Does Dropbox support SSO?")).content == "90"
+    assert rate_limiter.get_stats()["requests"] == 2
+    assert rate_limiter.in_flight == 0
+
+
+def test_rate_limiter_langchain_cancelled_request():
+    # The slot of a cancelled async request is returned, although langchain reports no end or error of the run
+    rate_limiter = AdaptiveRateLimiter("test", requests_per_second=1000, max_bucket_size=1000, max_concurrency=1)
+    langchain_rate_limiter = LangchainRateLimiter(rate_limiter)
+    llm = SlowFakeChatModel(delay=10, rate_limiter=langchain_rate_limiter, callbacks=[RateLimitCallbackHandler(langchain_rate_limiter)])
+
+    async def cancel_request() -> None:
+        request_task = asyncio.create_task(llm.ainvoke("Does Dropbox support MFA?"))
+        while rate_limiter.in_flight == 0:
+            await asyncio.sleep(0.01)
+
+        request_task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await request_task
+
+    asyncio.run(cancel_request())
+    assert rate_limiter.in_flight == 0 and rate_limiter.get_stats()["rate_limited"] == 0
+
+    # The next request gets the (only) slot
+    llm.delay = 0
+    assert asyncio.run(llm.ainvoke("Does Dropbox support SSO?")).content == "80"
+    assert rate_limiter.in_flight == 0 and rate_limiter.get_stats()["requests"] == 2
+
+
+def test_rate_limit_error_detection():
+    response = requests.Response()
+    response.status_code = 429
+
+    assert is_rate_limit_error(requests.HTTPError(response=response))
+    assert is_rate_limit_error(RateLimitError())
+    assert not is_rate_limit_error(ValueError("no rate limit"))
+
+
+# --- Test the instrumentation (spans and traces)
+def test_instrumentation_spans_and_json_export(tmp_path, monkeypatch):
+    monkeypatch.setattr(trace_collector, "trace_directory", str(tmp_path))
+
+    def fetch_page(size: int) -> None:
+        with span("fetch"):
+            instrumentation.add_span_metrics(bytes_fetched=size)
+
+    with start_trace("assessment", csp_name="Dropbox") as trace:
+        with span("stage:comp_issues") as stage_span:
+            # Spans of other threads are added to the span of the caller
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                list(executor.map(propagate_context(fetch_page), [100, 200]))
+
+    trace_files = list(tmp_path.glob("trace_Dropbox_*.json"))
+    assert len(trace_files) == 1
+
+    exported_trace = json.loads(trace_files[0].read_text())
+    fetch_spans = [exported_span for exported_span in exported_trace["spans"] if exported_span["name"] == "fetch"]
+    assert exported_trace["trace_id"] == trace.trace_id
+    assert all(fetch_span["parent_id"] == stage_span.span_id for fetch_span in fetch_spans)
+    assert sorted(fetch_span["metrics"]["bytes_fetched"] for fetch_span in fetch_spans) == [100, 200]
+    assert all(exported_span["duration"] is not None for exported_span in exported_trace["spans"])
+
+
+def test_instrumentation_without_trace():
+    # Outside of a trace, nothing is recorded
+    with span("stage:comp_issues") as stage_span:
+        instrumentation.add_span_metrics(bytes_fetched=100)
+
+    assert stage_span is None
+
+
+def test_instrumentation_span_percentiles():
+    traces = []
+    for duration in range(1, 11):
+        trace = Trace("assessment", {})
+        trace.duration = duration
+        stage_span = Span("stage:insec_auth", None, {})
+        stage_span.duration = duration / 10
+        stage_span.metrics = {"tokens_in": 10}
+        trace.add_span(stage_span)
+        traces.append(trace)
+
+    span_percentiles = get_span_percentiles(traces)
+
+    assert span_percentiles["assessment"]["count"] == 10
+    assert span_percentiles["assessment"]["p50"] == 5 and span_percentiles["assessment"]["p90"] == 9
+    assert span_percentiles["assessment"]["max"] == 10
+    assert span_percentiles["stage:insec_auth"]["p99"] == 1.0
+    assert span_percentiles["stage:insec_auth"]["tokens_in"] == 100
+
+
+def test_instrumentation_llm_tokens():
+    llm = GenericFakeChatModel(messages=iter([AIMessage(content="80", usage_metadata={"input_tokens": 12, "output_tokens": 1,
+                                                                                      "total_tokens": 13})]))
+
+    with start_trace("assessment") as trace:
+        assert llm.invoke("Does Dropbox support MFA?", config=get_instrumentation_config()).content == "80"
+
+    assert [trace_span.name for trace_span in trace.spans] == ["llm_generation"]
+    assert trace.spans[0].metrics == {"tokens_in": 12, "tokens_out": 1}
+
+
+def test_instrumentation_page_fetcher(tmp_path, local_http_server):
+    page_fetcher = PageFetcher(str(tmp_path / "page_cache.db"))
+
+    with start_trace("assessment") as trace:
+        page_fetcher.get_documents([local_http_server.url + "/page1", local_http_server.url + "/page2"])
+        page_fetcher.get_documents([local_http_server.url + "/page1"])
+
+    page_fetch_spans = [trace_span for trace_span in trace.spans if trace_span.name == "page_fetch"]
+    assert page_fetch_spans[0].metrics["pages_fetched"] == 2 and page_fetch_spans[0].metrics["bytes_fetched"] > 0
+    assert page_fetch_spans[1].metrics == {"page_cache_hits": 1}
+    page_fetcher.close()
+
+
+def test_instrumentation_batch_assessment(tmp_path, monkeypatch):
+    research_runner = SlowFakeResearcher(delay=0.0)
+    monkeypatch.setattr(cra, "get_research_runner", lambda data_gathering_method: research_runner)
+    monkeypatch.setattr(trace_collector, "trace_directory", str(tmp_path))
+
+    input_file = tmp_path / "batch_input.csv"
+    input_file.write_text("Dropbox,Switzerland\nBox,Germany\n")
+
+    cra.run_batch_assessment(str(input_file), str(tmp_path / "batch_results.jsonl"), DataGatheringMethod.GEMINI_DIRECT, max_workers=2,
+                             cve_data_gathering_method=DataGatheringMethod.GEMINI_CVE_DB)
+
+    assert len(list(tmp_path.glob("trace_*.json"))) == 2
+
+    batch_summary = json.loads((tmp_path / cra.BATCH_TRACE_SUMMARY_FILE).read_text())
+    assert batch_summary["assessment"]["count"] == 2
+    stage_names = ["valid_csp", "stage:lack_of_control", "stage:insec_auth", "stage:comp_issues"]
+    assert all(batch_summary[stage_name]["count"] == 2 for stage_name in stage_names)
+
+
+# --- Test the offline benchmarks
+def test_benchmark_nvd_stand_in(monkeypatch):
+    monkeypatch.delenv("NVD_MIRROR_DB", raising=False)
+    set_default_nvd_mirror(benchmark.BenchmarkNVDMirror(cve_count=25))
+
+    try:
+        cve_entries = CVELoader().get_CVE_entries_for_string("BenchmarkCSP0")
+    finally:
+        set_default_nvd_mirror(None)
+
+    assert len(cve_entries) == 25
+    assert CVELoader().nvd_mirror is None
+
+
+def test_benchmark_cold_and_warm_caches(tmp_path):
+    original_registry = cra.research_runner_registry
+
+    results = benchmark.run_benchmark([1], [10], ["cold", "warm"], str(tmp_path))
+
+    assert cra.research_runner_registry is original_registry
+    assert [result["caches"] for result in results] == ["cold", "warm"]
+    assert all(result["throughput_per_minute"] > 0 and result["peak_memory_mb"] > 0 for result in results)
+    assert sorted(results[0]["stage_latency"]) == sorted(benchmark.BENCHMARK_STAGES)
+    assert results[0]["latency"]["p50"] <= results[0]["latency"]["p99"] <= results[0]["latency"]["max"]
+
+    # With warm caches, all LLM answers are taken from the answer cache
+    assert results[0]["runners"]["GEMINI_SEARCH_SEPARATE"]["page_fetcher"]["fetches"] > 0
+    assert results[1]["answer_cache"]["misses"] == 0
+    assert results[1]["runners"]["GEMINI_SEARCH_SEPARATE"]["page_fetcher"]["fetches"] == 0
+
+
+def test_atomic_file_store(tmp_path):
+    file_store = AtomicLocalFileStore(str(tmp_path))
+    file_store.mset([("key1", b"value1"), ("key1", b"value2")])
+
+    assert file_store.mget(["key1", "key2"]) == [b"value2", None]
+    assert [path.name for path in tmp_path.iterdir()] == ["key1"]
+
+
+# --- Test the record-and-replay cassettes
+def test_cassette_chat_model_record_and_replay(tmp_path):
+    cassette_file = str(tmp_path / "cassette.json.gz")
+    likelihood_answer = AIMessage(content="", tool_calls=[{"name": "LikelihoodAnswers", "id": "1",
+                                                          "args": {"valid_csp": 90, "supports_mfa": 80, "supports_auth_protocols": 10}}])
+
+    recording_cassette = Cassette(cassette_file, "record")
+    recording_runner = LLMResearcherGeminiDirect(llm=CassetteChatModel(
+                            cassette=recording_cassette, model_name="fake-model",
+                            chat_model=GenericFakeChatModel(messages=iter([AIMessage(content="90"), likelihood_answer]))))
+    recorded_answer = recording_runner.get_research_results("", "Is Dropbox a cloud storage service?", False)
+    recorded_likelihoods = recording_runner.get_likelihood_results(cra.get_likelihood_questions("Dropbox"))
+    recording_cassette.save()
+
+    # No chat model is needed for the replay
+    replaying_cassette = Cassette(cassette_file)
+    replaying_runner = LLMResearcherGeminiDirect(llm=CassetteChatModel(cassette=replaying_cassette, model_name="fake-model"))
+
+    assert replaying_runner.get_research_results("", "Is Dropbox a cloud storage service?", False) == recorded_answer == "90"
+    assert replaying_runner.get_likelihood_results(cra.get_likelihood_questions("Dropbox")) == recorded_likelihoods
+    assert recorded_likelihoods == {"valid_csp": "90", "supports_mfa": "80", "supports_auth_protocols": "10"}
+    assert replaying_cassette.get_stats()["replayed"] == 2
+
+    with pytest.raises(LookupError):
+        replaying_runner.get_research_results("", "Is Box a cloud storage service?", False)
+
+
+def test_cassette_search_pages_and_embeddings(tmp_path, local_http_server):
+    cassette_file = str(tmp_path / "cassette.json.gz")
+    urls = [local_http_server.url + "/page1", local_http_server.url + "/missing"]
+
+    recording_cassette = Cassette(cassette_file, "record")
+    search = CassetteGoogleSearchAPIWrapper(cassette=recording_cassette, search_wrapper=FakeSearch.model_construct(links=urls))
+    page_fetcher = CassettePageFetcher(recording_cassette, str(tmp_path / "page_cache.db"))
+    embeddings = CassetteEmbeddings(recording_cassette, "fake-model", DeterministicFakeEmbedding(size=8))
+
+    recorded_results = search.results("Does Dropbox support MFA?", 2)
+    recorded_documents = page_fetcher.get_documents(urls)
+    recorded_embeddings = embeddings.embed_documents(["text1", "text2"]) + [embeddings.embed_query("text1")]
+    page_fetcher.close()
+    recording_cassette.save()
+
+    # The replay needs neither the search, nor the web server, nor the embedding model
+    replaying_cassette = Cassette(cassette_file)
+    search = CassetteGoogleSearchAPIWrapper(cassette=replaying_cassette)
+    page_fetcher = CassettePageFetcher(replaying_cassette, ":memory:")
+    embeddings = CassetteEmbeddings(replaying_cassette, "fake-model")
+
+    assert search.results("Does Dropbox support MFA?", 2) == recorded_results
+    assert page_fetcher.get_documents(urls) == recorded_documents
+    assert len(recorded_documents) == 1 and page_fetcher.get_stats()["fetches"] == 0
+    # The embeddings are stored as float32
+    replayed_embeddings = embeddings.embed_documents(["text2", "text1"]) + [embeddings.embed_query("text1")]
+    assert replayed_embeddings[0] == pytest.approx(recorded_embeddings[1], rel=1e-6)
+    assert replayed_embeddings[1] == pytest.approx(recorded_embeddings[0], rel=1e-6)
+    assert replayed_embeddings[2] == pytest.approx(recorded_embeddings[2], rel=1e-6)
+
+
+def test_cassette_nvd_record_and_replay(tmp_path, monkeypatch):
+    cassette_file = str(tmp_path / "cassette.json.gz")
+    nvd_mirror = NVDMirror(str(tmp_path / "nvd_mirror.db"))
+    nvd_mirror.sync_from_files([NVD_FIXTURE_INITIAL, NVD_FIXTURE_UPDATE])
+
+    set_active_cassette(Cassette(cassette_file, "record"))
+    try:
+        recorded_entries = CVELoader(nvd_mirror).get_CVE_entries_for_string("Dropbox")
+        recorded_records = list(CVELoader(nvd_mirror).iter_CVE_records_for_string("Dropbox"))
+        save_active_cassette()
+
+        # Replay without mirror and without access to the NVD API
+        monkeypatch.delenv("NVD_MIRROR_DB", raising=False)
+        monkeypatch.setattr(cve_loader.nvdlib, "searchCVE", None)
+        monkeypatch.setattr("nvd_mirror.get_nvd_cve_page", None)
+        set_active_cassette(Cassette(cassette_file))
+
+        assert [(cve.cve_id, cve.cvss_score) for cve in CVELoader().get_CVE_entries_for_string("Dropbox")] == \
+            [(cve.cve_id, cve.cvss_score) for cve in recorded_entries]
+        assert list(CVELoader().iter_CVE_records_for_string("Dropbox")) == recorded_records
+        assert len(recorded_records) == 4
+    finally:
+        set_active_cassette(None)
+
+
+def test_cassette_registry_replay_without_api_keys(tmp_path, monkeypatch):
+    monkeypatch.delenv("GOOGLE_API_KEY", raising=False)
+    Cassette(str(tmp_path / "cassette.json.gz"), "record").save()
+
+    set_active_cassette(Cassette(str(tmp_path / "cassette.json.gz")))
+    registry = LLMResearcherRegistry()
+    try:
+        for data_gathering_method in [DataGatheringMethod.GEMINI_SEARCH_SEPARATE, DataGatheringMethod.GEMINI_DIRECT]:
+            assert isinstance(registry.get_runner(data_gathering_method).llm, CassetteChatModel)
+    finally:
+        registry.close()
+        set_active_cassette(None)
+
+    with pytest.raises(ValueError):
+        Cassette(str(tmp_path / "cassette.json.gz"), "rewind")
+
+
+# --- Test the lazy backend imports (cold start of the CLI)
+def test_import_time_of_analyser():
+    # Not even langchain_core is imported (e.g. by the cassette models, the callbacks or the rate-limiter adapters)
+    assert "langchain_core" in benchmark.BENCHMARK_LAZY_MODULES
+    import_time = benchmark.measure_import_time("analyser")
+
+    assert import_time["lazy_modules_loaded"] == []
+    assert import_time["import_time"] < benchmark.BENCHMARK_IMPORT_TIME_BUDGET
+
+
+def test_backends_only_import_their_dependencies():
+    # The direct method needs neither the vector store, nor the web research, nor the NVD
+    assert benchmark.measure_import_time("llm_researcher_direct", 1)["lazy_modules_loaded"] == ["langchain_core", "langchain_google_genai"]
+    assert benchmark.measure_import_time("cve_loader", 1)["lazy_modules_loaded"] == ["nvdlib"]
+
+
+# --- Test the daemon mode (local assessment service)
+def test_service_runs_assessments_with_warm_runners(monkeypatch):
+    # The runners are created once (warm-up) and shared by all assessments. The result can be polled and streamed.
+    registry = LLMResearcherRegistry()
+    created_runners: list[DataGatheringMethod] = []
+    monkeypatch.setattr(registry, "create_runner", lambda data_gathering_method: created_runners.append(data_gathering_method) or FakeResearcher())
+
+    def fake_assess(csp_name, user_country, data_gathering_method, cve_data_gathering_method, batched_questions):
+        registry.get_runner(data_gathering_method)
+        time.sleep(0.2)
+        if csp_name == "Failing":
+            return {"csp_name": csp_name, "user_country": user_country, "valid_csp": None, "error": "RuntimeError()"}
+        return {"csp_name": csp_name, "user_country": user_country, "valid_csp": True}
+
+    service = AssessmentService(fake_assess, registry, max_workers=2)
+    service.warm_up([DataGatheringMethod.GEMINI_DIRECT])
+
+    with running_service(service) as url:
+        response = requests.post(url + "/assessments", json={"csp_name": "Dropbox", "user_country": "Switzerland", "method": 2})
+        assert response.status_code == 202 and response.json()["status"] in ["queued", "running"]
+        job_id = response.json()["id"]
+
+        events = [json.loads(line) for line in requests.get(url + "/assessments/" + job_id + "/events", stream=True).iter_lines() if line]
+        assert events[-1]["status"] == "done" and events[-1]["result"]["valid_csp"] is True
+
+        failing_id = requests.post(url + "/assessments", json={"csp_name": "Failing", "user_country": "Switzerland", "method": 2}).json()["id"]
+        failing_job = requests.get(url + "/assessments/" + failing_id + "?wait=5").json()
+        assert failing_job["status"] == "failed" and "error" in failing_job["result"]
+
+        health = requests.get(url + "/health").json()["service"]
+        assert health["submitted"] == 2 and health["pending"] == 0 and health["warm_runners"] == ["GEMINI_DIRECT"]
+
+    assert created_runners == [DataGatheringMethod.GEMINI_DIRECT]
+
+
+def test_service_rejects_invalid_requests_and_full_queue():
+    # The queue is bounded: further submissions are rejected with 503, until the pending assessments are finished
+    release = threading.Event()
+
+    def blocked_assess(csp_name, user_country, data_gathering_method, cve_data_gathering_method, batched_questions):
+        release.wait(5)
+        return {"csp_name": csp_name, "user_country": user_country, "valid_csp": True}
+
+    service = AssessmentService(blocked_assess, LLMResearcherRegistry(), max_workers=1, max_queue=2)
+
+    with running_service(service) as url:
+        assert requests.post(url + "/assessments", json={"user_country": "Switzerland"}).status_code == 400
+        assert requests.post(url + "/assessments", json={"csp_name": "Box", "user_country": "Switzerland", "method": 4}).status_code == 400
+        assert requests.get(url + "/assessments/unknown").status_code == 404
+
+        statuses = [requests.post(url + "/assessments", json={"csp_name": "Box", "user_country": "Switzerland"}).status_code for _ in range(3)]
+        assert statuses == [202, 202, 503]
+
+        release.set()
+        assert all(job.wait(5) for job in list(service.jobs.values()))
+        assert requests.post(url + "/assessments", json={"csp_name": "Box", "user_country": "Switzerland"}).status_code == 202
+
+
+# --- Test the jurisdiction index
+def test_jurisdiction_index_lookups():
+    # ISO codes, aliases, accents, case and punctuation are normalized
+    assert [jurisdiction_index.lookup(name) for name in ["Czechia", "Czech Republic", "CZE", "cz", "Deutschland", " GERMANY ", "U.S.A.", "usa",
+                                                         "United States of America", "Côte d’Ivoire", "the Netherlands", "Türkiye"]] == \
+        ["CZ", "CZ", "CZ", "CZ", "DE", "DE", "US", "US", "US", "CI", "NL", "TR"]
+    assert jurisdiction_index.lookup("Narnia") is None and jurisdiction_index.get_country_key("Narnia") == "narnia"
+    assert jurisdiction_index.is_unknown("Unknown") and jurisdiction_index.is_unknown("N/A") and not jurisdiction_index.is_unknown("Namibia")
+
+    assert jurisdiction_index.is_in_group("Norway", JURISDICTION_GDPR) and jurisdiction_index.is_in_group("Norway", JURISDICTION_EEA)
+    assert not jurisdiction_index.is_in_group("Switzerland", JURISDICTION_GDPR)
+    assert jurisdiction_index.get_groups("Switzerland") == [JURISDICTION_EU_ADEQUACY]
+    assert jurisdiction_index.get_country_name("DE") == "Germany"
+    assert JurisdictionIndex(groups={}).lookup("unknown") == UNKNOWN_COUNTRY
+
+
+def test_risk_calc_comp_issues_country_aliases():
+    # Different names of the same countries must end up in the same branches
+    def get_risk_comp_issues(user_country: str, csp_default_countries: list[str]) -> RiskLevel:
+        risk_calculator = RiskCalculator("TestCSP", user_country)
+        risk_calculator.set_risk_params_comp_issues(csp_default_countries, ["unknown"])
+        return risk_calculator.get_risk_comp_issues()
+
+    assert get_risk_comp_issues("Germany", ["Deutschland"]) == RiskLevel.LOW
+    assert get_risk_comp_issues("germany", ["DE", "Germany"]) == RiskLevel.LOW
+    assert get_risk_comp_issues("Germany", ["Czechia", "FR"]) == RiskLevel.MEDIUM_LOW
+    assert get_risk_comp_issues("Austria", ["Norway"]) == RiskLevel.MEDIUM_LOW
+    assert get_risk_comp_issues("Germany", ["USA", "United States"]) == RiskLevel.MEDIUM
+    assert get_risk_comp_issues("Germany", ["USA", "Germany"]) == RiskLevel.HIGH
+    assert get_risk_comp_issues("Germany", ["Not specified"]) == RiskLevel.HIGH
+
+
+def test_risk_calc_comp_issues_jurisdiction_groups():
+    # Names of the EU and the EEA are GDPR-only locations
+    assert [jurisdiction_index.get_country_key(name) for name in ["EU", "European Union", "Europe", "E.U.", "EEA"]] == \
+        [JURISDICTION_EU, JURISDICTION_EU, JURISDICTION_EU, JURISDICTION_EU, JURISDICTION_EEA]
+    assert jurisdiction_index.get_groups("EU") == [JURISDICTION_EU, JURISDICTION_EEA, JURISDICTION_GDPR]
+    assert jurisdiction_index.get_country_name(JURISDICTION_EU) == "European Union"
+
+    risk_calculator = RiskCalculator("TestCSP", "Germany")
+    risk_calculator.set_risk_params_comp_issues(["EU"], ["unknown"])
+    assert risk_calculator.get_risk_comp_issues() == RiskLevel.MEDIUM_LOW
+
+    risk_calculator.set_risk_params_comp_issues(["European Economic Area", "France"], ["unknown"])
+    assert risk_calculator.get_risk_comp_issues() == RiskLevel.MEDIUM_LOW
+
+    risk_calculator.set_risk_params_comp_issues(["Europe", "USA"], ["unknown"])
+    assert risk_calculator.get_risk_comp_issues() == RiskLevel.HIGH
+
+    risk_calculator = RiskCalculator("TestCSP", "Switzerland")
+    risk_calculator.set_risk_params_comp_issues(["EU"], ["unknown"])
+    assert risk_calculator.get_risk_comp_issues() == RiskLevel.MEDIUM
+
+
+# --- Test the vectorized batch scorer
+def test_batch_scorer_matches_risk_calculator():
+    # All combinations of the inputs (including missing ones) must result in the same risk levels as RiskCalculator.get_risk()
+    cve_lists = [None, [], [CVEEntry("CVE-1", 20.0)], [CVEEntry("CVE-1", 10.0), CVEEntry("CVE-2", 15.5)], [CVEEntry("CVE-1", 50.0), CVEEntry("CVE-2", 0.1)]]
+    auth_flags = [None, (False, False), (True, False), (False, True), (True, True)]
+    country_lists = [None, [], ["unknown"], ["Switzerland"], ["Germany"], ["Germany", "France"], ["Germany", "USA"], ["Germany", "Unknown"],
+                     ["USA"], ["Switzerland", "Germany"], ["Deutschland", "Czechia"], ["USA", "United States"], ["N/A"], ["Norway"],
+                     ["EU"], ["Europe", "Norway"], ["EEA", "USA"]]
+    user_countries = ["", "Switzerland", "Germany", "USA", "deutschland", "EU"]
+
+    risk_calculators: list[RiskCalculator] = []
+    for cve_list, auth_flag, country_list, user_country in itertools.product(cve_lists, auth_flags, country_lists, user_countries):
+        risk_calculator = RiskCalculator("CSP", user_country)
+        if cve_list is not None:
+            risk_calculator.cve_list = cve_list
+        if auth_flag is not None:
+            risk_calculator.csp_supports_mfa, risk_calculator.csp_supports_auth_protocols = auth_flag
+        if country_list is not None:
+            risk_calculator.csp_default_countries = country_list
+        risk_calculators.append(risk_calculator)
+
+    risk_levels = score_risk_batch(RiskInputBatch.from_risk_calculators(risk_calculators))
+
+    for index, risk_calculator in enumerate(risk_calculators):
+        risk_calculator.get_risk()
+
+        assert risk_levels["risk_lack_of_control"][index] == risk_calculator.risk_lack_of_control.value
+        assert risk_levels["risk_insec_auth"][index] == risk_calculator.risk_insec_auth.value
+        assert risk_levels["risk_comp_issues"][index] == risk_calculator.risk_comp_issues.value
+        assert risk_levels["risk_overall"][index] == risk_calculator.risk_overall.value
+
+
+def test_batch_scorer_thresholds_and_records():
+    # What-if run with other CVSS thresholds. Records of invalid CSPs and failed assessments are not changed.
+    records = [
+        {"csp_name": "A", "user_country": "Germany", "valid_csp": True, "cvss_total": 30.0, "csp_supports_mfa": True,
+         "csp_supports_auth_protocols": False, "csp_default_countries": ["Germany"], "risk_lack_of_control": "MEDIUM"},
+        {"csp_name": "B", "user_country": "Germany", "valid_csp": False},
+        {"csp_name": "C", "user_country": "Germany", "valid_csp": None, "error": "RuntimeError()"},
+        {"csp_name": "D", "user_country": "Germany", "valid_csp": True, "cvss_total": None, "csp_supports_mfa": False,
+         "csp_supports_auth_protocols": False, "csp_default_countries": ["USA", "Germany"]}
+    ]
+
+    assert get_risk_level_names(score_risk_batch(RiskInputBatch.from_records(records[:1]), 40.0, 60.0)["risk_lack_of_control"]) == ["LOW"]
+
+    rescored_records = rescore_records(records, 10.0, 25.0)
+    assert rescored_records[0]["risk_lack_of_control"] == "HIGH" and rescored_records[0]["risk_overall"] == "MEDIUM"
+    assert rescored_records[1:3] == records[1:3]
+    assert rescored_records[3]["risk_lack_of_control"] == "NA" and rescored_records[3]["risk_comp_issues"] == "HIGH"
+    assert rescored_records[3]["risk_overall"] == "NA"
+    assert records[0]["risk_lack_of_control"] == "MEDIUM"
+
+
+# --- Test the incremental reassessment from assessment snapshots
+def test_assessment_store_snapshots(tmp_path):
+    store = AssessmentStore(str(tmp_path / "snapshots.db"))
+
+    snapshot = store.get(" Dropbox ")
+    assert snapshot.dimensions == {} and not snapshot.is_fresh("valid_csp", "GEMINI_DIRECT")
+
+    snapshot.set_value("valid_csp", True, "GEMINI_DIRECT")
+    snapshot.set_value("comp_issues", {"csp_default_countries": ["USA"]}, "GEMINI_DIRECT")
+    store.put(snapshot)
+    store.close()
+
+    # Snapshots are keyed by the CSP name (case-insensitive). Inputs of another method or beyond their maximum age are stale.
+    snapshot = store.get("dropbox")
+    assert snapshot.get_value("comp_issues") == {"csp_default_countries": ["USA"]}
+    assert snapshot.is_fresh("valid_csp", "GEMINI_DIRECT") and not snapshot.is_fresh("valid_csp", "GEMINI_SEARCH_SEPARATE")
+    assert not snapshot.is_fresh("comp_issues", "GEMINI_DIRECT", time.time() + assessment_store.SNAPSHOT_MAX_AGES["comp_issues"])
+
+    store.put(snapshot)
+    assert store.get_stats()["refreshed"]["valid_csp"] == 1 and store.get_stats()["reused"]["valid_csp"] == 1
+
+    # Changed CVEs replace their records, CVEs published before the period are removed
+    cve_records = [["CVE-1", "2024-01-01T00:00:00", 5.0], ["CVE-2", "2020-01-01T00:00:00", 7.0], ["CVE-3", "2024-03-01T00:00:00", 4.0]]
+    changed_cve_records = [["CVE-3", "2024-03-01T00:00:00", 6.5], ["CVE-4", "2024-02-01T00:00:00", None]]
+    assert merge_cve_records(cve_records, changed_cve_records, datetime(2023, 1, 1)) == [
+        ["CVE-1", "2024-01-01T00:00:00", 5.0], ["CVE-4", "2024-02-01T00:00:00", None], ["CVE-3", "2024-03-01T00:00:00", 6.5]]
+
+
+def test_reassessment_refreshes_only_changed_inputs(tmp_path, monkeypatch):
+    nvd_mirror = NVDMirror(str(tmp_path / "nvd_mirror.db"))
+    nvd_mirror.sync_from_files([NVD_FIXTURE_INITIAL])
+    monkeypatch.setenv("NVD_MIRROR_DB", str(tmp_path / "nvd_mirror.db"))
+    monkeypatch.setattr(cve_loader, "CVE_PUBLISHED_PERIOD", timedelta(days=100 * 365))
+
+    researcher = SlowFakeResearcher(0)
+    registry = LLMResearcherRegistry()
+    monkeypatch.setattr(registry, "create_runner", lambda data_gathering_method: researcher)
+    monkeypatch.setattr(cra, "research_runner_registry", registry)
+
+    nvd_searches: list[datetime | None] = []
+    search_CVEs = CVELoader.search_CVEs
+
+    def spy_search_CVEs(self, search_string, published_since=None, modified_since=None):
+        nvd_searches.append(modified_since)
+        return search_CVEs(self, search_string, published_since, modified_since)
+
+    monkeypatch.setattr(CVELoader, "search_CVEs", spy_search_CVEs)
+
+    store = AssessmentStore(str(tmp_path / "snapshots.db"))
+
+    def reassess() -> dict:
+        return cra.get_batch_result_record("Dropbox", "Germany", DataGatheringMethod.GEMINI_DIRECT, DataGatheringMethod.CVE_DB_DIRECT,
+                                           assessment_store=store)
+
+    # First assessment: all inputs are gathered
+    record = reassess()
+    assert researcher.call_count == 4 and nvd_searches == [None]
+    assert record["cve_count"] == 3 and record["risk_overall"] is not None
+
+    # Nothing changed: no research request, and no NVD query
+    assert reassess() == {**record, "duration_seconds": ANY, "stage_durations": ANY}
+    assert researcher.call_count == 4 and nvd_searches == [None]
+
+    # Only the CVEs modified since the lastModified mark of the snapshot are requested, and merged into the snapshot
+    nvd_mirror.sync_from_files([NVD_FIXTURE_UPDATE])
+    nvd_mirror.close()
+
+    record = reassess()
+    assert researcher.call_count == 4 and nvd_searches == [None, datetime(2024, 6, 20, 12, 0)]
+
+    full_cve_entries = CVELoader().get_CVE_entries_for_string("Dropbox")
+    assert record["cve_count"] == len(full_cve_entries) == 4
+    assert record["cvss_total"] == pytest.approx(sum(cve.cvss_score for cve in full_cve_entries))
+    assert store.get_stats()["incremental"]["lack_of_control"] == 1
+
+    # A stale input is gathered again
+    monkeypatch.setitem(assessment_store.SNAPSHOT_MAX_AGES, "comp_issues", 0)
+    reassess()
+    assert researcher.call_count == 5
+    assert store.get_stats()["refreshed"]["comp_issues"] == 2 and store.get_stats()["reused"]["insec_auth"] == 3
+
+
+# --- Test the metadata-filtered retrieval of CVE documents
+def test_cve_documents_have_retrieval_metadata():
+    cve_record = {"cve_id": "CVE-9999-0002", "published": "2024-06-10T08:00:00.000", "cvss_version": "V31", "cvss_score": 8.1,
+                  "vendors": ["dropbox"], "products": ["passwords"], "description": "Cross-site scripting in Dropbox Passwords"}
+
+    metadata = get_cve_document(cve_record, "Dropbox").metadata
+    assert metadata["published_ts"] == datetime(2024, 6, 10, 8, 0).timestamp()
+    assert metadata["vendors"] == "dropbox" and metadata["vendor_match"] == "match"
+
+    # All words of the search string must be in the vendors or products. CVEs without CPEs are not analysed yet.
+    assert get_vendor_match(["box"], ["box_drive"], "Box Drive") == "match"
+    assert get_vendor_match(["acme"], ["dropbox_sync_plugin"], "Google Drive") == "other"
+    assert get_vendor_match([], [], "Dropbox") == "unknown"
+
+
+def test_cve_retrieval_filters_by_date_and_vendor(tmp_path, monkeypatch):
+    nvd_mirror = NVDMirror(str(tmp_path / "nvd_mirror.db"))
+    nvd_mirror.sync_from_files([NVD_FIXTURE_INITIAL, NVD_FIXTURE_UPDATE])
+    monkeypatch.setenv("CVE_RETRIEVAL_K", "10")
+    set_default_nvd_mirror(nvd_mirror)
+
+    try:
+        runner = LLMResearcherGeminiCVE(FakeListLLM(responses=["unused"]), DeterministicFakeEmbedding(size=8),
+                                        chromadb.PersistentClient(path=str(tmp_path / "chroma")),
+                                        published_period=datetime.now() - datetime(2024, 1, 1))
+        vectorstore = runner.get_question_vectorstore("Dropbox")
+        runner.load_cve_research(vectorstore, "Dropbox", "Dropbox")
+    finally:
+        set_default_nvd_mirror(None)
+
+    # A CVE of another vendor, which only mentions the CSP
+    vectorstore.add_documents([get_cve_document({"cve_id": "CVE-9999-0006", "published": "2024-08-01T00:00:00.000", "cvss_version": "V31",
+                                                 "cvss_score": 9.0, "vendors": ["acme"], "products": ["cloud_sync"],
+                                                 "description": "Acme Cloud Sync leaks Dropbox tokens"}, "Dropbox")])
+
+    # Only CVEs published in the period and not of other vendors are retrieved (CVE-9999-0001 and 0004 are older)
+    assert runner.retrieval_k == 10
+    retrieved_documents = runner.get_retriever(vectorstore).invoke("CVEs of Dropbox")
+    assert sorted(document.metadata["cve_id"] for document in retrieved_documents) == ["CVE-9999-0002", "CVE-9999-0005"]
+
+    runner.vendor_filter = False
+    assert len(runner.get_retriever(vectorstore).invoke("CVEs of Dropbox")) == 3
+
+    runner.retrieval_k = 1
+    assert len(runner.get_retriever(vectorstore).invoke("CVEs of Dropbox")) == 1
+
+
+# --- Test the context compression and token budgets
+def test_context_compression_keeps_relevant_sentences():
+    # The question type is derived from the question
+    assert get_question_type(prm.PROMT_CHECK_CSP_DATA_EXTRACT.format(csp="Dropbox")) == "valid_csp"
+    assert get_question_type(prm.PROMT_CHECK_RISK_INSEC_AUTH_1_DATA_EXTRACT.format(csp="Dropbox")) == "mfa"
+    assert get_question_type(prm.PROMT_CHECK_RISK_INSEC_AUTH_2_DATA_EXTRACT.format(csp="Dropbox")) == "sso"
+    assert get_question_type(prm.PROMT_CHECK_RISK_COMP_ISSUES_1_DATA_EXTRACT.format(csp="Dropbox")) == "data_location"
+    assert get_question_type(prm.PROMT_CHECK_RISK_LACK_OF_CONTROL_DATA_EXTRACT.format(csp="Dropbox", current_date="2024-06-01")) == "cve"
+    assert get_question_type("What is the price of Dropbox?") == "default"
+
+    documents = [Document(page_content="Dropbox was founded in 2007. Users can enable two-step verification in the settings.\n"
+                                       "The company is based in San Francisco.", metadata={"source": "https://example.com/1"}),
+                 Document(page_content="Pricing starts at 10 dollars. An authenticator app or a security key can be used.",
+                          metadata={"source": "https://example.com/2"})]
+
+    compressed_documents = compress_documents(documents, "mfa", 1000)
+    assert [document.page_content for document in compressed_documents] == [
+        "Users can enable two-step verification in the settings.", "An authenticator app or a security key can be used."]
+    assert compressed_documents[1].metadata == {"source": "https://example.com/2"}
+
+    # The budget limits the context, the most relevant sentence is always kept
+    assert len(compress_documents(documents, "mfa", 15)) == 1
+    assert compress_documents(documents, "mfa", 5)[0].page_content == "Users can enable two-step verification in the settings."[:20]
+
+    # Without relevant sentences, the documents are kept as they are. Records are not split.
+    assert [document.page_content for document in compress_documents(documents, "sso", 1000)] == [
+        "Dropbox was founded in 2007. Users can enable two-step verification in the settings. The company is based in San Francisco.",
+        documents[1].page_content]
+    assert compress_documents(documents, "cve", 1000) == [Document(page_content=document.page_content, metadata=document.metadata)
+                                                          for document in documents]
+
+
+def test_compressing_retriever_reports_context_tokens(tmp_path):
+    vectorstore = DedupingChroma(client=chromadb.PersistentClient(path=str(tmp_path / "chroma")), embedding_function=DeterministicFakeEmbedding(size=8),
+                                 collection_name="test_compressing_retriever")
+    vectorstore.add_documents([Document(page_content="Dropbox offers file sync. " * 20 + "Dropbox supports SAML single sign-on.",
+                                        metadata={"source": "https://example.com/sso"}),
+                               Document(page_content="Dropbox stores data in the United States. " * 40, metadata={"source": "https://example.com/dc"})])
+
+    question = prm.PROMT_CHECK_RISK_INSEC_AUTH_2_DATA_EXTRACT.format(csp="Dropbox")
+
+    with start_trace("assessment") as trace:
+        with span("llm_extraction"):
+            documents = get_compressing_retriever(vectorstore.as_retriever(search_kwargs={"k": 2})).invoke(question)
+
+    assert [document.page_content for document in documents] == ["Dropbox supports SAML single sign-on."]
+
+    extraction_span = next(trace_span for trace_span in trace.spans if trace_span.name == "llm_extraction")
+    assert extraction_span.metrics["compressed_context_tokens"] == estimate_tokens("Dropbox supports SAML single sign-on.")
+    assert extraction_span.metrics["context_tokens"] > 20 * extraction_span.metrics["compressed_context_tokens"]
+
+    # The budgets are per question type
+    documents = get_compressing_retriever(vectorstore.as_retriever(search_kwargs={"k": 2}), {**CONTEXT_TOKEN_BUDGETS, "data_location": 30}).invoke(
+        prm.PROMT_CHECK_RISK_COMP_ISSUES_1_DATA_EXTRACT.format(csp="Dropbox"))
+    assert sum(estimate_tokens(document.page_content) for document in documents) <= 30
+
+    vectorstore.delete_collection()
+
+
+def test_context_compression_only_enabled_by_command_line(tmp_path, monkeypatch):
+    # Without --compress-context, the prompts (and the recorded cassettes) are unchanged
+    assert cra.research_runner_registry.context_compression is False
+    monkeypatch.delenv("GOOGLE_API_KEY", raising=False)
+    monkeypatch.chdir(tmp_path)
+
+    for argv, compression_enabled in [(["--gc-collections"], False), (["--gc-collections", "--compress-context"], True)]:
+        monkeypatch.setattr(cra, "research_runner_registry", LLMResearcherRegistry())
+        monkeypatch.setattr("sys.argv", ["analyser.py", "--no-cache"] + argv)
+        cra.main()
+
+        assert cra.research_runner_registry.context_compression is compression_enabled
+
+        # The runners are created with the setting of the registry
+        Cassette(str(tmp_path / "cassette.json.gz"), "record").save()
+        set_active_cassette(Cassette(str(tmp_path / "cassette.json.gz")))
+        try:
+            for data_gathering_method in [DataGatheringMethod.GEMINI_SEARCH_SEPARATE, DataGatheringMethod.GEMINI_CVE_DB]:
+                assert cra.research_runner_registry.get_runner(data_gathering_method).context_compression is compression_enabled
+        finally:
+            cra.research_runner_registry.close()
+            set_active_cassette(None)
+
+
 #################################
 # Shared Functions
 #################################
+class FakeResearcher(LLMResearcher):
+    # Research runner which returns a fixed answer, without calling any external service
+    def __init__(self, answer: str = "100") -> None:
+        self.answer = answer
+        self.closed = False
+
+    def get_research_results(self, question_google: str, question_data_extract: str, llm_test_mode: bool, csp_name: str | None = None) -> str:
+        return self.answer
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class SlowFakeResearcher(FakeResearcher):
+    # Research runner which waits before answering, to simulate the latency of the LLM
+    def __init__(self, delay: float) -> None:
+        super().__init__()
+        self.delay = delay
+        self.call_count = 0
+        self.lock = threading.Lock()
+
+    def get_research_results(self, question_google: str, question_data_extract: str, llm_test_mode: bool, csp_name: str | None = None) -> str:
+        with self.lock:
+            self.call_count += 1
+
+        time.sleep(self.delay)
+        return self.answer
+
+    async def aget_research_results(self, question_google: str, question_data_extract: str, csp_name: str | None = None) -> str:
+        with self.lock:
+            self.call_count += 1
+
+        await asyncio.sleep(self.delay)
+        return self.answer
+
+
+class SlowFakeChatModel(BaseChatModel):
+    # Async chat model, which answers "80" after a delay
+    delay: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow-fake"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        raise NotImplementedError("Only async requests are supported")
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="80"))])
+
+
+class RateLimitError(Exception):
+    # Error of a backend with the status "429 Too Many Requests"
+    code = 429
+
+
+class FakeStructuredLLM():
+    # Chat model which returns a fixed structured answer, and "80" for all other questions
+    def __init__(self, structured_answer: dict[str, int]) -> None:
+        self.structured_answer = structured_answer
+        self.structured_calls = 0
+        self.calls = 0
+        self.prompts: list[str] = []
+
+    def with_structured_output(self, schema):
+        def get_structured_answer(prompt: str):
+            self.structured_calls += 1
+            self.prompts.append(prompt)
+            return schema(**self.structured_answer)
+
+        return RunnableLambda(get_structured_answer)
+
+    def invoke(self, prompt: str, config=None) -> AIMessage:
+        self.calls += 1
+        return AIMessage(content="80")
+
+
+class CountingFakeEmbedding(DeterministicFakeEmbedding):
+    # Fake embedding model which records all texts sent to it
+    embedded_texts: list[str] = []
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.embedded_texts.extend(texts)
+        return super().embed_documents(texts)
+
+
+class FakeSearch(GoogleSearchAPIWrapper):
+    # Google search, which returns the same links for every query
+    links: list[str] = []
+    calls: int = 0
+
+    def results(self, query: str, num_results: int, search_params: dict | None = None) -> list[dict]:
+        self.calls += 1
+
+        if len(self.links) == 0:
+            return [{"Result": "No good Google Search Result was found"}]
+
+        return [{"title": link, "link": link} for link in self.links[:num_results]]
+
+
+class LocalHTTPRequestHandler(BaseHTTPRequestHandler):
+    # Serves generated pages with an ETag. "/slow..." pages take 0.2 seconds, "/same..." pages have the same content.
+    # "/not-modified" always answers "304 Not Modified".
+    def do_GET(self) -> None:
+        server = self.server
+
+        with server.lock:
+            server.concurrent_requests += 1
+            server.max_concurrent_requests = max(server.max_concurrent_requests, server.concurrent_requests)
+
+        try:
+            if self.path.startswith("/slow"):
+                time.sleep(0.2)
+
+            if self.path == "/missing":
+                self.send_error(404)
+                return
+
+            if self.headers.get("If-None-Match") == "\"v1\"" or self.path == "/not-modified":
+                with server.lock:
+                    server.conditional_requests += 1
+                self.send_response(304)
+                self.end_headers()
+                return
+
+            content = "/same" if self.path.startswith("/same") else self.path
+            body = ("<html><body><h1>Content of " + content + "</h1><p>Some text.</p></body></html>").encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", "\"v1\"")
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.concurrent_requests -= 1
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def local_http_server():
+    # Local stand-in for the web servers of the web research
+    server = ThreadingHTTPServer(("127.0.0.1", 0), LocalHTTPRequestHandler)
+    server.lock = threading.Lock()
+    server.concurrent_requests = 0
+    server.max_concurrent_requests = 0
+    server.conditional_requests = 0
+    server.url = "http://127.0.0.1:" + str(server.server_address[1])
+
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+@contextmanager
+def running_service(service: AssessmentService):
+    # Run the HTTP API of the assessment service on a free local port
+    server = AssessmentHTTPServer(("127.0.0.1", 0), service)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+
+    try:
+        yield "http://127.0.0.1:" + str(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()